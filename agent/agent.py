@@ -23,14 +23,28 @@ sessionS_tabN_loadedLS: dict = {}     # session_id -> tab_id -> [text]
 sessionS_proxy_credentials: dict = {} # session_id -> {host:port -> {username, password}}
 import asyncio
 clients_lock = asyncio.Lock()
+import contextvars
+request_timing = contextvars.ContextVar('request_timing', default=None)  # phase -> seconds, of the api request being handled
 
 from typing import Optional
 from functools import wraps
 from fastapi import HTTPException
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, contextmanager
 import uiautomation as uia
 uia.SetGlobalSearchTimeout(1)
 
+@contextmanager
+def fun_timed(phase: str):
+    """Add the time spent in the block to a phase (uia, chrome) of the api request being handled."""
+    import time
+    timing = request_timing.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timing is not None:
+            timing[phase] = timing.get(phase, 0.0) + time.perf_counter() - started
+
 def require_params(*param_names):
     """Decorator to check required parameters in kwargs or data body."""
     def decorator(func):
@@ -117,18 +131,19 @@ async def fun_chrome_start(session_id: str, proxy: Optional[str],extension:bool=
         args.append(f'--proxy-server={proxy}')
     if extension:
         args.append(f'--load-extension={ext_path}')
-    chrome_process = subprocess.Popen(
-        executable=chrome_path,
-        args=args
-    )
-    sessionS_processO[session_id] = chrome_process
-    websocket_cfm = False
-    import asyncio
-    for _ in range(25):
-        await asyncio.sleep(0.200)
-        if session_id in sessionS_websocketO:
-            websocket_cfm = True
-            break
+    with fun_timed('chrome'):
+        chrome_process = subprocess.Popen(
+            executable=chrome_path,
+            args=args
+        )
+        sessionS_processO[session_id] = chrome_process
+        websocket_cfm = False
+        import asyncio
+        for _ in range(25):
+            await asyncio.sleep(0.200)
+            if session_id in sessionS_websocketO:
+                websocket_cfm = True
+                break
     if not extension or websocket_cfm:
         return chrome_process
     else:
@@ -147,9 +162,10 @@ async def fun_query_tabs(session_id: str):
     req = {r'id': id, r'command': r'Request.queryTabs'}
     import json
     text = json.dumps(req)
-    await chrome_websocket.send_text(text)
-    logger.debug(f'websocket send:{chrome_websocket.client.host} {chrome_websocket.client.port}\r\n{text}')
-    text = await fun_wait_reply(id)
+    with fun_timed('chrome'):
+        await chrome_websocket.send_text(text)
+        logger.debug(f'websocket send:{chrome_websocket.client.host} {chrome_websocket.client.port}\r\n{text}')
+        text = await fun_wait_reply(id)
     if text is None:
         logger.error("fun_wait_reply did not return a response for id: %s", id)
         return None
@@ -164,10 +180,11 @@ def fun_find_window(session_id: str):
     if not chrome_process:
         return
     chrome_window = None
-    desktop_windows = uia.GetRootControl().GetChildren()
-    for win in desktop_windows:
-        if win.ProcessId == chrome_process.pid:
-            chrome_window = win
+    with fun_timed('uia'):
+        desktop_windows = uia.GetRootControl().GetChildren()
+        for win in desktop_windows:
+            if win.ProcessId == chrome_process.pid:
+                chrome_window = win
     return chrome_window
 
 async def fun_session_maximize(session_id: str) -> Optional[str]:
@@ -177,14 +194,15 @@ async def fun_session_maximize(session_id: str) -> Optional[str]:
     chrome_window = fun_find_window(session_id)
     if not chrome_window:
         return
-    chrome_window.SetFocus()
-    try:
-        chrome_window.Maximize()  # type: ignore
-    except AttributeError:
-        logger.warning("chrome_window has no Maximize method")
-    title = None
-    chrome_document = chrome_window.DocumentControl()
-    title = chrome_document.Name
+    with fun_timed('uia'):
+        chrome_window.SetFocus()
+        try:
+            chrome_window.Maximize()  # type: ignore
+        except AttributeError:
+            logger.warning("chrome_window has no Maximize method")
+        title = None
+        chrome_document = chrome_window.DocumentControl()
+        title = chrome_document.Name
     return title
 
 async def fun_session_go(session_id: str, url: str) -> Optional[str]:
@@ -194,26 +212,30 @@ async def fun_session_go(session_id: str, url: str) -> Optional[str]:
     chrome_window = fun_find_window(session_id)
     if not chrome_window:
         return
-    chrome_window.SetFocus()
-    chrome_window.SendKeys(r'{Ctrl}L')
-    chrome_window.SendKeys(url)
-    chrome_window.SendKeys(r'{Enter}')
+    with fun_timed('uia'):
+        chrome_window.SetFocus()
+        chrome_window.SendKeys(r'{Ctrl}L')
+        chrome_window.SendKeys(url)
+        chrome_window.SendKeys(r'{Enter}')
     loaded_cfm = False
     import asyncio
-    for _ in range(50):
-        await asyncio.sleep(0.200)
-        try:
-            reload_button = chrome_window.ToolBarControl().GetChildren()[2].GetChildren()[2]
-            if reload_button.Name in reload_button.GetLegacyIAccessiblePattern().Description:
-                loaded_cfm = True
-                logger.info("reload button ready")
-                break
-        except Exception as e:
-            logger.info("check reload button error")
+    # Page load, polled on the reload button
+    with fun_timed('chrome'):
+        for _ in range(50):
+            await asyncio.sleep(0.200)
+            try:
+                reload_button = chrome_window.ToolBarControl().GetChildren()[2].GetChildren()[2]
+                if reload_button.Name in reload_button.GetLegacyIAccessiblePattern().Description:
+                    loaded_cfm = True
+                    logger.info("reload button ready")
+                    break
+            except Exception as e:
+                logger.info("check reload button error")
     title = None
     if loaded_cfm:
-        chrome_document = chrome_window.DocumentControl()
-        title = chrome_document.Name
+        with fun_timed('uia'):
+            chrome_document = chrome_window.DocumentControl()
+            title = chrome_document.Name
     return title
 
 async def fun_http_data(session_id: str, tab_id: int):
@@ -222,13 +244,14 @@ async def fun_http_data(session_id: str, tab_id: int):
         return
     loaded_cfm = False
     import asyncio
-    for _ in range(10):
-        await asyncio.sleep(0.200)
-        if session_id in sessionS_tabN_loadedLS:
-            if tab_id in sessionS_tabN_loadedLS[session_id]:
-                if sessionS_tabN_loadedLS[session_id][tab_id]:
-                    loaded_cfm = True
-                    break
+    with fun_timed('chrome'):
+        for _ in range(10):
+            await asyncio.sleep(0.200)
+            if session_id in sessionS_tabN_loadedLS:
+                if tab_id in sessionS_tabN_loadedLS[session_id]:
+                    if sessionS_tabN_loadedLS[session_id][tab_id]:
+                        loaded_cfm = True
+                        break
     if not loaded_cfm:
         return
     dataLO = []
@@ -299,9 +322,10 @@ def fun_uia_data(session_id: str):
     chrome_window = fun_find_window(session_id)
     if not chrome_window:
         return
-    chrome_window.SetFocus()
-    chrome_document = chrome_window.DocumentControl()
-    tree = fun_element_tree(chrome_document)
+    with fun_timed('uia'):
+        chrome_window.SetFocus()
+        chrome_document = chrome_window.DocumentControl()
+        tree = fun_element_tree(chrome_document)
     return tree
 
 async def fun_session_download(session_id: str, tab_id: int, request_id: str):
@@ -315,9 +339,10 @@ async def fun_session_download(session_id: str, tab_id: int, request_id: str):
     req = {r'id': id, r'command': r'Request.Network.getResponseBody', r'params': {r'tabId': tab_id, r'requestId': request_id}}
     import json
     text = json.dumps(req)
-    await chrome_websocket.send_text(text)
-    logger.debug(f'websocket send:{chrome_websocket.client.host} {chrome_websocket.client.port}\r\n{text}')
-    text = await fun_wait_reply(id)
+    with fun_timed('chrome'):
+        await chrome_websocket.send_text(text)
+        logger.debug(f'websocket send:{chrome_websocket.client.host} {chrome_websocket.client.port}\r\n{text}')
+        text = await fun_wait_reply(id)
     if text is None:
         logger.error("fun_wait_reply did not return a response for id: %s", id)
         return None
@@ -333,12 +358,13 @@ async def fun_session_click(session_id: str, element_id: str) -> Optional[str]:
         return
     text = None
     try:
-        chrome_window.SetFocus()
-        chrome_document = chrome_window.DocumentControl()
-        element = fun_element_search(chrome_document, element_id)
-        if element:
-            element.Click()
-            text = element.Name
+        with fun_timed('uia'):
+            chrome_window.SetFocus()
+            chrome_document = chrome_window.DocumentControl()
+            element = fun_element_search(chrome_document, element_id)
+            if element:
+                element.Click()
+                text = element.Name
     except Exception as e:
         pass
     return text
@@ -352,12 +378,13 @@ async def fun_session_input(session_id: str, element_id: str, keys: str) -> Opti
         return
     text = None
     try:
-        chrome_window.SetFocus()
-        chrome_document = chrome_window.DocumentControl()
-        element = fun_element_search(chrome_document, element_id)
-        if element:
-            element.SendKeys(keys)
-            text = element.Name
+        with fun_timed('uia'):
+            chrome_window.SetFocus()
+            chrome_document = chrome_window.DocumentControl()
+            element = fun_element_search(chrome_document, element_id)
+            if element:
+                element.SendKeys(keys)
+                text = element.Name
     except Exception as e:
         pass
     return text
@@ -378,7 +405,9 @@ async def fun_session_destroy(session_id: str) -> str:
     if session_id in sessionS_proxy_credentials:
         del sessionS_proxy_credentials[session_id]
     import asyncio
-    await asyncio.sleep(1.000)
+    # Let Chrome exit before its user data directory goes
+    with fun_timed('chrome'):
+        await asyncio.sleep(1.000)
     fun_clear_data(session_id)
     return session_id
 
@@ -432,6 +461,27 @@ async def lifespan(app: FastAPI):
 
 app = FastAPI(lifespan=lifespan)
 
+# ----------  ---------- request timing ----------  ----------
+from fastapi import Request
+@app.middleware('http')
+async def timing_middleware(request: Request, call_next):
+    """Report where the request's time went in a Server-Timing header (uia, chrome, total) and echo X-Trace-Id."""
+    import time
+    trace_id = request.headers.get('X-Trace-Id')
+    timing = {}
+    token = request_timing.set(timing)
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        request_timing.reset(token)
+    timing['total'] = time.perf_counter() - started
+    response.headers['Server-Timing'] = ', '.join(f'{phase};dur={seconds * 1000:.1f}' for phase, seconds in timing.items())
+    if trace_id:
+        response.headers['X-Trace-Id'] = trace_id
+        logger.info(f"trace {trace_id} {request.url.path}: {response.headers['Server-Timing']}")
+    return response
+
 # ----------  ---------- root ----------  ----------
 root_html = '''
 <!DOCTYPE html>
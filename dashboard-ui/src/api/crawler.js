@@ -38,4 +38,12 @@ export function deleteCrawlers(data) {
     method: 'post',
     data
   })
-}
\ No newline at end of file
+}
+
+export function getCrawlerMetrics(data) {
+  return request({
+    url: '/api/crawler/metrics',
+    method: 'post',
+    data
+  })
+}
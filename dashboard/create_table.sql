@@ -21,7 +21,8 @@ CREATE TABLE IF NOT EXISTS `crawler_info` (
   `memory_usage` float DEFAULT NULL,
   `create_time` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
   `update_time` datetime DEFAULT NULL ON UPDATE CURRENT_TIMESTAMP,
-  PRIMARY KEY (`id`)
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uk_crawler_info_uuid` (`uuid`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 
 -- Create crawler_setting table
@@ -48,19 +49,50 @@ CREATE TABLE IF NOT EXISTS `crawler_session` (
   `create_time` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
   `update_time` datetime DEFAULT NULL ON UPDATE CURRENT_TIMESTAMP,
   PRIMARY KEY (`id`),
+  UNIQUE KEY `uk_crawler_session_uuid` (`uuid`),
   CONSTRAINT `fk_crawler_session_info` FOREIGN KEY (`crawler_id`) REFERENCES `crawler_info` (`id`) ON DELETE SET NULL ON UPDATE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 
 -- Create crawler_log table
 CREATE TABLE IF NOT EXISTS `crawler_log` (
   `id` int NOT NULL AUTO_INCREMENT,
+  `uuid` varchar(50) DEFAULT NULL,
   `crawler_session_id` int DEFAULT NULL,
   `url` varchar(500) DEFAULT NULL,
   `request_time` datetime DEFAULT NULL,
   `response_time` datetime DEFAULT NULL,
   `status_code` int DEFAULT NULL,
+  `trace_id` varchar(64) DEFAULT NULL COMMENT 'X-Trace-Id relayed to the crawler and its agent',
+  `dispatch_ms` int DEFAULT NULL COMMENT 'dispatcher: admission, domain wait, outbound queue',
+  `link_ms` int DEFAULT NULL COMMENT 'control connection, both ways',
+  `client_ms` int DEFAULT NULL COMMENT 'DispatcherClient: relay slot wait, agent connection',
+  `agent_ms` int DEFAULT NULL COMMENT 'agent request handling',
+  `uia_ms` int DEFAULT NULL COMMENT 'part of agent_ms in UI Automation',
+  `chrome_ms` int DEFAULT NULL COMMENT 'part of agent_ms waiting on Chrome',
   `create_time` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
   `update_time` datetime DEFAULT NULL ON UPDATE CURRENT_TIMESTAMP,
   PRIMARY KEY (`id`),
+  UNIQUE KEY `uk_crawler_log_uuid` (`uuid`),
+  KEY `idx_crawler_log_trace` (`trace_id`),
   CONSTRAINT `fk_crawler_log_session` FOREIGN KEY (`crawler_session_id`) REFERENCES `crawler_session` (`id`) ON DELETE SET NULL ON UPDATE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+
+-- Create crawler_metric table (per-crawler load rollups written by the dispatcher, averages are sum / samples)
+CREATE TABLE IF NOT EXISTS `crawler_metric` (
+  `id` bigint NOT NULL AUTO_INCREMENT,
+  `crawler_id` int NOT NULL,
+  `resolution` int NOT NULL COMMENT 'bucket size in seconds, 60:minute, 3600:hour',
+  `bucket_time` datetime NOT NULL,
+  `samples` int NOT NULL DEFAULT 0 COMMENT 'heartbeats in the bucket',
+  `cpu_sum` double NOT NULL DEFAULT 0,
+  `cpu_max` float NOT NULL DEFAULT 0,
+  `memory_sum` double NOT NULL DEFAULT 0,
+  `memory_max` float NOT NULL DEFAULT 0,
+  `sessions_sum` int NOT NULL DEFAULT 0,
+  `sessions_max` int NOT NULL DEFAULT 0,
+  `requests` int NOT NULL DEFAULT 0 COMMENT 'requests relayed to the crawler',
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uk_crawler_metric_bucket` (`crawler_id`, `resolution`, `bucket_time`),
+  KEY `idx_crawler_metric_time` (`resolution`, `bucket_time`),
+  CONSTRAINT `fk_crawler_metric_info` FOREIGN KEY (`crawler_id`) REFERENCES `crawler_info` (`id`) ON DELETE CASCADE ON UPDATE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
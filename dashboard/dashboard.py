@@ -4,7 +4,7 @@
 from fastapi import FastAPI, HTTPException, Depends, Body
 from pydantic import BaseModel
 from typing import Optional, List
-from datetime import datetime
+from datetime import datetime, timedelta
 import mysql.connector
 from mysql.connector import pooling
 import os
@@ -62,6 +62,17 @@ class PageResponse(BaseModel):
 class DeleteRequest(BaseModel):
     ids: List[int]
 
+class CrawlerMetricsRequest(BaseModel):
+    crawler_id: Optional[int] = None  # None: all crawlers together
+    start_time: Optional[datetime] = None  # default: end_time - 1 hour
+    end_time: Optional[datetime] = None  # default: now
+    resolution: Optional[int] = None  # 60 or 3600, default: by the length of the range
+
+# crawler_metric rollups the dispatcher writes (bucket size in seconds)
+METRIC_RESOLUTIONS = (60, 3600)
+# Ranges up to this long are served from minute buckets, longer ones from hour buckets
+METRIC_MINUTE_RANGE = timedelta(hours=6)
+
 # Helper functions
 def format_datetime(dt: Optional[datetime]) -> Optional[str]:
     return dt.isoformat() if dt else None
@@ -209,6 +220,59 @@ def delete_crawlers(req: DeleteRequest, db=Depends(get_db_connection)):
                 cursor.close()
     return {"ids": exists_ids}
 
+@app.post("/crawler/metrics")
+def crawler_metrics(request: CrawlerMetricsRequest, db=Depends(get_db_connection)):
+    end_time = request.end_time or datetime.now()
+    start_time = request.start_time or end_time - timedelta(hours=1)
+    if start_time >= end_time:
+        raise HTTPException(status_code=400, detail="start_time must be before end_time")
+    resolution = request.resolution or (60 if end_time - start_time <= METRIC_MINUTE_RANGE else 3600)
+    if resolution not in METRIC_RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"resolution must be one of {METRIC_RESOLUTIONS}")
+    cursor = None
+    try:
+        cursor = db.cursor(dictionary=True)
+        
+        # Per-crawler averages are sum / samples; across crawlers CPU and memory are averaged, sessions and requests added up
+        query = """
+        SELECT cm.bucket_time,
+               SUM(cm.cpu_sum) / NULLIF(SUM(cm.samples), 0) AS cpu_avg, MAX(cm.cpu_max) AS cpu_max,
+               SUM(cm.memory_sum) / NULLIF(SUM(cm.samples), 0) AS memory_avg, MAX(cm.memory_max) AS memory_max,
+               SUM(cm.sessions_sum / NULLIF(cm.samples, 0)) AS sessions_avg, SUM(cm.sessions_max) AS sessions_max,
+               SUM(cm.requests) AS requests
+        FROM crawler_metric cm
+        WHERE cm.resolution = %s AND cm.bucket_time >= %s AND cm.bucket_time < %s
+        """
+        params = [resolution, start_time, end_time]
+        if request.crawler_id is not None:
+            query += " AND cm.crawler_id = %s"
+            params.append(request.crawler_id)
+        query += " GROUP BY cm.bucket_time ORDER BY cm.bucket_time"
+        
+        cursor.execute(query, params)
+        results = cursor.fetchall()
+        
+        rows = []
+        for row in results:
+            rows.append({
+                "time": format_datetime(row['bucket_time']),
+                "cpu_avg": float(row['cpu_avg']) if row['cpu_avg'] is not None else None,
+                "cpu_max": row['cpu_max'],
+                "memory_avg": float(row['memory_avg']) if row['memory_avg'] is not None else None,
+                "memory_max": row['memory_max'],
+                "sessions_avg": float(row['sessions_avg']) if row['sessions_avg'] is not None else None,
+                "sessions_max": int(row['sessions_max']),
+                "requests": int(row['requests']),
+                "requests_per_minute": int(row['requests']) * 60 / resolution,
+            })
+        
+        return {"resolution": resolution, "rows": rows}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if cursor:
+            cursor.close()
+
 @app.post("/session/grid", response_model=PageResponse)
 def session_grid(request: SessionGridRequest, db=Depends(get_db_connection)):
     cursor = None
@@ -302,6 +366,7 @@ def log_grid(request: LogGridRequest, db=Depends(get_db_connection)):
         # Base query
         query = """
         SELECT cl.id, cl.url, cl.request_time, cl.response_time, cl.status_code, cl.create_time, cl.update_time,
+               cl.trace_id, cl.dispatch_ms, cl.link_ms, cl.client_ms, cl.agent_ms, cl.uia_ms, cl.chrome_ms,
                cs.uuid, ci.uuid as crawler_uuid, ci.host_name, ci.external_ip, ci.internal_ip, cset.alias
         FROM crawler_log cl
         LEFT JOIN crawler_session cs ON cl.crawler_session_id = cs.id
@@ -326,8 +391,8 @@ def log_grid(request: LogGridRequest, db=Depends(get_db_connection)):
             params.append(request.session_id)
         if request.keyword:
             like_value = f"%{request.keyword}%"
-            conditions.append("(cl.url LIKE %s OR cs.uuid LIKE %s OR ci.uuid LIKE %s OR ci.host_name LIKE %s OR ci.external_ip LIKE %s OR ci.internal_ip LIKE %s OR cset.alias LIKE %s)")
-            params.extend([like_value, like_value, like_value, like_value, like_value, like_value, like_value])
+            conditions.append("(cl.url LIKE %s OR cl.trace_id = %s OR cs.uuid LIKE %s OR ci.uuid LIKE %s OR ci.host_name LIKE %s OR ci.external_ip LIKE %s OR ci.internal_ip LIKE %s OR cset.alias LIKE %s)")
+            params.extend([like_value, request.keyword, like_value, like_value, like_value, like_value, like_value, like_value])
         
         if conditions:
             where_clause = " AND ".join(conditions)
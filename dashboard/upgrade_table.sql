@@ -0,0 +1,44 @@
+-- Upgrade an existing database to the current create_table.sql
+-- (the dispatcher upserts by uuid, which needs these unique keys)
+
+-- Use the database
+USE `dashboard`;
+
+-- crawler_info / crawler_session: one row per uuid
+ALTER TABLE `crawler_info` ADD UNIQUE KEY `uk_crawler_info_uuid` (`uuid`);
+ALTER TABLE `crawler_session` ADD UNIQUE KEY `uk_crawler_session_uuid` (`uuid`);
+
+-- crawler_log: request uuid assigned by the dispatcher
+ALTER TABLE `crawler_log` ADD COLUMN `uuid` varchar(50) DEFAULT NULL AFTER `id`;
+ALTER TABLE `crawler_log` ADD UNIQUE KEY `uk_crawler_log_uuid` (`uuid`);
+
+-- crawler_metric: new table (per-crawler load rollups written by the dispatcher, averages are sum / samples)
+CREATE TABLE IF NOT EXISTS `crawler_metric` (
+  `id` bigint NOT NULL AUTO_INCREMENT,
+  `crawler_id` int NOT NULL,
+  `resolution` int NOT NULL COMMENT 'bucket size in seconds, 60:minute, 3600:hour',
+  `bucket_time` datetime NOT NULL,
+  `samples` int NOT NULL DEFAULT 0 COMMENT 'heartbeats in the bucket',
+  `cpu_sum` double NOT NULL DEFAULT 0,
+  `cpu_max` float NOT NULL DEFAULT 0,
+  `memory_sum` double NOT NULL DEFAULT 0,
+  `memory_max` float NOT NULL DEFAULT 0,
+  `sessions_sum` int NOT NULL DEFAULT 0,
+  `sessions_max` int NOT NULL DEFAULT 0,
+  `requests` int NOT NULL DEFAULT 0 COMMENT 'requests relayed to the crawler',
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uk_crawler_metric_bucket` (`crawler_id`, `resolution`, `bucket_time`),
+  KEY `idx_crawler_metric_time` (`resolution`, `bucket_time`),
+  CONSTRAINT `fk_crawler_metric_info` FOREIGN KEY (`crawler_id`) REFERENCES `crawler_info` (`id`) ON DELETE CASCADE ON UPDATE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+
+-- crawler_log: trace id and per-hop timing of relayed requests
+ALTER TABLE `crawler_log`
+  ADD COLUMN `trace_id` varchar(64) DEFAULT NULL COMMENT 'X-Trace-Id relayed to the crawler and its agent' AFTER `status_code`,
+  ADD COLUMN `dispatch_ms` int DEFAULT NULL COMMENT 'dispatcher: admission, domain wait, outbound queue' AFTER `trace_id`,
+  ADD COLUMN `link_ms` int DEFAULT NULL COMMENT 'control connection, both ways' AFTER `dispatch_ms`,
+  ADD COLUMN `client_ms` int DEFAULT NULL COMMENT 'DispatcherClient: relay slot wait, agent connection' AFTER `link_ms`,
+  ADD COLUMN `agent_ms` int DEFAULT NULL COMMENT 'agent request handling' AFTER `client_ms`,
+  ADD COLUMN `uia_ms` int DEFAULT NULL COMMENT 'part of agent_ms in UI Automation' AFTER `agent_ms`,
+  ADD COLUMN `chrome_ms` int DEFAULT NULL COMMENT 'part of agent_ms waiting on Chrome' AFTER `uia_ms`,
+  ADD KEY `idx_crawler_log_trace` (`trace_id`);
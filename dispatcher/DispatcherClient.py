@@ -2,54 +2,87 @@
 # pip install psutil
 #
 import asyncio
+import os
 import socket
 import logging
 import json
 import uuid
 import datetime
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List, Set
+from dataclasses import dataclass, field
 import platform
+import random
 import psutil
 import uuid as uuidlib
+import time
+from DispatcherHttp import HEADER_END, HttpConnectionPool, parse_head, parse_server_timing
+from DispatcherProtocol import (MESSAGE_DELIMITER, PROTOCOL_DELIMITED, PROTOCOL_STREAM, PROTOCOL_DELTA, SUPPORTED_PROTOCOLS, HELLO_TYPE, HANDSHAKE_TIMEOUT,
+                                RESPONSE_CHUNK_TYPE, RESPONSE_END_TYPE, RESPONSE_ACK_TYPE, CANCEL_TYPE, SESSIONS_TYPE, SESSIONS_ENDED_TYPE, STREAM_CHUNK_SIZE, STREAM_WINDOW, TRACE_HEADER,
+                                PriorityScheduler, StreamCredit, encode_frame, read_frame, split_binary_data, message_bytes, parse_priority)
 
 logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s %(message)s')
 
-DISPATCHER_HOST = '127.0.0.1'
-DISPATCHER_PORT = 8010
-HTTP_HOST = '127.0.0.1'
-HTTP_PORT = 8020
+DISPATCHER_HOST = os.getenv("DISPATCHER_HOST", '127.0.0.1')
+DISPATCHER_PORT = int(os.getenv("DISPATCHER_PORT", "8010"))
+HTTP_HOST = os.getenv("AGENT_HOST", '127.0.0.1')
+HTTP_PORT = int(os.getenv("AGENT_PORT", "8020"))
 
-# Message delimiter
-MESSAGE_DELIMITER = b'\x00\x01\x02\x03'
+# Dispatchers to keep a control connection to ("host:port,host:port"), each one can place sessions
+# on this client's browsers
+DISPATCHERS = os.getenv("DISPATCHERS", f"{DISPATCHER_HOST}:{DISPATCHER_PORT}")
 
-async def read_json_message(reader: asyncio.StreamReader) -> Optional[Dict[str, Any]]:
-    """Read a JSON message from the stream reader using delimiter"""
+# Delay before reconnecting: doubles from RECONNECT_DELAY_MIN per failed attempt up to RECONNECT_DELAY_MAX,
+# randomized (full jitter) so that a restarted dispatcher isn't hit by the whole fleet at once
+RECONNECT_DELAY_MIN = 0.05
+RECONNECT_DELAY_MAX = 10.0
+
+# Seconds between heartbeats, and between load samples (taken on a worker thread)
+HEARTBEAT_INTERVAL = 10
+
+# Browser processes started by the agent, counted and their memory summed in heartbeats
+BROWSER_PROCESS_NAMES = {"chrome.exe", "chrome", "chromium"}
+
+# Smallest change of a load value that goes out in a delta heartbeat (other fields go out on any change)
+HEARTBEAT_DEADBANDS = {"cpu_usage": 1.0, "memory_usage": 1.0, "rss_mb": 4, "browser_rss_mb": 64,
+                       "http_reuse_rate": 0.05, "http_latency_avg_ms": 50, "http_idle": 2}
+
+# Seconds a dispatcher may stay unreachable (e.g. restarting) before its sessions are announced to another one
+FAILOVER_DELAY = 5.0
+
+# Maximum number of http.request messages relayed to the HTTP server at the same time
+MAX_CONCURRENT_REQUESTS = 16
+
+# Order in which queued http.request messages get one of those slots: strict or weighted (by "priority")
+PRIORITY_SCHEDULING = os.getenv("PRIORITY_SCHEDULING", "weighted")
+
+async def read_json_message(reader: asyncio.StreamReader, protocol: int = PROTOCOL_DELIMITED) -> Optional[Dict[str, Any]]:
+    """Read a JSON message from the stream reader using the negotiated framing"""
     try:
-        # Read until we find the delimiter
-        buffer = b""
-        while True:
-            char = await reader.read(1)
-            if not char:
-                return None
-            buffer += char
-            # Check if we have the delimiter
-            if buffer.endswith(MESSAGE_DELIMITER):
-                # Remove delimiter and decode
-                json_data = buffer[:-len(MESSAGE_DELIMITER)]
-                try:
-                    message = json.loads(json_data.decode('utf-8', errors='ignore'))
-                    # Log the received message
-                    logging.info(f"[CLIENT][JSON] Received: {json.dumps(message, ensure_ascii=False)}")
-                    return message
-                except json.JSONDecodeError as e:
-                    logging.error(f"[CLIENT][JSON] Error parsing JSON: {e}")
-                    return None
+        frame = await read_frame(reader, protocol)
+        if frame is None:
+            return None
+        json_data, body = frame
+        try:
+            message = json.loads(json_data.decode('utf-8', errors='ignore'))
+            # Log the received message (raw body only by size)
+            logging.info(f"[CLIENT][JSON] Received: {json.dumps(message, ensure_ascii=False)}" + (f" +{len(body)} bytes" if body else ""))
+            if body is not None and "data" not in message:
+                message["data"] = body
+            return message
+        except json.JSONDecodeError as e:
+            logging.error(f"[CLIENT][JSON] Error parsing JSON: {e}")
+            return None
     except Exception as e:
         logging.error(f"[CLIENT][JSON] Error reading JSON message: {e}")
         return None
 
-async def write_json_message(writer: asyncio.StreamWriter, msg_id: str, msg_type: str, data: Any, reply_to: Optional[str] = None) -> None:
-    """Write a JSON message to the stream writer with delimiter"""
+async def _write_frame(writer: asyncio.StreamWriter, frame: List[bytes]) -> None:
+    writer.writelines(frame)
+    await writer.drain()
+
+async def write_json_message(writer: asyncio.StreamWriter, msg_id: str, msg_type: str, data: Any, reply_to: Optional[str] = None, protocol: int = PROTOCOL_DELIMITED, write_lock: Optional[asyncio.Lock] = None,
+                             timing: Optional[Dict[str, Any]] = None) -> None:
+    """Write a JSON message to the stream writer using the negotiated framing, serialized by write_lock if given"""
     try:
         # 直接在这里构造 JSON message
         message = {
@@ -60,55 +93,43 @@ async def write_json_message(writer: asyncio.StreamWriter, msg_id: str, msg_type
         }
         if reply_to:
             message["reply"] = reply_to
+        if timing is not None:
+            message["timing"] = timing
+        # Raw bytes go in the frame body (or base64 for older peers)
+        message, body = split_binary_data(message, protocol)
         message_str = json.dumps(message, ensure_ascii=False)
-        writer.write(message_str.encode('utf-8') + MESSAGE_DELIMITER)
-        await writer.drain()
+        frame = encode_frame(message_str.encode('utf-8'), protocol, body)
+        if write_lock is None:
+            await _write_frame(writer, frame)
+        else:
+            async with write_lock:
+                await _write_frame(writer, frame)
         
         # Log the sent message
         addr = writer.get_extra_info('peername')
-        logging.info(f"[CLIENT][JSON] Sent to {addr}: {message_str}")
+        logging.info(f"[CLIENT][JSON] Sent to {addr}: {message_str}" + (f" +{len(body)} bytes" if body else ""))
     except Exception as e:
         logging.error(f"[CLIENT][JSON] Error writing JSON message: {e}")
 
+# Keep-alive connections to the HTTP server, shared by all relayed requests
+http_pool = HttpConnectionPool(HTTP_HOST, HTTP_PORT, max_idle=MAX_CONCURRENT_REQUESTS)
+
 async def handle_http_request(request_body: bytes) -> bytes:
     """Handle HTTP request from dispatcher and forward to HTTP server, return response buffer"""
-    http_reader = None
-    http_writer = None
     try:
-        # Connect to HTTP server
-        http_reader, http_writer = await asyncio.open_connection(HTTP_HOST, HTTP_PORT)
-        
         # Debug: Log the binary HTTP request
         logging.info(f"[CLIENT][HTTP] Sending binary HTTP request, original size: {len(request_body)} bytes")
         
-        # Write binary HTTP request directly to HTTP server
-        http_writer.write(request_body)
-        await http_writer.drain()
-        
-        # Read HTTP response as binary data
-        response_buffer = b""
-        while True:
-            chunk = await http_reader.read(1024)
-            if not chunk:
-                break
-            response_buffer += chunk
+        started = time.monotonic()
+        response_buffer = await http_pool.request(request_body)
         
-        logging.info(f"[CLIENT][HTTP] Received binary HTTP response, size: {len(response_buffer)} bytes")
+        logging.info(f"[CLIENT][HTTP] Received binary HTTP response, size: {len(response_buffer)} bytes, trace: {_trace_id(request_body)}, latency: {(time.monotonic() - started) * 1000:.1f} ms")
         
         return response_buffer
         
     except Exception as e:
         logging.error(f"[CLIENT][HTTP] Error handling HTTP request: {e}")
         raise
-    finally:
-        # Ensure HTTP connection is properly closed
-        if http_writer:
-            try:
-                if not http_writer.is_closing():
-                    http_writer.close()
-                    await http_writer.wait_closed()
-            except Exception as e:
-                logging.error(f"[CLIENT][HTTP] Error closing HTTP connection: {e}")
 
 
 def get_os() -> str:
@@ -146,106 +167,443 @@ def get_uuid() -> str:
     except Exception:
         return str(uuid.uuid4())
 
-def get_cpu_percent() -> float:
-    """Get current CPU usage percent"""
-    return psutil.cpu_percent(interval=0.5)
+def get_identity() -> Dict[str, Any]:
+    """Static heartbeat fields, sent once per connection"""
+    return {
+        "uuid": get_uuid(),
+        "os": get_os(),
+        "agent": get_agent(),
+        "host_name": get_hostname(),
+        "ip": get_ip_list(),
+    }
+
+def sample_load() -> Dict[str, Any]:
+    """CPU and memory usage and the agent's browsers, blocking: runs on a worker thread.
+
+    cpu_percent(None) measures since the previous call instead of sleeping for an interval.
+    """
+    browser_count = 0
+    browser_rss = 0
+    for process in psutil.process_iter(['name', 'cmdline', 'memory_info']):
+        info = process.info
+        if (info.get('name') or '').lower() not in BROWSER_PROCESS_NAMES:
+            continue
+        if info.get('memory_info'):
+            browser_rss += info['memory_info'].rss
+        # Renderer, GPU and utility processes run with --type=, the browser itself doesn't
+        if not any(arg.startswith('--type=') for arg in info.get('cmdline') or []):
+            browser_count += 1
+    return {
+        "cpu_usage": psutil.cpu_percent(None),
+        "memory_usage": psutil.virtual_memory().percent,
+        "browser_count": browser_count,
+        "rss_mb": psutil.Process().memory_info().rss // (1024 * 1024),
+        "browser_rss_mb": browser_rss // (1024 * 1024),
+    }
+
+# Identity and the latest load sample, filled in by sample_load_periodically()
+identity: Dict[str, Any] = {}
+load_sample: Dict[str, Any] = {}
+
+async def sample_load_periodically(interval: int = HEARTBEAT_INTERVAL) -> None:
+    """Keep load_sample current without blocking relays"""
+    loop = asyncio.get_running_loop()
+    identity.update(await loop.run_in_executor(None, get_identity))
+    # The first cpu_percent(None) only starts the measurement
+    psutil.cpu_percent(None)
+    await asyncio.sleep(0.2)
+    while True:
+        try:
+            load_sample.update(await loop.run_in_executor(None, sample_load))
+        except Exception as e:
+            logging.error(f"[CLIENT][HEARTBEAT] Error sampling load: {e}")
+        await asyncio.sleep(interval)
+
+#==========  DISPATCHER LINK  ==========
+@dataclass
+class DispatcherLink:
+    """State of one control connection to a dispatcher"""
+    address: str  # "host:port" of the dispatcher
+    reader: asyncio.StreamReader
+    writer: asyncio.StreamWriter
+    protocol: int = PROTOCOL_DELIMITED
+    write_lock: asyncio.Lock = field(default_factory=asyncio.Lock)  # Serializes frames written to writer
+    request_semaphore: asyncio.Semaphore = field(default_factory=lambda: asyncio.Semaphore(MAX_CONCURRENT_REQUESTS))
+    request_queue: PriorityScheduler = field(default_factory=lambda: PriorityScheduler(PRIORITY_SCHEDULING))  # (received, http.request) waiting for a slot
+    request_tasks: Dict[str, asyncio.Task] = field(default_factory=dict)  # In-flight http.request tasks by request id
+    response_credits: Dict[str, StreamCredit] = field(default_factory=dict)  # Streamed responses by request id
+    heartbeat_sent: Dict[str, Any] = field(default_factory=dict)  # Heartbeat fields as the dispatcher last saw them
+
+    async def send(self, msg_type: str, data: Any, reply_to: Optional[str] = None, timing: Optional[Dict[str, Any]] = None) -> None:
+        await write_json_message(self.writer, str(uuid.uuid4()), msg_type, data, reply_to, self.protocol, self.write_lock, timing)
+
+# Connected dispatchers by address
+links: Dict[str, DispatcherLink] = {}
+
+# Sessions held by this client's browsers -> address of the dispatcher they belong to, announced
+# again when that dispatcher reconnects (or to another one while it is down)
+live_sessions: Dict[str, str] = {}
+
+# Dispatchers unreachable for longer than FAILOVER_DELAY, their sessions go to the next link that connects
+failed_over: Set[str] = set()
+
+# Background heartbeats and browser closes started by session changes
+session_tasks: Set[asyncio.Task] = set()
+
+def _status_code(response_head: bytes) -> int:
+    try:
+        return int(response_head.split(b' ', 2)[1])
+    except (IndexError, ValueError):
+        return 0
+
+def _trace_id(request_body: bytes) -> Optional[str]:
+    head = request_body.split(HEADER_END, 1)[0]
+    return parse_head(head)[1].get(TRACE_HEADER.lower())
+
+def _timing(received: float, started: float, response_head: bytes) -> Dict[str, Any]:
+    """Milliseconds a relayed request spent here: waiting for a slot (queue), at the HTTP server (relay)
+    and in total, with the HTTP server's own Server-Timing breakdown (agent)"""
+    now = time.monotonic()
+    headers = parse_head(response_head.split(HEADER_END, 1)[0])[1] if response_head else {}
+    return {
+        "total": round((now - received) * 1000, 1),
+        "queue": round((started - received) * 1000, 1),
+        "relay": round((now - started) * 1000, 1),
+        "agent": parse_server_timing(headers.get("server-timing")),
+    }
+
+def _track_session(link: DispatcherLink, request_body: bytes, status_code: int) -> None:
+    """Note sessions started and destroyed by the requests relayed for a dispatcher"""
+    head = request_body.split(b'\r\n\r\n', 1)[0].split(b'\r\n')
+    parts = head[0].split(b' ')
+    path = parts[1].split(b'?', 1)[0] if len(parts) > 1 else b''
+    if path not in (b'/api/start', b'/api/destroy'):
+        return
+    session_id = next((line.split(b':', 1)[1].strip().decode() for line in head[1:] if line.lower().startswith(b'x-session-id:')), None)
+    if not session_id:
+        return
+    if path == b'/api/start' and 200 <= status_code < 300:
+        live_sessions[session_id] = link.address
+    elif path == b'/api/destroy':
+        live_sessions.pop(session_id, None)
+    else:
+        return
+    share_capacity()
+
+def _background(coro) -> None:
+    task = asyncio.create_task(coro)
+    session_tasks.add(task)
+    task.add_done_callback(session_tasks.discard)
 
-def get_mem_percent() -> float:
-    """Get current memory usage percent"""
-    return psutil.virtual_memory().percent
+def share_capacity() -> None:
+    """Every dispatcher takes the sessions held for the others off this client's max_browser_count:
+    tell them right away when that changes (links before PROTOCOL_DELTA carry it in their next heartbeat)"""
+    for link in list(links.values()):
+        if link.protocol >= PROTOCOL_DELTA and not link.writer.is_closing():
+            delta = heartbeat_data(link)
+            if delta:
+                _background(link.send("dispatcher.heartbeat", delta))
 
-async def send_heartbeat_periodically(writer: asyncio.StreamWriter, client_uuid: str, interval: int = 10):
+async def close_browser(session_id: str) -> None:
+    request = (f"POST /api/destroy HTTP/1.1\r\nHost: {HTTP_HOST}:{HTTP_PORT}\r\nX-Session-Id: {session_id}\r\n"
+               f"Content-Type: application/json\r\nContent-Length: 2\r\n\r\n{{}}").encode()
+    try:
+        await http_pool.request(request)
+    except Exception as e:
+        logging.error(f"[CLIENT][HTTP] Error closing the browser of session {session_id}: {e}")
+
+def end_sessions(link: DispatcherLink, session_ids: List[str]) -> None:
+    """The dispatcher destroyed these sessions: stop announcing them and close their browsers"""
+    ended = [session_id for session_id in session_ids if live_sessions.get(session_id) == link.address]
+    if not ended:
+        return
+    for session_id in ended:
+        del live_sessions[session_id]
+        _background(close_browser(session_id))
+    logging.info(f"[CLIENT][CONN] Dispatcher({link.address}) ended {len(ended)} sessions, closing their browsers")
+    share_capacity()
+
+async def announce_sessions(link: DispatcherLink, owners: List[str]) -> None:
+    """Hand the sessions belonging to `owners` to the dispatcher on `link`"""
+    session_ids = [session_id for session_id, owner in live_sessions.items() if owner in owners]
+    if not session_ids:
+        return
+    await link.send(SESSIONS_TYPE, {"sessions": session_ids})
+    for session_id in session_ids:
+        live_sessions[session_id] = link.address
+    logging.info(f"[CLIENT][CONN] Announced {len(session_ids)} live sessions to dispatcher({link.address})")
+    share_capacity()
+
+def heartbeat_data(link: DispatcherLink) -> Dict[str, Any]:
+    """Heartbeat for the dispatcher on `link`: everything on the first one (and for dispatchers before
+    PROTOCOL_DELTA), afterwards only the fields that changed by more than their deadband"""
+    pool_stats = http_pool.stats()
+    current = {
+        **identity,
+        **load_sample,
+        # Relayed requests not answered yet, over all dispatchers
+        "in_flight": sum(len(l.request_tasks) for l in links.values()),
+        # Keep-alive pool to the HTTP server: reuse rate, average request latency and idle connections
+        "http_reuse_rate": pool_stats["reuse_rate"],
+        "http_latency_avg_ms": pool_stats["latency_avg_ms"],
+        "http_idle": pool_stats["idle"],
+        # Sessions placed through the other dispatchers, off the max_browser_count this one uses
+        "sessions_elsewhere": sum(1 for owner in live_sessions.values() if owner != link.address),
+    }
+    if link.protocol < PROTOCOL_DELTA:
+        return current
+    sent = link.heartbeat_sent
+    delta = {}
+    for key, value in current.items():
+        if key not in sent:
+            delta[key] = value
+            continue
+        deadband = HEARTBEAT_DEADBANDS.get(key)
+        if deadband is not None and value is not None and sent[key] is not None:
+            changed = abs(value - sent[key]) >= deadband
+        else:
+            changed = value != sent[key]
+        if changed:
+            delta[key] = value
+    sent.update(delta)
+    return delta
+
+async def send_heartbeat_periodically(link: DispatcherLink, interval: int = HEARTBEAT_INTERVAL):
     """Send heartbeat message periodically to the dispatcher server."""
     try:
-        while not writer.is_closing():
-            heartbeat_data = {
-                "uuid": client_uuid,
-                "os": get_os(),
-                "agent": get_agent(),
-                "host_name": get_hostname(),
-                "ip": get_ip_list(),
-                "cpu_usage": get_cpu_percent(),
-                "memory_usage": get_mem_percent()
-            }
-            msg_id = str(uuid.uuid4())
-            await write_json_message(writer, msg_id, "dispatcher.heartbeat", heartbeat_data)
+        while not link.writer.is_closing():
             await asyncio.sleep(interval)
+            await link.send("dispatcher.heartbeat", heartbeat_data(link))
     except Exception as e:
         logging.error(f"[CLIENT][HEARTBEAT] Error in periodic heartbeat: {e}")
 
-async def handle_dispatcher_connection():
+def _stream_response(response_head: bytes) -> bool:
+    """Whether a response goes out in chunks: chunked, delimited by connection close, or longer than one chunk"""
+    status_code = _status_code(response_head)
+    headers = parse_head(response_head.split(HEADER_END, 1)[0])[1]
+    if 'chunked' in headers.get('transfer-encoding', '').lower():
+        return True
+    if 'content-length' not in headers:
+        return not (status_code < 200 or status_code in (204, 304))
+    try:
+        return int(headers['content-length']) > STREAM_CHUNK_SIZE
+    except ValueError:
+        return True
+
+async def stream_http_request(link: DispatcherLink, request_msg_id: str, request_body: bytes, received: float) -> int:
+    """Relay one request and forward a long response in chunks as it arrives, within the dispatcher's credit;
+    one that fits in a chunk goes out whole as http.response.
+
+    Returns the response status code.
+    """
+    sent = 0
+    response = http_pool.stream(request_body, STREAM_CHUNK_SIZE)
+    try:
+        started = time.monotonic()
+        # The first part is the response head
+        response_head = await response.__anext__()
+        status_code = _status_code(response_head)
+        if not _stream_response(response_head):
+            parts = [response_head]
+            async for part in response:
+                parts.append(part)
+            response_buffer = b''.join(parts)
+            timing = _timing(received, started, response_head)
+            await link.send("http.response", response_buffer, request_msg_id, timing)
+            logging.info(f"[CLIENT][HTTP] Received binary HTTP response, size: {len(response_buffer)} bytes, trace: {_trace_id(request_body)}, timing: {json.dumps(timing)}")
+            return status_code
+        logging.info(f"[CLIENT][HTTP] Streaming binary HTTP request, original size: {len(request_body)} bytes")
+        credit = StreamCredit(STREAM_WINDOW)
+        link.response_credits[request_msg_id] = credit
+        await credit.acquire(len(response_head))
+        await link.send(RESPONSE_CHUNK_TYPE, response_head, request_msg_id)
+        sent += len(response_head)
+        async for part in response:
+            await credit.acquire(len(part))
+            await link.send(RESPONSE_CHUNK_TYPE, part, request_msg_id)
+            sent += len(part)
+        timing = _timing(received, started, response_head)
+        await link.send(RESPONSE_END_TYPE, {}, request_msg_id, timing)
+        logging.info(f"[CLIENT][HTTP] Streamed binary HTTP response, size: {sent} bytes, trace: {_trace_id(request_body)}, timing: {json.dumps(timing)}")
+        return status_code
+    except Exception as e:
+        if sent:
+            # Part of the response is already on its way, the dispatcher has to drop the user connection
+            logging.error(f"[CLIENT][HTTP] Error streaming HTTP response after {sent} bytes: {e}")
+            await link.send(RESPONSE_END_TYPE, {"error": str(e)}, request_msg_id, _timing(received, started, response_head))
+            return status_code
+        raise
+    finally:
+        await response.aclose()
+        link.response_credits.pop(request_msg_id, None)
+
+async def process_http_request(link: DispatcherLink, request_msg: Dict[str, Any], received: float) -> None:
+    """Relay one http.request to the HTTP server and reply to the dispatcher, runs as its own task"""
+    request_msg_id = request_msg.get("id", "")
+    started = time.monotonic()
+    try:
+        # Raw request bytes (frame body, or base64 from older dispatchers)
+        request_body = message_bytes(request_msg)
+        if link.protocol >= PROTOCOL_STREAM:
+            _track_session(link, request_body, await stream_http_request(link, request_msg_id, request_body, received))
+            return
+        # Handle HTTP request
+        response_buffer = await handle_http_request(request_body)
+        _track_session(link, request_body, _status_code(response_buffer))
+    except Exception as e:
+        logging.error(f"[CLIENT][HTTP] Error handling HTTP request: {e}")
+        # Send error response
+        response_buffer = b"HTTP/1.1 500 Internal Server Error\r\nContent-Type: text/plain\r\nContent-Length: 21\r\n\r\nInternal Server Error"
+    # Send response back to dispatcher, matched by the reply id so completion order doesn't matter
+    await link.send("http.response", response_buffer, request_msg_id, _timing(received, started, response_buffer))
+
+async def relay_requests(link: DispatcherLink) -> None:
+    """Start queued http.request messages by priority, up to MAX_CONCURRENT_REQUESTS at a time"""
+    while True:
+        await link.request_semaphore.acquire()
+        received, request_msg = await link.request_queue.get()
+        request_msg_id = request_msg.get("id", "")
+        task = asyncio.create_task(process_http_request(link, request_msg, received))
+        link.request_tasks[request_msg_id] = task
+        task.add_done_callback(lambda _, request_msg_id=request_msg_id: _request_done(link, request_msg_id))
+
+def _request_done(link: DispatcherLink, request_msg_id: str) -> None:
+    """Free the request's slot however its task ended, also when cancelled before it started"""
+    link.request_tasks.pop(request_msg_id, None)
+    link.request_semaphore.release()
+
+async def negotiate_protocol(server_reader: asyncio.StreamReader, server_writer: asyncio.StreamWriter) -> Optional[int]:
+    """Offer framed protocol versions to the dispatcher, return the accepted version or None if not understood
+    (it hung up on the hello or answered something else).
+
+    Raises ConnectionError when no answer comes in time, which says nothing about the dispatcher's version.
+    """
+    await write_json_message(server_writer, str(uuid.uuid4()), HELLO_TYPE, {"versions": SUPPORTED_PROTOCOLS})
+    try:
+        reply = await asyncio.wait_for(read_json_message(server_reader), timeout=HANDSHAKE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise ConnectionError("no answer to the protocol hello")
+    if not reply or reply.get("type") != HELLO_TYPE:
+        return None
+    version = reply.get("data", {}).get("version", PROTOCOL_DELIMITED)
+    return version if version in SUPPORTED_PROTOCOLS else None
+
+async def failover_sessions(address: str) -> None:
+    """Once the dispatcher at `address` has been unreachable for longer than a restart, move its sessions to a connected one"""
+    await asyncio.sleep(FAILOVER_DELAY)
+    if address in links:
+        return
+    failed_over.add(address)
+    if links:
+        try:
+            await announce_sessions(next(iter(links.values())), [address])
+        except Exception as e:
+            logging.error(f"[CLIENT][CONN] Error announcing sessions of dispatcher({address}): {e}")
+
+def reconnect_delay(attempt: int) -> float:
+    """Seconds to wait before reconnect attempt `attempt` (0 based): exponential backoff with full jitter"""
+    return random.uniform(0, min(RECONNECT_DELAY_MAX, RECONNECT_DELAY_MIN * 2 ** attempt))
+
+async def handle_dispatcher_connection(address: str):
+    """Keep a control connection to the dispatcher at "host:port", reconnecting with backoff"""
+    host, _, port = address.rpartition(":")
+    # Older dispatchers drop the connection on hello: the next attempt falls back to delimited messages,
+    # later reconnects offer framing again (the dispatcher may have been upgraded meanwhile)
+    fall_back = False
+    attempt = 0  # failed attempts since the last established connection
+    failover_task = None
     while True:
         server_reader = None
         server_writer = None
         heartbeat_task = None  # Track the heartbeat background task
+        relay_task = None
+        link = None
         try:
-            server_reader, server_writer = await asyncio.open_connection(DISPATCHER_HOST, DISPATCHER_PORT)
+            server_reader, server_writer = await asyncio.open_connection(host, int(port))
             # Immediately send a MESSAGE_DELIMITER after connection
             server_writer.write(MESSAGE_DELIMITER)
             await server_writer.drain()
             
-            # Immediately send a heartbeat message after connection
-            client_uuid = get_uuid()
-            heartbeat_data = {
-                "uuid": client_uuid,
-                "os": get_os(),
-                "agent": get_agent(),
-                "host_name": get_hostname(),
-                "ip": get_ip_list(),
-                "cpu_usage": get_cpu_percent(),
-                "memory_usage": get_mem_percent()
-            }
-            msg_id = str(uuid.uuid4())
-            await write_json_message(server_writer, msg_id, "dispatcher.heartbeat", heartbeat_data)
+            protocol = PROTOCOL_DELIMITED
+            offer_framing, fall_back = not fall_back, False
+            if offer_framing:
+                negotiated = await negotiate_protocol(server_reader, server_writer)
+                if negotiated is None:
+                    fall_back = True
+                    raise ConnectionError("dispatcher does not support protocol negotiation, falling back to delimited messages")
+                protocol = negotiated
+                logging.info(f"[CLIENT][CONN] Negotiated protocol version {protocol}")
+            link = DispatcherLink(address, server_reader, server_writer, protocol)
+            
+            # Immediately send a (complete) heartbeat message after connection
+            await link.send("dispatcher.heartbeat", heartbeat_data(link))
+            # Sessions placed through this dispatcher survive the reconnect; those of dispatchers down for longer
+            # than FAILOVER_DELAY come along (others may just be reconnecting too, e.g. after a network drop here)
+            failed_over.discard(address)
+            await announce_sessions(link, [owner for owner in set(live_sessions.values()) if owner == address or (owner in failed_over and owner not in links)])
+            links[address] = link
+            # The first heartbeat counted the sessions just announced here as held for others
+            share_capacity()
+            attempt = 0
+            if failover_task:
+                failover_task.cancel()
             
             # Start periodic heartbeat as a background task
-            heartbeat_task = asyncio.create_task(send_heartbeat_periodically(server_writer, client_uuid, interval=10))
+            heartbeat_task = asyncio.create_task(send_heartbeat_periodically(link))
+            relay_task = asyncio.create_task(relay_requests(link))
             
             sock = server_writer.get_extra_info('socket')
             if sock is not None:
                 sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
-            logging.info(f"[CLIENT][CONN] Connected to dispatcher({DISPATCHER_HOST}:{DISPATCHER_PORT}), forward to http({HTTP_HOST}:{HTTP_PORT})")
+            logging.info(f"[CLIENT][CONN] Connected to dispatcher({address}), forward to http({HTTP_HOST}:{HTTP_PORT})")
 
             while True:
                 # Wait for JSON request from dispatcher
-                request_msg = await read_json_message(server_reader)
+                request_msg = await read_json_message(server_reader, protocol)
                 if not request_msg:
-                    logging.info("[CLIENT][CONN] Dispatcher connection closed, reconnecting...")
+                    logging.info(f"[CLIENT][CONN] Dispatcher({address}) connection closed, reconnecting...")
                     break
                 
                 if request_msg.get("type") == "http.request":
-                    # Extract and decode request data
-                    request_body_b64 = request_msg.get("data", "")
-                    request_msg_id = request_msg.get("id", "")
-                    
-                    # Decode base64 request data
-                    import base64
-                    try:
-                        request_body = base64.b64decode(request_body_b64)
-                        # Handle HTTP request
-                        response_buffer = await handle_http_request(request_body)
-                        # Send response back to dispatcher
-                        response_data = base64.b64encode(response_buffer).decode('utf-8')
-                        msg_id = str(uuid.uuid4())
-                        await write_json_message(server_writer, msg_id, "http.response", response_data, request_msg_id)
-                    except Exception as e:
-                        logging.error(f"[CLIENT][HTTP] Error handling HTTP request: {e}")
-                        # Send error response
-                        error_response = base64.b64encode(b"HTTP/1.1 500 Internal Server Error\r\nContent-Type: text/plain\r\nContent-Length: 21\r\n\r\nInternal Server Error").decode('utf-8')
-                        msg_id = str(uuid.uuid4())
-                        await write_json_message(server_writer, msg_id, "http.response", error_response, request_msg_id)
+                    # Queued by priority until one of the MAX_CONCURRENT_REQUESTS slots is free (the dispatcher
+                    # limits how many it sends), so urgent requests overtake the ones still waiting
+                    link.request_queue.put(parse_priority(request_msg.get("priority")), request_msg.get("id", ""), (time.monotonic(), request_msg))
+                elif request_msg.get("type") == RESPONSE_ACK_TYPE:
+                    # Dispatcher handed streamed bytes to the user, extend the window
+                    credit = link.response_credits.get(request_msg.get("reply", ""))
+                    if credit:
+                        credit.grant(int(request_msg.get("data", {}).get("bytes", 0)))
+                elif request_msg.get("type") == SESSIONS_ENDED_TYPE:
+                    end_sessions(link, request_msg.get("data", {}).get("sessions", []))
+                elif request_msg.get("type") == CANCEL_TYPE:
+                    # Dispatcher gave up on the request (deadline), stop waiting on the HTTP server
+                    task = link.request_tasks.get(request_msg.get("reply", ""))
+                    if task:
+                        logging.warning(f"[CLIENT][HTTP] Request {request_msg.get('reply')} cancelled by dispatcher")
+                        task.cancel()
+                    elif link.request_queue.remove(request_msg.get("reply", "")):
+                        logging.warning(f"[CLIENT][HTTP] Queued request {request_msg.get('reply')} cancelled by dispatcher")
                 else:
                     logging.warning(f"[CLIENT][JSON] Unknown message type: {request_msg.get('type')}")
                     
         except Exception as e:
-            logging.error(f"[CLIENT][CONN] Connection error: {e}. Reconnecting...")
+            logging.error(f"[CLIENT][CONN] Dispatcher({address}) connection error: {e}. Reconnecting...")
         finally:
+            if link is not None and links.get(address) is link:
+                del links[address]
+                failover_task = asyncio.create_task(failover_sessions(address))
             # Cancel the heartbeat task if running
             if heartbeat_task:
                 try:
                     heartbeat_task.cancel()
                 except Exception as e:
                     pass
+            if relay_task:
+                relay_task.cancel()
+            # Abandon in-flight requests, the dispatcher can't receive their replies anymore
+            if link:
+                for task in list(link.request_tasks.values()):
+                    task.cancel()
             # Ensure dispatcher connection is properly closed
             if server_writer:
                 try:
@@ -253,7 +611,15 @@ async def handle_dispatcher_connection():
                     await server_writer.wait_closed()
                 except Exception as e:
                     pass
-        await asyncio.sleep(10)
+        await asyncio.sleep(reconnect_delay(attempt))
+        attempt += 1
+
+async def main():
+    sampler = asyncio.create_task(sample_load_periodically())
+    # Identity and a first load sample before the first heartbeat
+    while not load_sample and not sampler.done():
+        await asyncio.sleep(0.05)
+    await asyncio.gather(sampler, *(handle_dispatcher_connection(address.strip()) for address in DISPATCHERS.split(",") if address.strip()))
 
 if __name__ == '__main__':
-    asyncio.run(handle_dispatcher_connection())
+    asyncio.run(main())
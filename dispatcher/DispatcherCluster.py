@@ -0,0 +1,256 @@
+#
+# Shared routing table for a cluster of dispatcher nodes (session -> owning node)
+#
+# python DispatcherCluster.py [port]   serves an in-memory table for the nodes over TCP (default 8030)
+#
+#==========  IMPORTS AND CONFIGURATION  ==========
+import asyncio
+import itertools
+import json
+import logging
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s %(message)s')
+
+#==========  CONSTANTS AND CONFIGURATION  ==========
+ROUTING_PORT = 8030
+
+# A node that hasn't registered for this long is left out of nodes()
+NODE_TIMEOUT = 30.0
+
+# Seconds to wait for the table server before treating a lookup as failed
+ROUTING_TIMEOUT = 2.0
+
+# Sessions whose node a RemoteRoutingTable remembers, and for how long (seconds): a session that moves
+# to another node (its crawler reconnected there) reaches the old one at most this much longer
+ROUTE_CACHE_SIZE = 10000
+ROUTE_CACHE_TTL = 5.0
+
+#==========  ROUTING TABLE  ==========
+class RoutingTable:
+    """Where each session lives (node address, host:port of its HTTP listener) and which nodes are up.
+
+    Implementations are shared by every node of the cluster; see make_routing_table().
+    """
+    async def get(self, session_id: str) -> Optional[str]:
+        raise NotImplementedError
+
+    async def set(self, session_id: str, node: str) -> None:
+        raise NotImplementedError
+
+    async def delete(self, session_id: str) -> None:
+        raise NotImplementedError
+
+    async def register_node(self, node: str, info: Dict[str, Any]) -> None:
+        """Announce a node (and its free capacity), repeated periodically"""
+        raise NotImplementedError
+
+    async def nodes(self) -> Dict[str, Dict[str, Any]]:
+        """Nodes that registered within NODE_TIMEOUT"""
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+class InMemoryRoutingTable(RoutingTable):
+    """Table held in this process, for a single node, tests, and behind RoutingTableServer"""
+    def __init__(self):
+        self.routes: Dict[str, str] = {}
+        self._nodes: Dict[str, Dict[str, Any]] = {}
+
+    async def get(self, session_id: str) -> Optional[str]:
+        return self.routes.get(session_id)
+
+    async def set(self, session_id: str, node: str) -> None:
+        self.routes[session_id] = node
+
+    async def delete(self, session_id: str) -> None:
+        self.routes.pop(session_id, None)
+
+    async def register_node(self, node: str, info: Dict[str, Any]) -> None:
+        self._nodes[node] = {**info, "seen": time.time()}
+
+    async def nodes(self) -> Dict[str, Dict[str, Any]]:
+        now = time.time()
+        return {node: info for node, info in self._nodes.items() if now - info["seen"] < NODE_TIMEOUT}
+
+class RemoteRoutingTable(RoutingTable):
+    """Client of a RoutingTableServer over a persistent connection, one JSON line per request and per reply.
+
+    Requests carry an id the server echoes, so callers share the connection without waiting for each
+    other and one that gives up (cancelled, timed out) doesn't leave its reply for the next. Lookups
+    are cached for ROUTE_CACHE_TTL, set() and delete() from this node update the cache.
+    """
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reply_task: Optional[asyncio.Task] = None
+        self._connect_lock = asyncio.Lock()
+        self._ids = itertools.count()
+        self._waiting: Dict[int, asyncio.Future] = {}  # request id -> reply
+        self._routes: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()  # session -> (node, expiry)
+
+    async def _connect(self) -> asyncio.StreamWriter:
+        async with self._connect_lock:
+            if self._writer is None or self._writer.is_closing():
+                self._reader, self._writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), ROUTING_TIMEOUT)
+                self._reply_task = asyncio.create_task(self._read_replies(self._reader, self._writer))
+            return self._writer
+
+    async def _read_replies(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        error: Exception = ConnectionError("routing table server closed the connection")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                reply = json.loads(line)
+                # Servers that don't echo ids answer in order
+                future = self._waiting.pop(reply.get("id", next(iter(self._waiting), None)), None)
+                if future is not None and not future.done():
+                    future.set_result(reply)
+        except (OSError, ValueError, asyncio.IncompleteReadError) as e:
+            error = ConnectionError(str(e))
+        finally:
+            self._disconnect(writer, error)
+
+    def _disconnect(self, writer: asyncio.StreamWriter, error: Exception) -> None:
+        """Drop the connection and fail the requests still waiting on it"""
+        writer.close()
+        if self._writer is writer:
+            self._writer = None
+            for future in self._waiting.values():
+                if not future.done():
+                    future.set_exception(error)
+            self._waiting.clear()
+
+    async def _call(self, op: str, **args: Any) -> Any:
+        for attempt in range(2):
+            writer = None
+            request_id = next(self._ids)
+            try:
+                writer = await self._connect()
+                future = self._waiting[request_id] = asyncio.get_running_loop().create_future()
+                writer.write(json.dumps({"id": request_id, "op": op, **args}).encode('utf-8') + b'\n')
+                await writer.drain()
+                reply = await asyncio.wait_for(future, ROUTING_TIMEOUT)
+                if "error" in reply:
+                    raise RuntimeError(reply["error"])
+                return reply.get("value")
+            except (OSError, asyncio.TimeoutError) as e:
+                # Start over on a fresh connection once, the server may have restarted
+                if writer is not None:
+                    self._disconnect(writer, ConnectionError(f"routing table {self.host}:{self.port} unavailable: {e}"))
+                if attempt:
+                    raise ConnectionError(f"routing table {self.host}:{self.port} unavailable: {e}")
+            finally:
+                self._waiting.pop(request_id, None)
+
+    def _remember(self, session_id: str, node: str) -> None:
+        self._routes[session_id] = (node, time.monotonic() + ROUTE_CACHE_TTL)
+        self._routes.move_to_end(session_id)
+        if len(self._routes) > ROUTE_CACHE_SIZE:
+            self._routes.popitem(last=False)
+
+    async def get(self, session_id: str) -> Optional[str]:
+        cached = self._routes.get(session_id)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+        node = await self._call("get", key=session_id)
+        if node is not None:
+            self._remember(session_id, node)
+        else:
+            self._routes.pop(session_id, None)
+        return node
+
+    async def set(self, session_id: str, node: str) -> None:
+        self._remember(session_id, node)
+        await self._call("set", key=session_id, value=node)
+
+    async def delete(self, session_id: str) -> None:
+        self._routes.pop(session_id, None)
+        await self._call("delete", key=session_id)
+
+    async def register_node(self, node: str, info: Dict[str, Any]) -> None:
+        await self._call("register", key=node, value=info)
+
+    async def nodes(self) -> Dict[str, Dict[str, Any]]:
+        return await self._call("nodes") or {}
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            self._disconnect(self._writer, ConnectionError("routing table closed"))
+
+def make_routing_table(url: str) -> Optional[RoutingTable]:
+    """Routing table from DISPATCHER_ROUTING_TABLE: "" (no cluster), "memory" or "tcp://host:port" """
+    if not url:
+        return None
+    if url == "memory":
+        return InMemoryRoutingTable()
+    if url.startswith("tcp://"):
+        host, _, port = url[len("tcp://"):].rpartition(":")
+        return RemoteRoutingTable(host or "127.0.0.1", int(port or ROUTING_PORT))
+    raise ValueError(f"Unknown routing table '{url}', expected 'memory' or 'tcp://host:port'")
+
+#==========  ROUTING TABLE SERVER  ==========
+class RoutingTableServer:
+    """Serves an InMemoryRoutingTable to the nodes of a cluster"""
+    def __init__(self, table: Optional[InMemoryRoutingTable] = None):
+        self.table = table or InMemoryRoutingTable()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        addr = writer.get_extra_info('peername')
+        logging.info(f"[ROUTING] Node connected: {addr}")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request = {}
+                try:
+                    request = json.loads(line)
+                    op, key, value = request.get("op"), request.get("key"), request.get("value")
+                    if op == "get":
+                        reply = {"value": await self.table.get(key)}
+                    elif op == "set":
+                        await self.table.set(key, value)
+                        reply = {}
+                    elif op == "delete":
+                        await self.table.delete(key)
+                        reply = {}
+                    elif op == "register":
+                        await self.table.register_node(key, value or {})
+                        reply = {}
+                    elif op == "nodes":
+                        reply = {"value": await self.table.nodes()}
+                    else:
+                        reply = {"error": f"unknown op {op}"}
+                except (ValueError, AttributeError) as e:
+                    reply = {"error": str(e)}
+                # Echo the request id, the node matches replies by it
+                if isinstance(request, dict) and "id" in request:
+                    reply["id"] = request["id"]
+                writer.write(json.dumps(reply).encode('utf-8') + b'\n')
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            logging.warning(f"[ROUTING] Node {addr} connection error: {e}")
+        finally:
+            writer.close()
+            logging.info(f"[ROUTING] Node disconnected: {addr}")
+
+async def serve(port: int = ROUTING_PORT) -> None:
+    server = await asyncio.start_server(RoutingTableServer().handle, '0.0.0.0', port)
+    async with server:
+        logging.info(f"[ROUTING] Routing table server started on 0.0.0.0:{port}")
+        await server.serve_forever()
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(serve(int(sys.argv[1]) if len(sys.argv) > 1 else ROUTING_PORT))
+    except KeyboardInterrupt:
+        logging.info("[ROUTING] Server stopped by user (Ctrl+C)")
@@ -0,0 +1,410 @@
+#
+# HTTP/1.1 helpers shared by the dispatcher processes
+#
+import asyncio
+import collections
+import logging
+import time
+from typing import AsyncIterator, Deque, Dict, List, NamedTuple, Optional, Tuple
+
+HEADER_END = b'\r\n\r\n'
+CRLF = b'\r\n'
+MAX_BODY_SIZE = 64 * 1024 * 1024
+
+# Requests that may be sent twice (RFC 9110 9.2.2), the pool retries only these once they reached the server
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS', 'TRACE'}
+
+#==========  MESSAGE PARSING  ==========
+def parse_head(head: bytes) -> Tuple[str, Dict[str, str]]:
+    """Split a request/response head into its start line and lower-cased headers"""
+    lines = head.decode('latin-1').split('\r\n')
+    headers: Dict[str, str] = {}
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return lines[0], headers
+
+def parse_server_timing(value: Optional[str]) -> Dict[str, float]:
+    """Durations (ms) of a Server-Timing header: "uia;dur=12.5, chrome;dur=80" -> {"uia": 12.5, "chrome": 80.0}"""
+    timing: Dict[str, float] = {}
+    for entry in (value or "").split(","):
+        name, *params = [part.strip() for part in entry.split(";")]
+        for param in params:
+            key, _, number = param.partition("=")
+            if name and key.strip().lower() == "dur":
+                try:
+                    timing[name] = timing.get(name, 0.0) + float(number.strip().strip('"'))
+                except ValueError:
+                    pass
+    return timing
+
+class HttpError(Exception):
+    """Malformed or unacceptable request, answered with status and closed"""
+
+    def __init__(self, status: int, reason: str):
+        super().__init__(f"{status} {reason}")
+        self.status = status
+        self.reason = reason
+
+    def response(self) -> bytes:
+        body = self.reason.encode('latin-1')
+        return f"HTTP/1.1 {self.status} {self.reason}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body
+
+class HttpRequest(NamedTuple):
+    method: str
+    url: str
+    lines: List[bytes]       # request line and header lines as received, each ending with CRLF
+    headers: Dict[str, str]  # lower-cased names
+    body: bytes
+
+class ResponseHead(NamedTuple):
+    raw: bytes
+    status_code: int
+    headers: Dict[str, str]
+    keep_alive: bool
+
+async def iter_chunked_body(reader: asyncio.StreamReader, chunk_size: Optional[int] = None) -> AsyncIterator[bytes]:
+    """Yield a chunked body exactly as received (size lines, data, trailers), data split at chunk_size"""
+    while True:
+        size_line = await reader.readuntil(CRLF)
+        size = int(size_line.split(b';', 1)[0].strip(), 16)
+        if size == 0:
+            # Trailer section ends with an empty line
+            parts = [size_line]
+            while True:
+                line = await reader.readuntil(CRLF)
+                parts.append(line)
+                if line == CRLF:
+                    yield b''.join(parts)
+                    return
+        remaining = size + len(CRLF)
+        if chunk_size is None or remaining <= chunk_size:
+            yield size_line + await reader.readexactly(remaining)
+            continue
+        yield size_line
+        while remaining:
+            part = await reader.readexactly(min(remaining, chunk_size))
+            remaining -= len(part)
+            yield part
+
+async def read_chunked_body(reader: asyncio.StreamReader, parts: List[bytes]) -> None:
+    """Append a chunked body to parts exactly as received"""
+    async for part in iter_chunked_body(reader):
+        parts.append(part)
+
+async def read_request(reader: asyncio.StreamReader, max_body_size: int = MAX_BODY_SIZE) -> Optional[HttpRequest]:
+    """Read one request from the reader's buffer (whole header block at once), None on clean close.
+
+    Chunked bodies are decoded and the request rewritten with a Content-Length, so it can be
+    relayed and inspected like any other.
+    """
+    try:
+        head = await reader.readuntil(HEADER_END)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial.strip():
+            return None
+        raise HttpError(400, "Bad Request")
+    except asyncio.LimitOverrunError:
+        raise HttpError(431, "Request Header Fields Too Large")
+
+    # Ignore empty lines between pipelined requests (RFC 9112 2.2)
+    head = head.lstrip(CRLF)
+    lines = [line + CRLF for line in head[:-len(HEADER_END)].split(CRLF)]
+    parts = lines[0].decode('latin-1').split()
+    if len(parts) < 2:
+        raise HttpError(400, "Bad Request")
+    method, url = parts[0].upper(), parts[1]
+
+    headers: Dict[str, str] = {}
+    for line in lines[1:]:
+        name, sep, value = line.decode('latin-1').partition(':')
+        if not sep:
+            raise HttpError(400, "Bad Request")
+        headers[name.strip().lower()] = value.strip()
+
+    if 'chunked' in headers.get('transfer-encoding', '').lower():
+        chunks: List[bytes] = []
+        size = 0
+        while True:
+            try:
+                size_line = await reader.readuntil(CRLF)
+                chunk_size = int(size_line.split(b';', 1)[0].strip(), 16)
+            except (asyncio.LimitOverrunError, ValueError):
+                raise HttpError(400, "Bad Request")
+            if chunk_size == 0:
+                # Discard trailers
+                try:
+                    while await reader.readuntil(CRLF) != CRLF:
+                        pass
+                except asyncio.LimitOverrunError:
+                    raise HttpError(400, "Bad Request")
+                break
+            size += chunk_size
+            if size > max_body_size:
+                raise HttpError(413, "Payload Too Large")
+            chunks.append((await reader.readexactly(chunk_size + len(CRLF)))[:-len(CRLF)])
+        body = b''.join(chunks)
+        lines = [line for line in lines if not line.lower().startswith((b'transfer-encoding:', b'content-length:'))]
+        lines.append(f"Content-Length: {len(body)}\r\n".encode('latin-1'))
+        headers.pop('transfer-encoding')
+        headers['content-length'] = str(len(body))
+    else:
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise HttpError(400, "Bad Request")
+        if length > max_body_size:
+            raise HttpError(413, "Payload Too Large")
+        body = await reader.readexactly(length) if length > 0 else b""
+
+    return HttpRequest(method, url, lines, headers, body)
+
+async def read_response_head(reader: asyncio.StreamReader) -> ResponseHead:
+    """Read the status line and headers of an HTTP response"""
+    head = await reader.readuntil(HEADER_END)
+    status_line, headers = parse_head(head)
+    version, _, rest = status_line.partition(' ')
+    status_code = int(rest.split(' ', 1)[0])
+    connection = headers.get('connection', '').lower()
+    keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+    if 'chunked' not in headers.get('transfer-encoding', '').lower() and 'content-length' not in headers:
+        # Body delimited by connection close
+        keep_alive = keep_alive and (status_code < 200 or status_code in (204, 304))
+    return ResponseHead(head, status_code, headers, keep_alive)
+
+async def iter_response_body(reader: asyncio.StreamReader, head: ResponseHead, method: str = 'GET', chunk_size: Optional[int] = None) -> AsyncIterator[bytes]:
+    """Yield the raw body of a response in pieces of at most chunk_size (whole body if None)"""
+    if method == 'HEAD' or head.status_code < 200 or head.status_code in (204, 304):
+        return
+    if 'chunked' in head.headers.get('transfer-encoding', '').lower():
+        async for part in iter_chunked_body(reader, chunk_size):
+            yield part
+    elif 'content-length' in head.headers:
+        remaining = int(head.headers['content-length'])
+        while remaining:
+            part = await reader.readexactly(remaining if chunk_size is None else min(remaining, chunk_size))
+            remaining -= len(part)
+            yield part
+    else:
+        while True:
+            part = await reader.read(-1 if chunk_size is None else chunk_size)
+            if not part:
+                return
+            yield part
+
+async def read_response(reader: asyncio.StreamReader, method: str = 'GET') -> Tuple[bytes, bool]:
+    """Read one HTTP response, return its raw bytes and whether the connection can be reused"""
+    head = await read_response_head(reader)
+    parts = [head.raw]
+    async for part in iter_response_body(reader, head, method):
+        parts.append(part)
+    return b''.join(parts), head.keep_alive
+
+def set_keep_alive(request: bytes) -> Tuple[bytes, str]:
+    """Replace the Connection header of a raw request with keep-alive, return the request and its method"""
+    head_end = request.find(HEADER_END)
+    if head_end < 0:
+        return request, 'GET'
+    lines = request[:head_end].split(CRLF)
+    method = lines[0].split(b' ', 1)[0].decode('latin-1').upper()
+    lines = [lines[0]] + [line for line in lines[1:] if not line.lower().startswith(b'connection:')]
+    lines.append(b'Connection: keep-alive')
+    return CRLF.join(lines) + request[head_end:], method
+
+#==========  PIPELINING  ==========
+class ResponseSlot:
+    """Place of one response on a user connection; writes are held back until earlier responses are done"""
+
+    def __init__(self, sequencer: 'ResponseSequencer'):
+        self._sequencer = sequencer
+        self._buffer: List[bytes] = []
+        self._is_head = asyncio.Event()
+        self.finished = False
+
+    def write(self, data: bytes) -> None:
+        if self.finished or self._sequencer.writer.is_closing():
+            return
+        if self._is_head.is_set():
+            self._sequencer.writer.write(data)
+        else:
+            self._buffer.append(data)
+
+    async def drain(self) -> None:
+        """Wait until this response is at the front of the connection and its bytes have been taken"""
+        await self._is_head.wait()
+        await self._sequencer.writer.drain()
+
+    def is_closing(self) -> bool:
+        return self._sequencer.writer.is_closing()
+
+    def finish(self) -> None:
+        """Mark the response complete so the next one in line may be written"""
+        if not self.finished:
+            self.finished = True
+            self._sequencer._advance()
+
+    def abort(self) -> None:
+        """Drop the connection, used when a response can't be completed"""
+        self.finish()
+        self._sequencer.writer.close()
+
+class ResponseSequencer:
+    """Keeps responses on one keep-alive connection in request order (HTTP/1.1 pipelining)"""
+
+    def __init__(self, writer: asyncio.StreamWriter, max_outstanding: int):
+        self.writer = writer
+        self.max_outstanding = max_outstanding
+        self._slots: Deque[ResponseSlot] = collections.deque()
+        self._changed = asyncio.Event()
+
+    def open_slot(self) -> ResponseSlot:
+        slot = ResponseSlot(self)
+        self._slots.append(slot)
+        self._advance()
+        return slot
+
+    def _advance(self) -> None:
+        # Flush the front response, and keep going while it is already complete
+        while self._slots:
+            head = self._slots[0]
+            if head._buffer:
+                if not self.writer.is_closing():
+                    self.writer.writelines(head._buffer)
+                head._buffer.clear()
+            head._is_head.set()
+            if not head.finished:
+                break
+            self._slots.popleft()
+        self._changed.set()
+
+    @property
+    def outstanding(self) -> int:
+        return len(self._slots)
+
+    async def _wait_until(self, limit: int) -> None:
+        while len(self._slots) > limit:
+            self._changed.clear()
+            await self._changed.wait()
+
+    async def wait_capacity(self) -> None:
+        """Wait until another request may be read from the connection"""
+        await self._wait_until(self.max_outstanding - 1)
+
+    async def wait_idle(self) -> None:
+        """Wait until every outstanding response has been written"""
+        await self._wait_until(0)
+
+#==========  KEEP-ALIVE CONNECTION POOL  ==========
+class HttpConnectionPool:
+    """Pool of keep-alive HTTP/1.1 connections to one host (or Unix socket path), with reuse and latency counters"""
+
+    def __init__(self, host: Optional[str], port: Optional[int], max_idle: int = 16, idle_timeout: float = 4.0, path: Optional[str] = None):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.max_idle = max_idle
+        # Close idle connections before the server's keep-alive timeout (uvicorn: 5s) does
+        self.idle_timeout = idle_timeout
+        self._idle: Deque[Tuple[asyncio.StreamReader, asyncio.StreamWriter, float]] = collections.deque()
+        self.requests = 0
+        self.reused = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    async def _acquire(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter, bool]:
+        now = time.monotonic()
+        while self._idle:
+            reader, writer, last_used = self._idle.pop()
+            if now - last_used < self.idle_timeout and not writer.is_closing() and not reader.at_eof():
+                return reader, writer, True
+            self._discard(writer)
+        if self.path:
+            reader, writer = await asyncio.open_unix_connection(self.path)
+        else:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+        return reader, writer, False
+
+    def _release(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        if len(self._idle) >= self.max_idle:
+            self._discard(writer)
+            return
+        self._idle.append((reader, writer, time.monotonic()))
+
+    @staticmethod
+    def _discard(writer: asyncio.StreamWriter) -> None:
+        try:
+            writer.close()
+        except Exception as e:
+            logging.error(f"[HTTP][POOL] Error closing connection: {e}")
+
+    async def stream(self, request: bytes, chunk_size: Optional[int] = None) -> AsyncIterator[bytes]:
+        """Send a raw HTTP request over a pooled connection and yield the raw response as it arrives"""
+        request, method = set_keep_alive(request)
+        started = time.monotonic()
+        while True:
+            reader, writer, reused = await self._acquire()
+            written = False
+            try:
+                writer.write(request)
+                await writer.drain()
+                written = True
+                head = await read_response_head(reader)
+            except (asyncio.IncompleteReadError, ConnectionError) as e:
+                self._discard(writer)
+                # The server may have closed an idle connection just before we used it, retry on a fresh one;
+                # unless it may have acted on the request already (/api/start, /api/click ... are POSTs)
+                if reused and (not written or method in IDEMPOTENT_METHODS) and (not isinstance(e, asyncio.IncompleteReadError) or not e.partial):
+                    continue
+                raise
+            except BaseException:
+                self._discard(writer)
+                raise
+            break
+
+        complete = False
+        try:
+            yield head.raw
+            async for part in iter_response_body(reader, head, method, chunk_size):
+                yield part
+            complete = True
+        finally:
+            # A response abandoned half way leaves the connection unusable
+            if complete and head.keep_alive:
+                self._release(reader, writer)
+            else:
+                self._discard(writer)
+            if complete:
+                latency = time.monotonic() - started
+                self.requests += 1
+                self.reused += 1 if reused else 0
+                self.latency_total += latency
+                self.latency_max = max(self.latency_max, latency)
+
+    async def request(self, request: bytes) -> bytes:
+        """Send a raw HTTP request over a pooled connection and return the raw response"""
+        parts = []
+        response = self.stream(request)
+        try:
+            async for part in response:
+                parts.append(part)
+        finally:
+            # Close the connection right away if the caller was cancelled
+            await response.aclose()
+        return b''.join(parts)
+
+    def stats(self) -> Dict[str, float]:
+        """Connection reuse rate and request latency since start"""
+        return {
+            "requests": self.requests,
+            "reuse_rate": round(self.reused / self.requests, 3) if self.requests else 0.0,
+            "latency_avg_ms": round(self.latency_total * 1000 / self.requests, 1) if self.requests else 0.0,
+            "latency_max_ms": round(self.latency_max * 1000, 1),
+            "idle": len(self._idle),
+        }
+
+    def close(self) -> None:
+        while self._idle:
+            _, writer, _ = self._idle.pop()
+            self._discard(writer)
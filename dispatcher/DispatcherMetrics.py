@@ -0,0 +1,130 @@
+#
+# Prometheus text exposition of dispatcher metrics (counters, gauges, pre-bucketed histograms)
+#
+# Recording happens on the event loop (or is handed to it) and only bumps numbers in place: label
+# children are created on first use and kept, histograms have fixed buckets. Gauges are read from
+# dispatcher state by callbacks when /metrics is scraped.
+#
+#==========  IMPORTS AND CONFIGURATION  ==========
+import bisect
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple, Union
+
+#==========  CONSTANTS AND CONFIGURATION  ==========
+# Upper bounds (seconds) of request latency buckets, relayed requests run from milliseconds to minutes
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+# Database flushes and event loop lag
+SHORT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+LabelValues = Tuple[str, ...]
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: Union[int, float]) -> str:
+    if isinstance(value, float):
+        if value == float("inf"):
+            return "+Inf"
+        return repr(value)
+    return str(value)
+
+#==========  METRIC TYPES  ==========
+class Counter:
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self._values: Dict[LabelValues, float] = {}
+        if not self.label_names:
+            self._values[()] = 0  # exported from the start
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for values, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.label_names, values)} {_format_value(value)}")
+        return lines
+
+class _HistogramChild:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, size: int):
+        self.counts = [0] * size  # per bucket, the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._children: Dict[LabelValues, _HistogramChild] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        child = self._children.get(label_values)
+        if child is None:
+            child = self._children[label_values] = _HistogramChild(len(self.buckets) + 1)
+        child.counts[bisect.bisect_left(self.buckets, value)] += 1
+        child.sum += value
+        child.count += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                le = 'le="' + _format_value(float(bound)) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, values)} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, values)} {child.count}")
+        return lines
+
+class Gauge:
+    """Read at scrape time: collect() returns (label values, value) pairs"""
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str], collect: Callable[[], Iterable[Tuple[LabelValues, float]]]):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for values, value in self.collect():
+            lines.append(f"{self.name}{_format_labels(self.label_names, values)} {_format_value(value)}")
+        return lines
+
+#==========  REGISTRY  ==========
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: List[Union[Counter, Histogram, Gauge]] = []
+
+    def counter(self, name: str, help_text: str, label_names: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help_text, label_names)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, label_names: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, label_names, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help_text: str, collect: Callable[[], Iterable[Tuple[LabelValues, float]]], label_names: Sequence[str] = ()) -> Gauge:
+        metric = Gauge(name, help_text, label_names, collect)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> bytes:
+        """All metrics in the Prometheus text format (version 0.0.4)"""
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return ("\n".join(lines) + "\n").encode("utf-8")
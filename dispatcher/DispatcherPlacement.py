@@ -0,0 +1,311 @@
+#
+# Placement of new sessions (/api/start) on connected clients
+#
+#==========  IMPORTS AND CONFIGURATION  ==========
+import asyncio
+import bisect
+import hashlib
+import heapq
+import itertools
+import random
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+#==========  CONSTANTS AND CONFIGURATION  ==========
+# least-loaded score weights: CPU %, memory % and sessions / max_browser_count, each scaled to 0..1
+LOAD_WEIGHTS = (0.4, 0.2, 0.4)
+
+# Points per client on the consistent hashing ring
+HASH_RING_REPLICAS = 100
+
+# Recent admission waits kept for the wait-time figures
+ADMISSION_WAIT_SAMPLES = 1000
+
+#==========  SESSION PLACEMENT  ==========
+class SessionPlacement:
+    """Active-session counters per client and a heap of online clients by session count.
+
+    Counters are updated when sessions start and end, so picking a client is O(log n) in the
+    number of clients instead of a recount over every session. Heap entries are invalidated
+    lazily: a popped entry whose count is stale (or whose client went offline or is full) is
+    dropped. Ties go to the client that connected first, like the original scan over `clients`.
+    """
+    def __init__(self, strategy: Optional["PlacementStrategy"] = None):
+        self.strategy = strategy or LeastSessionsStrategy()
+        self.version = 0  # bumped when the set of online clients changes
+        self.active: Dict[str, int] = {}  # client uuid -> active sessions (kept across reconnects)
+        self._capacity: Dict[str, int] = {}  # online clients -> max_browser_count
+        self._order: Dict[str, int] = {}  # client uuid -> connect order, tie-breaker
+        self._heap: List[Tuple[int, int, str]] = []  # (active sessions, connect order, client uuid)
+        self._sequence = itertools.count()
+        self._load: Dict[str, Tuple[float, float]] = {}  # client uuid -> (cpu %, memory %) from the last heartbeat
+        self._online: List[str] = []  # online clients, for random sampling
+        self._online_index: Dict[str, int] = {}
+
+    def add_client(self, client_uuid: str, max_browser_count: int) -> None:
+        """A client connected (or reconnected) and can take sessions"""
+        self._capacity[client_uuid] = max_browser_count
+        self._order[client_uuid] = next(self._sequence)
+        self.active.setdefault(client_uuid, 0)
+        if client_uuid not in self._online_index:
+            self._online_index[client_uuid] = len(self._online)
+            self._online.append(client_uuid)
+            self.version += 1
+        self._push(client_uuid)
+
+    def remove_client(self, client_uuid: str) -> None:
+        """A client disconnected, its sessions stay counted until they end"""
+        self._capacity.pop(client_uuid, None)
+        self._load.pop(client_uuid, None)
+        index = self._online_index.pop(client_uuid, None)
+        if index is not None:
+            last = self._online.pop()
+            if last != client_uuid:
+                self._online[index] = last
+                self._online_index[last] = index
+            self.version += 1
+
+    def update_load(self, client_uuid: str, cpu_usage: Optional[float], memory_usage: Optional[float]) -> None:
+        """CPU and memory usage reported by the client's heartbeat"""
+        if client_uuid in self._capacity:
+            self._load[client_uuid] = (cpu_usage or 0.0, memory_usage or 0.0)
+
+    def set_capacity(self, client_uuid: str, max_browser_count: int) -> None:
+        if client_uuid in self._capacity:
+            self._capacity[client_uuid] = max_browser_count
+            self._push(client_uuid)
+
+    def session_started(self, client_uuid: str) -> None:
+        self.active[client_uuid] = self.active.get(client_uuid, 0) + 1
+        self._push(client_uuid)
+
+    def session_ended(self, client_uuid: str) -> None:
+        count = self.active.get(client_uuid, 0) - 1
+        if count > 0 or client_uuid in self._capacity:
+            self.active[client_uuid] = max(0, count)
+        else:
+            # Offline and idle, nothing left to remember
+            self.active.pop(client_uuid, None)
+        self._push(client_uuid)
+
+    def has_capacity(self, client_uuid: str) -> bool:
+        capacity = self._capacity.get(client_uuid)
+        return capacity is not None and self.active.get(client_uuid, 0) < capacity
+
+    def online(self) -> List[str]:
+        return self._online
+
+    def free_browsers(self) -> int:
+        """Sessions the online clients can still take"""
+        return sum(max(0, capacity - self.active.get(c, 0)) for c, capacity in self._capacity.items())
+
+    def load_score(self, client_uuid: str) -> float:
+        """Weighted mix of CPU, memory and session usage, lower is better"""
+        cpu, memory = self._load.get(client_uuid, (0.0, 0.0))
+        capacity = self._capacity.get(client_uuid) or 1
+        w_cpu, w_memory, w_sessions = LOAD_WEIGHTS
+        return w_cpu * cpu / 100 + w_memory * memory / 100 + w_sessions * self.active.get(client_uuid, 0) / capacity
+
+    def pick(self, key: Optional[str] = None) -> Optional[str]:
+        """Client for a new session according to the configured strategy, None if all are full"""
+        return self.strategy.pick(self, key)
+
+    def least_sessions(self) -> Optional[str]:
+        """The online client with the fewest active sessions below its max_browser_count"""
+        heap = self._heap
+        while heap:
+            count, order, client_uuid = heap[0]
+            if count == self.active.get(client_uuid) and order == self._order.get(client_uuid) and self.has_capacity(client_uuid):
+                return client_uuid
+            heapq.heappop(heap)
+        return None
+
+    def _push(self, client_uuid: str) -> None:
+        if not self.has_capacity(client_uuid):
+            return
+        heapq.heappush(self._heap, (self.active[client_uuid], self._order[client_uuid], client_uuid))
+        # Stale entries only leave the heap when they reach the top, rebuild before it grows large
+        if len(self._heap) > 4 * len(self._capacity) + 64:
+            self._heap = [(self.active[c], self._order[c], c) for c in self._capacity if self.has_capacity(c)]
+            heapq.heapify(self._heap)
+
+#==========  PLACEMENT STRATEGIES  ==========
+class PlacementStrategy:
+    """Chooses the client for a new session, `key` is the caller's placement key (if any)"""
+    name = ""
+
+    def pick(self, placement: SessionPlacement, key: Optional[str] = None) -> Optional[str]:
+        raise NotImplementedError
+
+class LeastSessionsStrategy(PlacementStrategy):
+    """Fewest active sessions (the original behaviour)"""
+    name = "least-sessions"
+
+    def pick(self, placement: SessionPlacement, key: Optional[str] = None) -> Optional[str]:
+        return placement.least_sessions()
+
+class LeastLoadedStrategy(PlacementStrategy):
+    """Lowest weighted mix of reported CPU, memory and session usage"""
+    name = "least-loaded"
+
+    def pick(self, placement: SessionPlacement, key: Optional[str] = None) -> Optional[str]:
+        candidates = [c for c in placement.online() if placement.has_capacity(c)]
+        return min(candidates, key=placement.load_score) if candidates else None
+
+class PowerOfTwoStrategy(PlacementStrategy):
+    """The less loaded of two random clients, cheap and avoids herding on stale heartbeats"""
+    name = "power-of-two"
+
+    def __init__(self, choices: int = 2, attempts: int = 8):
+        self.choices = choices
+        self.attempts = attempts
+
+    def pick(self, placement: SessionPlacement, key: Optional[str] = None) -> Optional[str]:
+        online = placement.online()
+        candidates = set()
+        for _ in range(self.attempts):
+            if len(candidates) >= self.choices or not online:
+                break
+            client_uuid = online[random.randrange(len(online))]
+            if placement.has_capacity(client_uuid):
+                candidates.add(client_uuid)
+        if not candidates:
+            # Mostly full, sampling keeps missing
+            return placement.least_sessions()
+        return min(candidates, key=placement.load_score)
+
+class ConsistentHashStrategy(PlacementStrategy):
+    """Same key (proxy, domain, ...) goes to the same client while it has room, for cache locality"""
+    name = "consistent-hash"
+
+    def __init__(self, replicas: int = HASH_RING_REPLICAS):
+        self.replicas = replicas
+        self._ring: List[Tuple[int, str]] = []
+        self._version = -1
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+    def pick(self, placement: SessionPlacement, key: Optional[str] = None) -> Optional[str]:
+        if not key:
+            return placement.least_sessions()
+        if self._version != placement.version:
+            self._ring = sorted((self._hash(f"{c}#{i}"), c) for c in placement.online() for i in range(self.replicas))
+            self._version = placement.version
+        if not self._ring:
+            return None
+        # Walk clockwise past clients that are full
+        start = bisect.bisect(self._ring, (self._hash(key), ""))
+        seen = set()
+        for i in range(len(self._ring)):
+            client_uuid = self._ring[(start + i) % len(self._ring)][1]
+            if client_uuid in seen:
+                continue
+            if placement.has_capacity(client_uuid):
+                return client_uuid
+            seen.add(client_uuid)
+            if len(seen) == len(placement.online()):
+                break
+        return None
+
+STRATEGIES = {cls.name: cls for cls in (LeastSessionsStrategy, LeastLoadedStrategy, PowerOfTwoStrategy, ConsistentHashStrategy)}
+
+def make_strategy(name: str) -> PlacementStrategy:
+    """Strategy by its config name, see STRATEGIES"""
+    try:
+        return STRATEGIES[name]()
+    except KeyError:
+        raise ValueError(f"Unknown placement strategy '{name}', expected one of: {', '.join(STRATEGIES)}")
+
+#==========  ADMISSION QUEUE  ==========
+class _Waiter:
+    __slots__ = ("key", "future", "enqueued")
+
+    def __init__(self, key: Optional[str], future: asyncio.Future, enqueued: float):
+        self.key = key
+        self.future = future
+        self.enqueued = enqueued
+
+class AdmissionQueue:
+    """/api/start callers waiting for a free browser slot, highest priority first, FIFO within a priority.
+
+    A new caller only skips the queue when nobody is waiting. When capacity frees up (dispatch()
+    after a session ends or a client connects) the head waiter gets the client with its session
+    already counted, so later arrivals can't take the slot in between.
+    """
+    def __init__(self, placement: SessionPlacement):
+        self.placement = placement
+        self._waiters: List[Tuple[int, int, _Waiter]] = []  # (-priority, arrival order, waiter)
+        self._sequence = itertools.count()
+        self.depth = 0  # waiters still waiting
+        self.queued = 0
+        self.admitted = 0
+        self.timed_out = 0
+        self._waits: deque = deque(maxlen=ADMISSION_WAIT_SAMPLES)  # seconds waited by queued callers
+
+    async def admit(self, key: Optional[str] = None, priority: int = 0, max_wait: float = 0.0) -> Optional[str]:
+        """Client uuid for a new session (already counted), None if none frees up within max_wait"""
+        if not self.depth:
+            client_uuid = self.placement.pick(key)
+            if client_uuid is not None:
+                self.placement.session_started(client_uuid)
+                self.admitted += 1
+                return client_uuid
+        if max_wait <= 0:
+            return None
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(key, loop.create_future(), loop.time())
+        heapq.heappush(self._waiters, (-priority, next(self._sequence), waiter))
+        self.depth += 1
+        self.queued += 1
+        self.dispatch()
+        try:
+            client_uuid = await asyncio.wait_for(waiter.future, max_wait)
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+            self.timed_out += 1
+            return None
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+        self._waits.append(loop.time() - waiter.enqueued)
+        return client_uuid
+
+    def _abandon(self, waiter: _Waiter) -> None:
+        if waiter.future.done() and not waiter.future.cancelled():
+            # Handed a client just as the caller gave up, pass the slot on
+            self.placement.session_ended(waiter.future.result())
+            self.dispatch()
+        else:
+            waiter.future.cancel()
+            self.depth -= 1
+
+    def dispatch(self) -> None:
+        """Hand free capacity to waiters in order"""
+        while self._waiters:
+            waiter = self._waiters[0][2]
+            if waiter.future.done():
+                # Timed out or cancelled, already taken out of depth
+                heapq.heappop(self._waiters)
+                continue
+            client_uuid = self.placement.pick(waiter.key)
+            if client_uuid is None:
+                break
+            heapq.heappop(self._waiters)
+            self.depth -= 1
+            self.placement.session_started(client_uuid)
+            self.admitted += 1
+            waiter.future.set_result(client_uuid)
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self._waits)
+        return {
+            "depth": self.depth,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "timed_out": self.timed_out,
+            "wait_avg_ms": round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+            "wait_p95_ms": round(waits[min(len(waits) - 1, int(0.95 * len(waits)))] * 1000, 1) if waits else 0.0,
+            "wait_max_ms": round(waits[-1] * 1000, 1) if waits else 0.0,
+        }
@@ -0,0 +1,179 @@
+#
+# Per-domain politeness for /api/go: token bucket rate and concurrent navigation cap by registrable domain
+#
+#==========  IMPORTS AND CONFIGURATION  ==========
+import asyncio
+import ipaddress
+import json
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+#==========  CONSTANTS AND CONFIGURATION  ==========
+# Second-level labels under which registrations happen one level deeper (example.co.uk, example.com.au)
+SECOND_LEVEL_LABELS = {"ac", "co", "com", "edu", "gov", "net", "org", "ne", "or", "go", "gob", "mil", "nom", "ltd", "plc"}
+
+#==========  REGISTRABLE DOMAIN  ==========
+def registrable_domain(url: Optional[str]) -> Optional[str]:
+    """example.com for https://www.shop.example.com/x, example.co.uk for a.example.co.uk, the host for IPs.
+
+    A short list of second-level labels stands in for the public suffix list.
+    """
+    if not url:
+        return None
+    try:
+        host = urlsplit(url if "//" in url else "//" + url).hostname
+    except ValueError:
+        return None
+    if not host:
+        return None
+    host = host.rstrip(".")
+    try:
+        ipaddress.ip_address(host)
+        return host
+    except ValueError:
+        pass
+    labels = host.split(".")
+    if len(labels) > 2 and labels[-2] in SECOND_LEVEL_LABELS and len(labels[-1]) == 2:
+        return ".".join(labels[-3:])
+    return ".".join(labels[-2:])
+
+#==========  DOMAIN LIMITS  ==========
+@dataclass
+class DomainLimit:
+    rate: float  # navigations per second (0: no rate limit)
+    burst: int  # navigations that may start at once after an idle period
+    concurrency: int  # navigations in flight at the same time (0: no cap)
+
+def load_overrides(path: str) -> Dict[str, Dict[str, Any]]:
+    """Per-domain limits from a JSON file: {"example.com": {"rate": 0.2, "burst": 1, "concurrency": 2}, ...}
+
+    Fields left out of an entry keep the default's value, see PolitenessLimiter.
+    """
+    if not path:
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return {domain.lower(): limit for domain, limit in json.load(f).items()}
+
+@dataclass
+class _Domain:
+    name: str
+    limit: DomainLimit
+    tokens: float
+    updated: float
+    active: int = 0
+    waiters: Deque[Tuple[str, asyncio.Future]] = field(default_factory=deque)
+    timer: Optional[asyncio.TimerHandle] = None
+
+#==========  POLITENESS LIMITER  ==========
+class PolitenessLimiter:
+    """Navigations per registrable domain, across every client of the dispatcher.
+
+    A navigation takes a token from its domain's bucket and a concurrency slot, held until its response
+    (or failure) comes back. Navigations that can't start yet wait in line per domain, in arrival
+    order, and are started by a timer when the next token is due or when a slot is released.
+    """
+    def __init__(self, default: DomainLimit, overrides: Optional[Dict[str, Any]] = None):
+        self.default = default
+        self.overrides: Dict[str, DomainLimit] = {}
+        for domain, limit in (overrides or {}).items():
+            if isinstance(limit, DomainLimit):
+                self.overrides[domain] = limit
+            else:
+                self.overrides[domain] = DomainLimit(
+                    float(limit.get("rate", default.rate)), int(limit.get("burst", default.burst)), int(limit.get("concurrency", default.concurrency)))
+        self._domains: Dict[str, _Domain] = {}
+        self._held: Dict[str, str] = {}  # navigation key (request id) -> domain
+        self.delayed = 0  # navigations that had to wait
+        self.expired = 0  # navigations that gave up waiting
+
+    def limit_for(self, domain: str) -> DomainLimit:
+        return self.overrides.get(domain, self.default)
+
+    async def acquire(self, domain: str, key: str, max_wait: float) -> bool:
+        """Wait for the domain to allow a navigation, False after max_wait seconds"""
+        state = self._domains.get(domain)
+        if state is None:
+            limit = self.limit_for(domain)
+            state = self._domains[domain] = _Domain(domain, limit, float(limit.burst), time.monotonic())
+        if not state.waiters and self._take(state):
+            self._held[key] = domain
+            return True
+        future = asyncio.get_running_loop().create_future()
+        state.waiters.append((key, future))
+        self.delayed += 1
+        self._schedule(state)
+        try:
+            return await asyncio.wait_for(future, max_wait)
+        except asyncio.TimeoutError:
+            self.expired += 1
+            return False
+
+    def release(self, key: str) -> None:
+        """The navigation is over (answered, failed or timed out), no-op for keys not holding a slot"""
+        domain = self._held.pop(key, None)
+        state = self._domains.get(domain) if domain else None
+        if state is None:
+            return
+        state.active -= 1
+        self._dispatch(state)
+
+    def _refill(self, state: _Domain) -> None:
+        now = time.monotonic()
+        if state.limit.rate > 0:
+            state.tokens = min(float(state.limit.burst), state.tokens + (now - state.updated) * state.limit.rate)
+        state.updated = now
+
+    def _take(self, state: _Domain) -> bool:
+        self._refill(state)
+        if state.limit.concurrency and state.active >= state.limit.concurrency:
+            return False
+        if state.limit.rate > 0:
+            if state.tokens < 1.0:
+                return False
+            state.tokens -= 1.0
+        state.active += 1
+        return True
+
+    def _dispatch(self, state: _Domain) -> None:
+        """Start waiting navigations the domain allows now, then wait for the next token if some are left"""
+        if state.timer is not None:
+            state.timer.cancel()
+            state.timer = None
+        while state.waiters:
+            key, future = state.waiters[0]
+            if future.done():
+                state.waiters.popleft()  # gave up waiting
+                continue
+            if not self._take(state):
+                break
+            state.waiters.popleft()
+            self._held[key] = state.name
+            future.set_result(True)
+        self._schedule(state)
+
+    def _schedule(self, state: _Domain) -> None:
+        if not state.waiters or state.timer is not None:
+            return
+        if state.limit.concurrency and state.active >= state.limit.concurrency:
+            return  # release() dispatches
+        delay = max(0.0, (1.0 - state.tokens) / state.limit.rate) if state.limit.rate > 0 else 0.0
+        state.timer = asyncio.get_running_loop().call_later(delay, self._dispatch, state)
+
+    def prune(self) -> None:
+        """Forget domains with nothing in flight or waiting and a full bucket"""
+        for domain, state in list(self._domains.items()):
+            self._refill(state)
+            if not state.active and not state.waiters and state.tokens >= state.limit.burst:
+                del self._domains[domain]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "domains": len(self._domains),
+            "in_flight": len(self._held),
+            "waiting": sum(len(state.waiters) for state in self._domains.values()),
+            "delayed": self.delayed,
+            "expired": self.expired,
+        }
@@ -0,0 +1,267 @@
+#
+# Wire format shared by DispatcherServer and DispatcherClient (control channel, port 8010)
+#
+# Connection preamble:
+#   client -> server  MESSAGE_DELIMITER
+#   client -> server  {"type": "dispatcher.hello", "data": {"versions": [0, 1, 2, 3, 4]}}  (delimited)
+#   server -> client  {"type": "dispatcher.hello", "data": {"version": 4}}                 (delimited)
+#   ... all following messages use the negotiated version
+#
+# From PROTOCOL_BINARY on, a bytes "data" field (raw HTTP request/response) travels as the frame
+# body instead of base64 inside the JSON header; peers on older versions still get base64.
+#
+# From PROTOCOL_STREAM on, the client may answer an http.request with http.response.chunk frames
+# followed by http.response.end instead of one http.response: it does for chunked responses, those
+# delimited by connection close and those longer than STREAM_CHUNK_SIZE. The dispatcher grants credit with
+# http.response.ack as it hands chunks to the user socket, so at most STREAM_WINDOW bytes per
+# request are in flight between the agent and the user no matter how large the body is.
+#
+# From PROTOCOL_DELTA on, only the first dispatcher.heartbeat of a connection is complete (identity
+# and load), later ones carry just the fields that changed since, possibly none.
+#
+# An http.request may carry "priority" (PRIORITY_INTERACTIVE .. PRIORITY_BULK) next to "id"; both
+# peers queue requests for a crawler by it, clients that don't know the field relay in arrival order.
+#
+# Relayed requests carry a TRACE_HEADER the client and agent log and the agent echoes. The reply to
+# an http.request (http.response, or http.response.end when streamed) may carry "timing" next to
+# "reply", the client's milliseconds: {"total": ..., "queue": ..., "relay": ..., "agent": {...}}
+# with the agent's Server-Timing entries under "agent". Dispatchers that don't know it ignore it.
+#
+# After its first heartbeat a reconnecting client sends dispatcher.sessions with the sessions its
+# browsers still hold, and the dispatcher takes them back instead of expiring them. Sessions it
+# destroyed meanwhile (or that another client holds) it names in dispatcher.sessions.ended, the
+# client forgets them and closes their browsers. Clients that don't know the message ignore it.
+#
+# A client connected to several dispatchers reports the sessions it holds for the others in the
+# "sessions_elsewhere" heartbeat field, each dispatcher takes them off the client's max_browser_count.
+#
+# Older clients skip the hello and send their first heartbeat right after MESSAGE_DELIMITER,
+# which keeps them on PROTOCOL_DELIMITED.
+#
+import asyncio
+import base64
+import struct
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+#==========  CONSTANTS  ==========
+# Message delimiter (connection preamble and PROTOCOL_DELIMITED terminator)
+MESSAGE_DELIMITER = b'\x00\x01\x02\x03'
+
+# Protocol versions
+PROTOCOL_DELIMITED = 0  # JSON + MESSAGE_DELIMITER
+PROTOCOL_FRAMED = 1     # 4-byte big-endian length + JSON
+PROTOCOL_BINARY = 2     # 4-byte JSON length + 4-byte body length + JSON header + raw body
+PROTOCOL_STREAM = 3     # PROTOCOL_BINARY + chunked, flow-controlled http responses
+PROTOCOL_DELTA = 4      # PROTOCOL_STREAM + heartbeats with changed fields only
+SUPPORTED_PROTOCOLS = [PROTOCOL_DELIMITED, PROTOCOL_FRAMED, PROTOCOL_BINARY, PROTOCOL_STREAM, PROTOCOL_DELTA]
+
+HELLO_TYPE = "dispatcher.hello"
+RESPONSE_CHUNK_TYPE = "http.response.chunk"
+RESPONSE_END_TYPE = "http.response.end"
+RESPONSE_ACK_TYPE = "http.response.ack"
+CANCEL_TYPE = "http.cancel"  # dispatcher gave up on a request (deadline), the client should abort it
+SESSIONS_TYPE = "dispatcher.sessions"  # client re-announces its live sessions after reconnecting
+SESSIONS_ENDED_TYPE = "dispatcher.sessions.ended"  # dispatcher destroyed sessions the client holds
+TRACE_HEADER = "X-Trace-Id"  # added to relayed requests by the dispatcher (the user's own, or the request id)
+HANDSHAKE_TIMEOUT = 5.0
+
+FRAME_HEADER = struct.Struct('!I')
+BINARY_FRAME_HEADER = struct.Struct('!II')
+MAX_FRAME_SIZE = 256 * 1024 * 1024
+
+# Streamed responses: bytes per chunk frame and unacknowledged bytes allowed per request
+STREAM_CHUNK_SIZE = 64 * 1024
+STREAM_WINDOW = 256 * 1024
+
+# Request priority classes, lower goes first (X-Priority header on the user request, by name or number)
+PRIORITY_INTERACTIVE = 0  # operator calls waiting on a screen (/api/click, /api/input)
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2  # crawl traffic that can wait
+PRIORITY_NAMES = {"interactive": PRIORITY_INTERACTIVE, "normal": PRIORITY_NORMAL, "bulk": PRIORITY_BULK}
+# Weighted-fair scheduling: requests taken from each class per round while all classes are waiting
+PRIORITY_WEIGHTS = {PRIORITY_INTERACTIVE: 8, PRIORITY_NORMAL: 4, PRIORITY_BULK: 1}
+
+#==========  NEGOTIATION  ==========
+def negotiate_protocol(offered: Optional[List[int]]) -> int:
+    """Pick the highest protocol version supported by both peers"""
+    common = [v for v in (offered or []) if v in SUPPORTED_PROTOCOLS]
+    return max(common) if common else PROTOCOL_DELIMITED
+
+#==========  FLOW CONTROL  ==========
+class StreamCredit:
+    """Send window of one streamed response, replenished by http.response.ack"""
+
+    def __init__(self, window: int = STREAM_WINDOW):
+        self.available = window
+        self._granted = asyncio.Event()
+
+    def grant(self, size: int) -> None:
+        self.available += size
+        self._granted.set()
+
+    async def acquire(self, size: int) -> None:
+        """Wait until some window is left, then spend size bytes of it"""
+        while self.available <= 0:
+            self._granted.clear()
+            await self._granted.wait()
+        self.available -= size
+
+#==========  PRIORITY  ==========
+def parse_priority(value: Any, default: int = PRIORITY_NORMAL) -> int:
+    """Priority class from a header or message field (name or number), default when missing or unknown"""
+    if value is None:
+        return default
+    if isinstance(value, str):
+        value = value.strip().lower()
+        if value in PRIORITY_NAMES:
+            return PRIORITY_NAMES[value]
+    try:
+        priority = int(value)
+    except (TypeError, ValueError):
+        return default
+    return priority if priority in PRIORITY_WEIGHTS else default
+
+class PriorityScheduler:
+    """Queued requests for one crawler, a FIFO per priority class.
+
+    strict: always the most urgent class first (bulk can starve while interactive keeps coming).
+    weighted: smooth weighted round robin over the classes that have requests, by PRIORITY_WEIGHTS,
+    so every class keeps moving and the urgent ones get most of the turns.
+    """
+    def __init__(self, mode: str = "strict", weights: Optional[Dict[int, int]] = None):
+        if mode not in ("strict", "weighted"):
+            raise ValueError(f"Unknown priority scheduling '{mode}', expected 'strict' or 'weighted'")
+        self.mode = mode
+        self.weights = weights or PRIORITY_WEIGHTS
+        self.bytes = 0  # sizes of the queued items
+        self._queues: Dict[int, Deque[Tuple[str, Any, int]]] = {priority: deque() for priority in sorted(self.weights)}
+        self._current = {priority: 0 for priority in self.weights}  # weighted round robin state
+        self._queued: Dict[str, int] = {}  # key -> priority of items not taken or removed yet
+        self._ready = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._queued)
+
+    def put(self, priority: int, key: str, item: Any, size: int = 0) -> None:
+        if priority not in self._queues:
+            priority = PRIORITY_NORMAL
+        self._queues[priority].append((key, item, size))
+        self._queued[key] = priority
+        self.bytes += size
+        self._ready.set()
+
+    def remove(self, key: str) -> bool:
+        """Drop a queued item (cancelled before its turn), False if it isn't queued"""
+        priority = self._queued.pop(key, None)
+        if priority is None:
+            return False
+        # Left in its deque and skipped when it comes up, its bytes no longer count
+        for queued_key, _, size in self._queues[priority]:
+            if queued_key == key:
+                self.bytes -= size
+                break
+        return True
+
+    def get_nowait(self) -> Optional[Any]:
+        while self._queued:
+            priority = self._next_class()
+            key, item, size = self._queues[priority].popleft()
+            if self._queued.get(key) != priority:
+                continue  # removed
+            del self._queued[key]
+            self.bytes -= size
+            return item
+        for queue in self._queues.values():
+            queue.clear()  # only removed items were left
+        return None
+
+    async def get(self) -> Any:
+        while True:
+            item = self.get_nowait()
+            if item is not None:
+                return item
+            self._ready.clear()
+            await self._ready.wait()
+
+    def _next_class(self) -> int:
+        waiting = [priority for priority, queue in self._queues.items() if queue]
+        if self.mode == "strict" or len(waiting) == 1:
+            return waiting[0]
+        total = 0
+        for priority in waiting:
+            self._current[priority] += self.weights[priority]
+            total += self.weights[priority]
+        chosen = max(waiting, key=lambda priority: self._current[priority])
+        self._current[chosen] -= total
+        return chosen
+
+#==========  BINARY DATA  ==========
+def split_binary_data(message: Dict[str, Any], protocol: int) -> Tuple[Dict[str, Any], Optional[bytes]]:
+    """Move a bytes "data" field out of the JSON header: into the frame body, or to base64 on older protocols"""
+    data = message.get("data")
+    if not isinstance(data, (bytes, bytearray, memoryview)):
+        return message, None
+    if protocol >= PROTOCOL_BINARY:
+        header = {k: v for k, v in message.items() if k != "data"}
+        return header, bytes(data) if not isinstance(data, bytes) else data
+    return dict(message, data=base64.b64encode(data).decode('utf-8')), None
+
+def message_bytes(message: Dict[str, Any]) -> bytes:
+    """Get the raw bytes carried by a message, whichever protocol delivered it"""
+    data = message.get("data")
+    if isinstance(data, bytes):
+        return data
+    return base64.b64decode(data or "")
+
+#==========  FRAME ENCODING  ==========
+def encode_frame(payload: bytes, protocol: int, body: Optional[bytes] = None) -> List[bytes]:
+    """Wrap a serialized message (and optional raw body) for the given protocol version"""
+    if protocol >= PROTOCOL_BINARY:
+        body = body or b""
+        return [BINARY_FRAME_HEADER.pack(len(payload), len(body)), payload, body]
+    if protocol == PROTOCOL_FRAMED:
+        return [FRAME_HEADER.pack(len(payload)), payload]
+    return [payload, MESSAGE_DELIMITER]
+
+async def _read_delimited(reader: asyncio.StreamReader) -> bytes:
+    """Read one MESSAGE_DELIMITER terminated message from the reader's buffer"""
+    chunks = []
+    while True:
+        try:
+            chunks.append(await reader.readuntil(MESSAGE_DELIMITER))
+            break
+        except asyncio.LimitOverrunError as e:
+            # Message is larger than the stream limit, drain what has been scanned and keep looking
+            chunks.append(await reader.readexactly(e.consumed))
+    data = b''.join(chunks) if len(chunks) > 1 else chunks[0]
+    return data[:-len(MESSAGE_DELIMITER)]
+
+async def _read_framed(reader: asyncio.StreamReader) -> bytes:
+    """Read one length-prefixed message"""
+    header = await reader.readexactly(FRAME_HEADER.size)
+    (length,) = FRAME_HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame too large: {length} bytes")
+    return await reader.readexactly(length)
+
+async def _read_binary(reader: asyncio.StreamReader) -> Tuple[bytes, bytes]:
+    """Read one JSON header + raw body frame"""
+    header = await reader.readexactly(BINARY_FRAME_HEADER.size)
+    json_length, body_length = BINARY_FRAME_HEADER.unpack(header)
+    if json_length + body_length > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame too large: {json_length + body_length} bytes")
+    payload = await reader.readexactly(json_length)
+    body = await reader.readexactly(body_length) if body_length else b""
+    return payload, body
+
+async def read_frame(reader: asyncio.StreamReader, protocol: int) -> Optional[Tuple[bytes, Optional[bytes]]]:
+    """Read one serialized message and its raw body (None before PROTOCOL_BINARY), return None on EOF"""
+    try:
+        if protocol >= PROTOCOL_BINARY:
+            return await _read_binary(reader)
+        if protocol == PROTOCOL_FRAMED:
+            return await _read_framed(reader), None
+        return await _read_delimited(reader), None
+    except asyncio.IncompleteReadError:
+        return None
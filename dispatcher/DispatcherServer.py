@@ -3,22 +3,124 @@
 #
 #==========  IMPORTS AND CONFIGURATION  ==========
 import asyncio
+import heapq
+import multiprocessing
 import socket
+import tempfile
 import logging
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import datetime
-from typing import Any, Optional, Dict, List, Tuple, Union
+from typing import Any, Optional, Dict, List, Set, Tuple, Union
 import uuid
 import mysql.connector
 from mysql.connector import pooling
 import os
+import re
 import json
+from DispatcherStore import PersistenceWorker, MetricBuckets, ClientRecord, SessionRecord, LogRecord, Record
+from DispatcherPlacement import AdmissionQueue, SessionPlacement, make_strategy
+from DispatcherCluster import make_routing_table
+from DispatcherShedding import LoadShedder, RateMeter, RETRY_AFTER_MAX
+from DispatcherPoliteness import DomainLimit, PolitenessLimiter, load_overrides, registrable_domain
+from DispatcherMetrics import MetricsRegistry, SHORT_BUCKETS
+from DispatcherHttp import HttpConnectionPool, HttpError, HttpRequest, ResponseSequencer, ResponseSlot, read_request
+from DispatcherProtocol import (MESSAGE_DELIMITER, PROTOCOL_DELIMITED, HELLO_TYPE, RESPONSE_CHUNK_TYPE, RESPONSE_END_TYPE, RESPONSE_ACK_TYPE, CANCEL_TYPE, SESSIONS_TYPE, SESSIONS_ENDED_TYPE, STREAM_CHUNK_SIZE,
+                                TRACE_HEADER, PRIORITY_INTERACTIVE, PRIORITY_NORMAL, PriorityScheduler, encode_frame, read_frame, split_binary_data, message_bytes, negotiate_protocol, parse_priority)
 
 logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s %(message)s')
 
 #==========  CONSTANTS AND CONFIGURATION  ==========
-HTTP_PORT = 8000
-CLIENT_PORT = 8010
+HTTP_PORT = int(os.getenv("DISPATCHER_HTTP_PORT", "8000"))
+CLIENT_PORT = int(os.getenv("DISPATCHER_CLIENT_PORT", "8010"))
+
+# Worker processes sharing HTTP_PORT and CLIENT_PORT with SO_REUSEPORT (Linux), 1 runs everything in this process.
+# Each worker owns the crawlers that connected to it and their sessions, and forwards requests for
+# sessions of other workers to the owner over a Unix socket in WORKER_SOCKET_DIR.
+WORKER_COUNT = min(int(os.getenv("DISPATCHER_WORKERS", "1")), 256)
+WORKER_SOCKET_DIR = os.getenv("DISPATCHER_SOCKET_DIR", tempfile.gettempdir())
+FORWARDED_HEADER = "X-Dispatcher-Forwarded"
+# Workers tell each other on this path (Unix sockets only) which worker took re-announced sessions
+WORKER_OWNERS_PATH = "/dispatcher/owners"
+
+# Several dispatcher nodes (each with its own crawlers) sharing a routing table of session -> node: ""
+# runs standalone, "memory" keeps the table in this process, "tcp://host:port" uses a DispatcherCluster.py
+# server. Any node takes user requests and forwards them to the session's node at NODE_ADDRESS (its HTTP_PORT
+# as the other nodes reach it), marked with NODE_HEADER so that they are not forwarded again.
+ROUTING_TABLE = os.getenv("DISPATCHER_ROUTING_TABLE", "")
+NODE_ADDRESS = os.getenv("DISPATCHER_NODE", f"{socket.gethostname()}:{HTTP_PORT}")
+NODE_HEADER = "X-Dispatcher-Via"
+# How often a node announces itself and its free browsers to the routing table
+NODE_REGISTER_INTERVAL = 5.0
+
+# Deadline for reading one user request (header block and body), also the keep-alive idle timeout
+REQUEST_TIMEOUT = 10.0
+
+# Seconds a relayed request may take before the dispatcher answers 504 and cancels it on the client,
+# by path (page loads get long deadlines, quick queries short ones), DEFAULT_REQUEST_DEADLINE otherwise
+REQUEST_DEADLINES = {
+    "/api/start": 60.0,
+    "/api/go": 120.0,
+    "/api/download": 300.0,
+    "/api/network": 10.0,
+    "/api/view": 30.0,
+}
+DEFAULT_REQUEST_DEADLINE = 60.0
+
+# How /api/start picks a client: least-sessions, least-loaded, power-of-two or consistent-hash
+# (consistent-hash places by the X-Placement-Key request header, e.g. a proxy or domain)
+PLACEMENT_STRATEGY = os.getenv("PLACEMENT_STRATEGY", "least-sessions")
+
+# How long /api/start waits for a free browser when all clients are full (X-Max-Wait overrides, up to the limit)
+ADMISSION_MAX_WAIT = 30.0
+ADMISSION_MAX_WAIT_LIMIT = 300.0
+
+# Seconds a disconnected client's sessions are kept for it to reconnect and re-announce them (its
+# browsers live on), requests for them get 503 meanwhile; 0 destroys them on disconnect. Longer rides
+# out longer client outages, shorter tells users sooner that they must start over (440): a client
+# reconnects within a second or two of a dropped connection, backing off up to 10 s while we are gone
+SESSION_RECONNECT_GRACE = float(os.getenv("SESSION_RECONNECT_GRACE", "10"))
+
+# Requests a user connection may pipeline before the dispatcher stops reading from it
+MAX_PIPELINED_REQUESTS = 8
+
+# Priority class of a relayed request: the X-Priority header (interactive, normal, bulk or 0-2), else by path
+PRIORITY_HEADER = "X-Priority"
+REQUEST_PRIORITIES = {
+    "/api/click": PRIORITY_INTERACTIVE,
+    "/api/input": PRIORITY_INTERACTIVE,
+}
+# How each client's outbound queue picks the next request: strict (by class) or weighted (fair share per class)
+PRIORITY_SCHEDULING = os.getenv("PRIORITY_SCHEDULING", "weighted")
+
+# Trace ids users may pass in TRACE_HEADER, anything else is replaced by the request id
+TRACE_ID_PATTERN = re.compile(r'[A-Za-z0-9._:-]{1,64}')
+
+# Load shedding: past these limits requests are answered 429 with a Retry-After instead of being
+# queued on the control connections (per dispatcher process and per client, 0: no limit)
+MAX_IN_FLIGHT = int(os.getenv("DISPATCHER_MAX_IN_FLIGHT", "2000"))
+MAX_WRITE_BUFFER = int(os.getenv("DISPATCHER_MAX_WRITE_BUFFER", str(256 * 1024 * 1024)))
+MAX_CLIENT_IN_FLIGHT = int(os.getenv("DISPATCHER_MAX_CLIENT_IN_FLIGHT", "100"))
+MAX_CLIENT_WRITE_BUFFER = int(os.getenv("DISPATCHER_MAX_CLIENT_WRITE_BUFFER", str(16 * 1024 * 1024)))
+
+# Politeness per registrable domain for /api/go across all clients: navigations per second, burst and
+# navigations in flight (0: no limit, the default; e.g. 2.0, 5 and 10 to spread load on the sites);
+# DISPATCHER_DOMAIN_LIMITS names a JSON file of per-domain overrides, which apply either way
+DOMAIN_RATE = float(os.getenv("DISPATCHER_DOMAIN_RATE", "0"))
+DOMAIN_BURST = int(os.getenv("DISPATCHER_DOMAIN_BURST", "5"))
+DOMAIN_CONCURRENCY = int(os.getenv("DISPATCHER_DOMAIN_CONCURRENCY", "0"))
+DOMAIN_LIMITS_FILE = os.getenv("DISPATCHER_DOMAIN_LIMITS", "")
+# Seconds a navigation waits for its domain before it is answered 429
+DOMAIN_MAX_WAIT = 300.0
+
+# Prometheus /metrics, on its own port (worker N of several listens on METRICS_PORT + N), off unless set
+# (e.g. 8040; several dispatchers on one host need a port each)
+METRICS_PORT = int(os.getenv("DISPATCHER_METRICS_PORT", "0"))
+# Agent API paths get their own path label, anything else is counted as "other"
+METRIC_PATHS = {"/api/start", "/api/go", "/api/maximize", "/api/view", "/api/network", "/api/download", "/api/click", "/api/input", "/api/destroy"}
+# Per-hop timings of LogInfo, exported by hop label
+REQUEST_HOPS = ("dispatch", "link", "client", "agent", "uia", "chrome")
+# How often the event loop lag is sampled (seconds)
+LOOP_LAG_INTERVAL = 0.5
 
 # Database configuration
 db_config = {
@@ -30,12 +132,12 @@ db_config = {
     "pool_size": 5
 }
 
-# Message delimiter
-MESSAGE_DELIMITER = b'\x00\x01\x02\x03'
-
 # Global connection pool
 connection_pool = None
 
+# Where crawler_log rows go while the database is unreachable (replayed when it is back)
+SPOOL_DIR = os.getenv("DISPATCHER_SPOOL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "spool"))
+
 #==========  DATABASE FUNCTIONS  ==========
 def get_db_connection() -> Optional[Union[mysql.connector.MySQLConnection, mysql.connector.pooling.PooledMySQLConnection]]:
     global connection_pool
@@ -54,34 +156,30 @@ def get_db_connection() -> Optional[Union[mysql.connector.MySQLConnection, mysql
         return None
 
 #==========  JSON MESSAGE HANDLING  ==========
-async def read_json_message(reader: asyncio.StreamReader) -> Optional[Dict[str, Any]]:
-    """Read a JSON message from the stream reader using delimiter"""
+async def read_json_message(reader: asyncio.StreamReader, protocol: int = PROTOCOL_DELIMITED) -> Optional[Dict[str, Any]]:
+    """Read a JSON message from the stream reader using the negotiated framing"""
     try:
-        # Read until we find the delimiter
-        buffer = b""
-        while True:
-            char = await reader.read(1)
-            if not char:
-                return None
-            buffer += char
-            # Check if we have the delimiter
-            if buffer.endswith(MESSAGE_DELIMITER):
-                # Remove delimiter and decode
-                json_data = buffer[:-len(MESSAGE_DELIMITER)]
-                try:
-                    message = json.loads(json_data.decode('utf-8', errors='ignore'))
-                    # Log the received message
-                    logging.info(f"[SERVER][JSON] Received: {json.dumps(message, ensure_ascii=False)}")
-                    return message
-                except json.JSONDecodeError as e:
-                    logging.error(f"[SERVER][JSON] Error parsing JSON: {e}")
-                    return None
+        frame = await read_frame(reader, protocol)
+        if frame is None:
+            return None
+        json_data, body = frame
+        try:
+            message = json.loads(json_data.decode('utf-8', errors='ignore'))
+            # Log the received message (raw body only by size)
+            logging.info(f"[SERVER][JSON] Received: {json.dumps(message, ensure_ascii=False)}" + (f" +{len(body)} bytes" if body else ""))
+            if body is not None and "data" not in message:
+                message["data"] = body
+            return message
+        except json.JSONDecodeError as e:
+            logging.error(f"[SERVER][JSON] Error parsing JSON: {e}")
+            return None
     except Exception as e:
         logging.error(f"[SERVER][JSON] Error reading JSON message: {e}")
         return None
 
-async def write_json_message(writer: asyncio.StreamWriter, msg_id: str, msg_type: str, data: Any, reply_to: Optional[str] = None) -> None:
-    """Write a JSON message to the stream writer with delimiter"""
+async def write_json_message(writer: asyncio.StreamWriter, msg_id: str, msg_type: str, data: Any, reply_to: Optional[str] = None, protocol: int = PROTOCOL_DELIMITED,
+                             priority: Optional[int] = None) -> None:
+    """Write a JSON message to the stream writer using the negotiated framing"""
     try:
         # 直接在这里构造 JSON message
         message = {
@@ -92,13 +190,17 @@ async def write_json_message(writer: asyncio.StreamWriter, msg_id: str, msg_type
         }
         if reply_to:
             message["reply"] = reply_to
+        if priority is not None:
+            message["priority"] = priority
+        # Raw bytes go in the frame body (or base64 for older peers)
+        message, body = split_binary_data(message, protocol)
         message_str = json.dumps(message, ensure_ascii=False)
-        writer.write(message_str.encode('utf-8') + MESSAGE_DELIMITER)
+        writer.writelines(encode_frame(message_str.encode('utf-8'), protocol, body))
         await writer.drain()
         
         # Log the sent message
         addr = writer.get_extra_info('peername')
-        logging.info(f"[SERVER][JSON] Sent to {addr}: {message_str}")
+        logging.info(f"[SERVER][JSON] Sent to {addr}: {message_str}" + (f" +{len(body)} bytes" if body else ""))
     except Exception as e:
         logging.error(f"[SERVER][JSON] Error writing JSON message: {e}")
 
@@ -110,6 +212,7 @@ class ClientInfo:
     connect_time: datetime.datetime
     disconnect_time: Optional[datetime.datetime] = None
     max_browser_count: int = 5
+    protocol: int = PROTOCOL_DELIMITED  # negotiated control channel framing
     # Fields corresponding to crawler_info table
     uuid: Optional[str] = None
     host_name: Optional[str] = None
@@ -121,6 +224,24 @@ class ClientInfo:
     status: int = 10  # 10:online, 20:offline, 30:shutdown
     cpu_usage: Optional[float] = None
     memory_usage: Optional[float] = None
+    # Load reported by newer clients: browsers running, resident memory of the client and of its
+    # browsers (MB), and relayed requests not answered yet
+    browser_count: Optional[int] = None
+    rss_mb: Optional[int] = None
+    browser_rss_mb: Optional[int] = None
+    in_flight: Optional[int] = None
+    # Sessions the client holds for other dispatchers, off max_browser_count here
+    sessions_elsewhere: Optional[int] = None
+    # Requests in flight on this connection (pending_requests keys) and sessions placed on it,
+    # failed and destroyed together when it disconnects
+    pending: Set[str] = field(default_factory=set)
+    sessions: Set[str] = field(default_factory=set)
+    # Responses currently being streamed over this connection
+    streams: Dict[str, "ResponseStream"] = field(default_factory=dict)
+    # Rate at which the client answers requests, for Retry-After when it is over its limits
+    completed: RateMeter = field(default_factory=RateMeter)
+    # Requests waiting to be written to the connection, (msg_id, priority, request bytes) by priority
+    outbound: PriorityScheduler = field(default_factory=lambda: PriorityScheduler(PRIORITY_SCHEDULING))
 
 @dataclass
 class SessionInfo:
@@ -139,33 +260,138 @@ class LogInfo:
     response_time: Optional[datetime.datetime] = None
     status_code: Optional[int] = None
     id: Optional[int] = None
+    # Where the request's time went (ms): in the dispatcher until written to the control connection,
+    # on that connection both ways, in the client (relay slot wait, agent connection) and in the
+    # agent, of which UIA and Chrome. Hops after the dispatcher are reported by newer clients only.
+    trace_id: Optional[str] = None
+    dispatch_ms: Optional[int] = None
+    link_ms: Optional[int] = None
+    client_ms: Optional[int] = None
+    agent_ms: Optional[int] = None
+    uia_ms: Optional[int] = None
+    chrome_ms: Optional[int] = None
+    # Loop time the request was read from the user and written to the client
+    received: Optional[float] = None
+    sent: Optional[float] = None
+
+@dataclass
+class ResponseStream:
+    """A response relayed chunk by chunk from a client to the user connection"""
+    slot: ResponseSlot
+    request_obj: LogInfo
+    unacked: int = 0  # bytes written to the slot but not yet acknowledged to the client
+    ack_task: Optional[asyncio.Task] = None
 
 #==========  GLOBAL STATE  ==========
+# This process's worker number (0 when running a single process)
+worker_index = 0
+
 clients: Dict[str, ClientInfo] = {}
 clients_lock = asyncio.Lock()
 
 sessions: Dict[Optional[str], SessionInfo] = {}
 sessions_lock = asyncio.Lock()
 
-logs: List[LogInfo] = []
-logs_lock = asyncio.Lock()
+# Snapshots of state transitions (client heartbeat, session created/updated/destroyed, request
+# sent/responded) since the last hand-off to the persistence worker, in the order they happened
+journal: List[Record] = []
+# Per-minute load of each client (heartbeats, relayed requests), closed minutes go out with the journal
+metrics = MetricBuckets()
+
+# Active sessions per client, picks the client for /api/start
+placement = SessionPlacement(make_strategy(PLACEMENT_STRATEGY))
+# /api/start callers waiting for a free browser
+admission = AdmissionQueue(placement)
 
 # Store pending HTTP requests waiting for response
-pending_requests: Dict[str, Tuple[asyncio.StreamWriter, LogInfo]] = {}
+pending_requests: Dict[str, Tuple[ResponseSlot, LogInfo]] = {}
 pending_requests_lock = asyncio.Lock()
+# (deadline in loop time, msg_id, client) of relayed requests, entries of answered requests are skipped when they come up
+request_deadlines: List[Tuple[float, str, ClientInfo]] = []
+# Requests over the in-flight and write buffer limits get 429
+shedder = LoadShedder(MAX_IN_FLIGHT, MAX_WRITE_BUFFER, MAX_CLIENT_IN_FLIGHT, MAX_CLIENT_WRITE_BUFFER)
+# /api/go waits here until its domain allows another navigation
+politeness = PolitenessLimiter(DomainLimit(DOMAIN_RATE, DOMAIN_BURST, DOMAIN_CONCURRENCY), load_overrides(DOMAIN_LIMITS_FILE))
+
+# Cluster routing table (None when running standalone) and background updates to it
+routing = make_routing_table(ROUTING_TABLE)
+routing_tasks: Set[asyncio.Task] = set()
+
+# Sessions whose crawler reconnected to another worker than the one in their id -> that worker,
+# and the announcements of such moves to the other workers in flight
+session_owners: Dict[str, int] = {}
+owner_tasks: Set[asyncio.Task] = set()
+
+# Sessions destroyed while their client was away, by client uuid: refused when it re-announces them
+# (and named in dispatcher.sessions.ended), with those notices in flight
+ended_sessions: Dict[str, Set[str]] = {}
+notice_tasks: Set[asyncio.Task] = set()
+
+# Heartbeat field -> ClientInfo attribute, heartbeats may carry any subset (only changed fields)
+HEARTBEAT_FIELDS = {
+    "os": "os",
+    "agent": "agent",
+    "host_name": "host_name",
+    "ip": "internal_ip",
+    "cpu_usage": "cpu_usage",
+    "memory_usage": "memory_usage",
+    "browser_count": "browser_count",
+    "rss_mb": "rss_mb",
+    "browser_rss_mb": "browser_rss_mb",
+    "in_flight": "in_flight",
+    "sessions_elsewhere": "sessions_elsewhere",
+}
+
+def _apply_heartbeat(client_info: ClientInfo, heartbeat_data: Dict[str, Any]) -> None:
+    for key, attr in HEARTBEAT_FIELDS.items():
+        if key in heartbeat_data:
+            setattr(client_info, attr, heartbeat_data[key])
+
+def _capacity(client_info: ClientInfo) -> int:
+    """Sessions the client can take from this dispatcher: its max_browser_count less those it holds for others"""
+    return max(0, client_info.max_browser_count - (client_info.sessions_elsewhere or 0))
+
+#==========  CHANGE JOURNAL  ==========
+def _journal_client(client: ClientInfo) -> None:
+    journal.append(ClientRecord(
+        client.uuid, client.host_name, client.internal_ip, client.external_ip, client.os, client.agent, client.last_heartbeat,
+        10 if client.disconnect_time is None else 20,  # 10: online, 20: offline
+        client.cpu_usage, client.memory_usage, client.max_browser_count
+    ))
+
+def _journal_session(session: SessionInfo) -> None:
+    journal.append(SessionRecord(session.uuid, session.client_uuid, session.init_time, session.url, session.destroy_time))
+
+def _journal_log(request_obj: LogInfo) -> None:
+    journal.append(LogRecord(request_obj.uuid, request_obj.session_uuid, request_obj.url, request_obj.request_time, request_obj.response_time, request_obj.status_code,
+                             request_obj.trace_id, request_obj.dispatch_ms, request_obj.link_ms, request_obj.client_ms, request_obj.agent_ms, request_obj.uia_ms, request_obj.chrome_ms))
 
 #==========  HTTP UTILITY FUNCTIONS  ==========
-async def _send_response(writer: asyncio.StreamWriter, response_bytes: bytes) -> None:
-    """Send HTTP response without closing the connection"""
+def _respond(slot: ResponseSlot, response_bytes: bytes) -> None:
+    """Write a complete HTTP response into its place on the user connection"""
     try:
         # Check if writer is still open before writing
-        if not writer.is_closing():
-            writer.write(response_bytes)
-            await writer.drain()
+        if not slot.is_closing():
+            slot.write(response_bytes)
         else:
             logging.warning("[SERVER][HTTP] Cannot send response: writer is already closing")
     except Exception as e:
-        logging.error(f"[SERVER][HTTP] Error in _send_response: {e}")
+        logging.error(f"[SERVER][HTTP] Error in _respond: {e}")
+    finally:
+        slot.finish()
+
+def _shed(slot: ResponseSlot, retry_after: int) -> None:
+    shed_requests.inc()
+    _respond(slot, f"HTTP/1.1 429 Too Many Requests\r\nRetry-After: {retry_after}\r\nContent-Length: 17\r\n\r\nToo Many Requests".encode())
+
+def _write_buffer(client: ClientInfo) -> int:
+    """Bytes queued for the client's control connection (outbound queue and transport buffer)"""
+    transport = client.writer.transport
+    return client.outbound.bytes + (transport.get_write_buffer_size() if transport is not None else 0)
+
+def _check_client_load(client: ClientInfo) -> Optional[int]:
+    """Retry-After when the client is over its in-flight or write buffer limit, None otherwise"""
+    return shedder.check_client(len(client.pending), _write_buffer(client), client.completed)
 
 async def _close_writer(writer: asyncio.StreamWriter) -> None:
     """Close the writer connection"""
@@ -176,29 +402,226 @@ async def _close_writer(writer: asyncio.StreamWriter) -> None:
     except Exception as e:
         logging.error(f"[SERVER][HTTP] Error closing writer: {e}")
 
-async def _read_until_delimiter(reader: asyncio.StreamReader, delimiter: str = '\r\n', timeout: float = 10.0, max_size: int = 8192) -> Optional[bytes]:
-    """Read data until a specific delimiter is found with timeout and maximum buffer size"""
+def _parse_status_code(response_head: bytes) -> int:
+    """Extract the status code from the start of a binary HTTP response"""
     try:
-        delimiter_bytes = delimiter.encode('utf-8')
-        buffer = b""
-        
-        # Use asyncio.wait_for to add timeout
-        while True:
-            # Read one byte at a time to find delimiter
-            char = await asyncio.wait_for(reader.read(1), timeout=timeout)
-            if not char:
-                return buffer if buffer else None  # Return buffer if we have data, None if empty
-                
-            # Add char to buffer
-            buffer += char
-            
-            # Check if buffer length reaches max_size or ends with delimiter
-            if len(buffer) >= max_size or buffer.endswith(delimiter_bytes):
-                return buffer
-                
+        status_line = response_head.split(b'\r\n', 1)[0]
+        return int(status_line.split(b' ')[1])
+    except (IndexError, ValueError):
+        return 200  # Default status code
+
+def _fail_pending(msg_id: str, response_bytes: bytes, status_code: int, streamed: bool = False) -> None:
+    """Answer a pending request on the dispatcher's behalf (the client can't anymore)"""
+    pending = pending_requests.pop(msg_id, None)
+    if pending is None:
+        return
+    slot, request_obj = pending
+    request_obj.response_time = datetime.datetime.now()
+    request_obj.status_code = status_code
+    _apply_timing(request_obj, None)
+    _journal_log(request_obj)
+    _observe_request(request_obj)
+    politeness.release(msg_id)
+    if streamed:
+        # Part of the response is already out, all we can do is cut the connection
+        slot.abort()
+    else:
+        _respond(slot, response_bytes)
+
+def _release_client(client_info: ClientInfo) -> None:
+    """Fail a disconnected client's in-flight requests with 502, its sessions expire after SESSION_RECONNECT_GRACE.
+
+    No awaits in here, so no request can be routed to the client half way through.
+    """
+    for msg_id in list(client_info.pending):
+        stream = client_info.streams.pop(msg_id, None)
+        if stream and stream.ack_task:
+            stream.ack_task.cancel()
+        _fail_pending(msg_id, b'HTTP/1.1 502 Bad Gateway\r\nContent-Length: 19\r\n\r\nClient disconnected', 502, stream is not None)
+    if client_info.pending:
+        logging.info(f"[SERVER][CLIENT] Failed {len(client_info.pending)} in-flight requests of client {client_info.uuid}")
+    client_info.pending.clear()
+    if client_info.sessions and SESSION_RECONNECT_GRACE > 0:
+        asyncio.get_running_loop().call_later(SESSION_RECONNECT_GRACE, _expire_sessions, client_info)
+    else:
+        _expire_sessions(client_info)
+    # Its capacity is gone but waiters may fit elsewhere now
+    admission.dispatch()
+
+def _expire_sessions(client_info: ClientInfo) -> None:
+    """Destroy the sessions of a disconnected client that no reconnected client took back"""
+    current = clients.get(client_info.uuid)
+    reclaimed = current.sessions if current is not None and current is not client_info else set()
+    now = datetime.datetime.now()
+    expired = []
+    for session_uuid in client_info.sessions - reclaimed:
+        session = sessions.get(session_uuid)
+        if session and session.destroy_time is None:
+            session.destroy_time = now
+            placement.session_ended(session.client_uuid)
+            _journal_session(session)
+            expired.append(session_uuid)
+    if expired:
+        logging.info(f"[SERVER][SESSION] Destroyed {len(expired)} sessions of disconnected client {client_info.uuid}")
+        _unroute(expired)
+        _disown(expired)
+        admission.dispatch()
+        # Back without them (it may have lost them too): tell it now, else when it re-announces them
+        if current is not None and current.disconnect_time is None:
+            _notify_ended(current, expired)
+        else:
+            ended_sessions.setdefault(client_info.uuid, set()).update(expired)
+    client_info.sessions.clear()
+
+def _notify_ended(client_info: ClientInfo, session_ids: List[str]) -> None:
+    """Tell the client to forget destroyed sessions (and close their browsers), in the background"""
+    task = asyncio.create_task(write_json_message(client_info.writer, str(uuid.uuid4()), SESSIONS_ENDED_TYPE, {"sessions": session_ids}, protocol=client_info.protocol))
+    notice_tasks.add(task)
+    task.add_done_callback(notice_tasks.discard)
+
+def _reattach_sessions(client_info: ClientInfo, session_ids: List[str]) -> None:
+    """Take back the sessions a reconnected client still holds, from its last connection or from before a restart"""
+    now = datetime.datetime.now()
+    restored = []
+    refused = []
+    ended = ended_sessions.pop(client_info.uuid, set())
+    for session_uuid in session_ids:
+        if session_uuid in ended:
+            refused.append(session_uuid)
+            continue
+        session = sessions.get(session_uuid)
+        if session is not None and session.destroy_time is None:
+            owner = clients.get(session.client_uuid)
+            if session.client_uuid != client_info.uuid and owner is not None and owner.disconnect_time is None:
+                logging.warning(f"[SERVER][SESSION] Client {client_info.uuid} announced session {session_uuid} of client {session.client_uuid}")
+                refused.append(session_uuid)
+                continue
+            if session.client_uuid != client_info.uuid:
+                placement.session_ended(session.client_uuid)
+                placement.session_started(client_info.uuid)
+                session.client_uuid = client_info.uuid
+        else:
+            # Expired meanwhile or unknown here (dispatcher restarted, or failed over from another one)
+            session = SessionInfo(uuid=session_uuid, client_uuid=client_info.uuid, init_time=session.init_time if session else now, url=session.url if session else None)
+            sessions[session_uuid] = session
+            placement.session_started(client_info.uuid)
+        client_info.sessions.add(session_uuid)
+        session_owners.pop(session_uuid, None)
+        _journal_session(session)
+        restored.append(session_uuid)
+    if restored:
+        logging.info(f"[SERVER][SESSION] Client {client_info.uuid} re-announced {len(restored)} sessions")
+        _route(restored)
+        # The client may have reconnected to another worker than before, requests follow it here
+        _announce_owners(restored, worker_index)
+    if refused:
+        logging.info(f"[SERVER][SESSION] Client {client_info.uuid} re-announced {len(refused)} ended sessions")
+        _notify_ended(client_info, refused)
+
+def _apply_timing(request_obj: LogInfo, timing: Optional[Dict[str, Any]]) -> None:
+    """Split the time of an answered request into hops, with the client's "timing" of its reply"""
+    if request_obj.received is None:
+        return
+    now = asyncio.get_running_loop().time()
+    if request_obj.sent is None:
+        # Never written to the client (timed out in the outbound queue, client gone)
+        request_obj.dispatch_ms = round((now - request_obj.received) * 1000)
+        return
+    request_obj.dispatch_ms = round((request_obj.sent - request_obj.received) * 1000)
+    if not isinstance(timing, dict):
+        return  # older client, or answered on its behalf
+    try:
+        client_total = float(timing.get("total", 0))
+        agent = timing.get("agent") or {}
+        # Agents without Server-Timing count as a whole from the client's side
+        agent_total = float(agent.get("total", timing.get("relay", 0)))
+        request_obj.link_ms = max(0, round((now - request_obj.sent) * 1000 - client_total))
+        request_obj.client_ms = max(0, round(client_total - agent_total))
+        request_obj.agent_ms = round(agent_total)
+        request_obj.uia_ms = round(float(agent["uia"])) if "uia" in agent else None
+        request_obj.chrome_ms = round(float(agent["chrome"])) if "chrome" in agent else None
+    except (AttributeError, TypeError, ValueError) as e:
+        logging.warning(f"[SERVER][HTTP] Invalid timing for request {request_obj.uuid}: {e}")
+
+async def _record_response(request_obj: LogInfo, status_code: int, timing: Optional[Dict[str, Any]] = None) -> None:
+    """Update the request log and session state once a response has been relayed"""
+    request_obj.response_time = datetime.datetime.now()
+    request_obj.status_code = status_code
+    _apply_timing(request_obj, timing)
+    _journal_log(request_obj)
+    _observe_request(request_obj)
+    politeness.release(request_obj.uuid)
+    
+    # --- New logic: update session destroy_time if api is /api/destroy ---
+    if request_obj.url == "/api/destroy":
+        async with sessions_lock:
+            session = sessions.get(request_obj.session_uuid)
+            if session and session.destroy_time is None:
+                session.destroy_time = datetime.datetime.now()
+                placement.session_ended(session.client_uuid)
+                owner = clients.get(session.client_uuid)
+                if owner is not None:
+                    owner.sessions.discard(session.uuid)
+                admission.dispatch()
+                _unroute([session.uuid])
+                _disown([session.uuid])
+                _journal_session(session)
+                logging.info(f"[SERVER][SESSION] Set destroy_time for session {session.uuid} due to /api/destroy response.")
+    # ---------------------------------------------------------------
+
+async def _ack_after_drain(client_info: ClientInfo, response_msg_id: str, stream: ResponseStream) -> None:
+    """Grant the client more window once the user socket has taken the streamed bytes"""
+    while stream.unacked:
+        try:
+            await stream.slot.drain()
+        except Exception as e:
+            # User went away, keep acknowledging so the client can finish reading from the agent
+            logging.warning(f"[SERVER][HTTP] Error draining streamed response {response_msg_id}: {e}")
+        size, stream.unacked = stream.unacked, 0
+        await write_json_message(client_info.writer, str(uuid.uuid4()), RESPONSE_ACK_TYPE, {"bytes": size}, response_msg_id, client_info.protocol)
+
+async def send_requests(client_info: ClientInfo) -> None:
+    """Write queued requests to the client in priority order; while the connection is backed up
+    (drain) they wait in the outbound queue, where later urgent requests can overtake them"""
+    while True:
+        msg_id, priority, request_buffer = await client_info.outbound.get()
+        if msg_id not in client_info.pending:
+            continue  # Timed out while queued
+        await write_json_message(client_info.writer, msg_id, "http.request", request_buffer, protocol=client_info.protocol, priority=priority)
+        pending = pending_requests.get(msg_id)
+        if pending:
+            pending[1].sent = asyncio.get_running_loop().time()
+
+def _route(session_ids: List[str]) -> None:
+    """Point the cluster routing table at this node for re-announced sessions, in the background"""
+    if routing is None:
+        return
+    task = asyncio.create_task(_set_routes(session_ids))
+    routing_tasks.add(task)
+    task.add_done_callback(routing_tasks.discard)
+
+def _unroute(session_ids: List[str]) -> None:
+    """Drop destroyed sessions from the cluster routing table in the background"""
+    if routing is None:
+        return
+    task = asyncio.create_task(_delete_routes(session_ids))
+    routing_tasks.add(task)
+    task.add_done_callback(routing_tasks.discard)
+
+async def _set_routes(session_ids: List[str]) -> None:
+    try:
+        for session_id in session_ids:
+            await routing.set(session_id, NODE_ADDRESS)
     except Exception as e:
-        logging.error(f"[SERVER][HTTP] Error reading data: {e}")
-        return buffer if buffer else None
+        logging.warning(f"[SERVER][CLUSTER] Error adding {len(session_ids)} sessions to the routing table: {e}")
+
+async def _delete_routes(session_ids: List[str]) -> None:
+    try:
+        for session_id in session_ids:
+            await routing.delete(session_id)
+    except Exception as e:
+        # Left-over routes point at this node, which answers 440 for them
+        logging.warning(f"[SERVER][CLUSTER] Error removing {len(session_ids)} sessions from the routing table: {e}")
 
 #==========  CLIENT CONNECTION HANDLER  ==========
 async def handle_client(clint_reader: asyncio.StreamReader,  client_writer: asyncio.StreamWriter) -> None:
@@ -214,9 +637,15 @@ async def handle_client(clint_reader: asyncio.StreamReader,  client_writer: asyn
         await _close_writer(client_writer)
         return
     
-    # Read heartbeat message after MESSAGE_DELIMITER
+    # Negotiate framing (older clients send their heartbeat right away), then read heartbeat
+    protocol = PROTOCOL_DELIMITED
     try:
         heartbeat_msg = await read_json_message(clint_reader)
+        if heartbeat_msg and heartbeat_msg.get("type") == HELLO_TYPE:
+            protocol = negotiate_protocol(heartbeat_msg.get("data", {}).get("versions"))
+            await write_json_message(client_writer, str(uuid.uuid4()), HELLO_TYPE, {"version": protocol}, heartbeat_msg.get("id"))
+            logging.info(f"[SERVER][CLIENT] Negotiated protocol version {protocol}")
+            heartbeat_msg = await read_json_message(clint_reader, protocol)
         if not heartbeat_msg or heartbeat_msg.get("type") != "dispatcher.heartbeat":
             logging.warning(f"[SERVER][CLIENT] Invalid or missing heartbeat message, closing connection.")
             await _close_writer(client_writer)
@@ -237,28 +666,31 @@ async def handle_client(clint_reader: asyncio.StreamReader,  client_writer: asyn
     addr = client_writer.get_extra_info('peername')
     ip, port = addr if addr else ('unknown', 0)
     connect_time = datetime.datetime.now()
-    client_info = ClientInfo(clint_reader, client_writer, connect_time)
+    client_info = ClientInfo(clint_reader, client_writer, connect_time, protocol=protocol)
     
     # Update client info with heartbeat data
     client_uuid = heartbeat_data.get("uuid")
     client_info.uuid = client_uuid
-    client_info.os = heartbeat_data.get("os")
-    client_info.agent = heartbeat_data.get("agent")
-    client_info.host_name = heartbeat_data.get("host_name")
-    client_info.internal_ip = heartbeat_data.get("ip")
+    _apply_heartbeat(client_info, heartbeat_data)
     client_info.external_ip = ip
-    client_info.cpu_usage = heartbeat_data.get("cpu_usage")
-    client_info.memory_usage = heartbeat_data.get("memory_usage")
     client_info.last_heartbeat = connect_time
     
+    # Responses currently being streamed over this connection
+    streams = client_info.streams
+    
     logging.info(f"[SERVER][CLIENT] Client connected: {ip}:{port} at {connect_time}")
     async with clients_lock:
         clients[client_uuid] = client_info
+    placement.add_client(client_uuid, _capacity(client_info))
+    placement.update_load(client_uuid, client_info.cpu_usage, client_info.memory_usage)
+    admission.dispatch()
+    _journal_client(client_info)
+    sender = asyncio.create_task(send_requests(client_info))
     #
     try:
         while True:
             # Wait for JSON request from server
-            request_msg = await read_json_message(clint_reader)
+            request_msg = await read_json_message(clint_reader, protocol)
             #
             if not request_msg:
                 break
@@ -268,66 +700,85 @@ async def handle_client(clint_reader: asyncio.StreamReader,  client_writer: asyn
                 response_msg_id = request_msg.get("reply", "")
                 #
                 async with pending_requests_lock:
-                    if response_msg_id in pending_requests:
-                        http_writer, request_obj = pending_requests.pop(response_msg_id)
-                        # Decode base64 response data
-                        if http_writer and request_obj:
-                            try:
-                                response_body_b64 = request_msg.get("data", "")
-                                import base64
-                                response_body = base64.b64decode(response_body_b64)
-                                                        # Update log status (try to extract status code from response)
-                                async with logs_lock:
-                                    request_obj.response_time = datetime.datetime.now()
-                                    # Try to extract status code from binary response
-                                    try:
-                                        status_line = response_body.split(b'\r\n')[0]
-                                        status_code = int(status_line.split(b' ')[1])
-                                        request_obj.status_code = status_code
-                                    except (IndexError, ValueError):
-                                        request_obj.status_code = 200  # Default status code
-                                
-                                # --- New logic: update session destroy_time if api is /api/destroy ---
-                                if request_obj.url == "/api/destroy":
-                                    async with sessions_lock:
-                                        session = sessions.get(request_obj.session_uuid)
-                                        if session and session.destroy_time is None:
-                                            session.destroy_time = datetime.datetime.now()
-                                            logging.info(f"[SERVER][SESSION] Set destroy_time for session {session.uuid} due to /api/destroy response.")
-                                # ---------------------------------------------------------------
-                                # Check if writer is still open before writing
-                                if not http_writer.is_closing():
-                                    # Send binary HTTP response back to client
-                                    await _send_response(http_writer, response_body)
-                                else:
-                                    logging.warning(f"[SERVER][HTTP] HTTP writer is closed, cannot send response for request: {response_msg_id}")
-                                    
-                            except Exception as e:
-                                logging.error(f"[SERVER][HTTP] Error processing response for request {response_msg_id}: {e}")
-                                # Try to send error response if writer is still open
-                                try:
-                                    if not http_writer.is_closing():
-                                        await _send_response(http_writer, b'HTTP/1.1 500 Internal Server Error\r\nContent-Length: 21\r\n\r\nInternal server error')
-                                        await _close_writer(http_writer)
-                                except Exception as close_error:
-                                    logging.error(f"[SERVER][HTTP] Error sending error response: {close_error}")
-                        else:
-                            logging.warning(f"[SERVER][HTTP] Invalid http_writer or request_obj for response: {response_msg_id}")
+                    pending = pending_requests.pop(response_msg_id, None)
+                client_info.pending.discard(response_msg_id)
+                if pending:
+                    slot, request_obj = pending
+                    shedder.complete(client_info.completed)
+                    try:
+                        # Raw response bytes (frame body, or base64 from older clients)
+                        response_body = message_bytes(request_msg)
+                        # Update log status (try to extract status code from response)
+                        await _record_response(request_obj, _parse_status_code(response_body), request_msg.get("timing"))
+                        if slot.is_closing():
+                            logging.warning(f"[SERVER][HTTP] HTTP writer is closed, cannot send response for request: {response_msg_id}")
+                        # Send binary HTTP response back in request order, without waiting on the user socket
+                        _respond(slot, response_body)
+                    except Exception as e:
+                        logging.error(f"[SERVER][HTTP] Error processing response for request {response_msg_id}: {e}")
+                        _respond(slot, b'HTTP/1.1 500 Internal Server Error\r\nContent-Length: 21\r\n\r\nInternal server error')
+                else:
+                    logging.warning(f"[SERVER][HTTP] Received response for unknown request: {response_msg_id}")
+            elif request_msg.get("type") == RESPONSE_CHUNK_TYPE:
+                # Streamed response: hand each chunk to the user socket as it arrives
+                response_msg_id = request_msg.get("reply", "")
+                chunk = message_bytes(request_msg)
+                stream = streams.get(response_msg_id)
+                if stream is None:
+                    async with pending_requests_lock:
+                        pending = pending_requests.get(response_msg_id)
+                    if pending:
+                        # First chunk starts with the response head
+                        stream = ResponseStream(*pending)
+                        stream.request_obj.status_code = _parse_status_code(chunk)
+                        streams[response_msg_id] = stream
+                if stream and not stream.slot.is_closing():
+                    # Held back by the slot while earlier responses on the connection are pending
+                    stream.slot.write(chunk)
+                    stream.unacked += len(chunk)
+                    if stream.ack_task is None or stream.ack_task.done():
+                        stream.ack_task = asyncio.create_task(_ack_after_drain(client_info, response_msg_id, stream))
+                else:
+                    # Nobody to deliver to, keep the client's window open so it can finish the request
+                    await write_json_message(client_writer, str(uuid.uuid4()), RESPONSE_ACK_TYPE, {"bytes": len(chunk)}, response_msg_id, protocol)
+            elif request_msg.get("type") == RESPONSE_END_TYPE:
+                response_msg_id = request_msg.get("reply", "")
+                stream = streams.pop(response_msg_id, None)
+                async with pending_requests_lock:
+                    pending = pending_requests.pop(response_msg_id, None)
+                client_info.pending.discard(response_msg_id)
+                if pending:
+                    slot, request_obj = pending
+                    shedder.complete(client_info.completed)
+                    await _record_response(request_obj, request_obj.status_code or 200, request_msg.get("timing"))
+                    error = request_msg.get("data", {}).get("error")
+                    if error or stream is None:
+                        # Truncated (or empty) response, the user connection can't be reused
+                        logging.error(f"[SERVER][HTTP] Streamed response for request {response_msg_id} failed: {error}")
+                        slot.abort()
                     else:
-                        logging.warning(f"[SERVER][HTTP] Received response for unknown request: {response_msg_id}")
+                        slot.finish()
+                else:
+                    logging.warning(f"[SERVER][HTTP] Received response end for unknown request: {response_msg_id}")
+            elif request_msg.get("type") == SESSIONS_TYPE:
+                # Reconnected client still holds these sessions
+                _reattach_sessions(client_info, request_msg.get("data", {}).get("sessions", []))
             elif request_msg.get("type") == "dispatcher.heartbeat":
                 # Handle heartbeat message from client and update ClientInfo
                 heartbeat_data = request_msg.get("data", {})
                 now = datetime.datetime.now()
-                # Update client_info fields with new heartbeat data
-                client_info.os = heartbeat_data.get("os")
-                client_info.agent = heartbeat_data.get("agent")
-                client_info.host_name = heartbeat_data.get("host_name")
-                client_info.internal_ip = heartbeat_data.get("ip")
+                # Update the fields the heartbeat carries (newer clients send only what changed)
+                _apply_heartbeat(client_info, heartbeat_data)
                 # external_ip is set at connect time and not updated here
-                client_info.cpu_usage = heartbeat_data.get("cpu_usage")
-                client_info.memory_usage = heartbeat_data.get("memory_usage")
                 client_info.last_heartbeat = now
+                if clients.get(client_info.uuid) is client_info:
+                    placement.update_load(client_info.uuid, client_info.cpu_usage, client_info.memory_usage)
+                    if "sessions_elsewhere" in heartbeat_data:
+                        # Sessions placed through other dispatchers came or went
+                        placement.set_capacity(client_info.uuid, _capacity(client_info))
+                        admission.dispatch()
+                _journal_client(client_info)
+                metrics.sample(client_info.uuid, client_info.cpu_usage, client_info.memory_usage, placement.active.get(client_info.uuid, 0), now)
                 # Log the heartbeat update
                 logging.info(f"[SERVER][CLIENT] Heartbeat updated for client {client_info.uuid} at {now}: {json.dumps(heartbeat_data, ensure_ascii=False)}")
             else:
@@ -335,131 +786,308 @@ async def handle_client(clint_reader: asyncio.StreamReader,  client_writer: asyn
     except Exception as e:
         logging.error(f"[SERVER][CLIENT] Error handling client {ip}:{port}: {e}")
     finally:
-        # Close client writer
-        await _close_writer(client_writer)
-        
+        sender.cancel()
         # Update client info
         disconnect_time = datetime.datetime.now()
         client_info.disconnect_time = disconnect_time
+        if clients.get(client_info.uuid) is client_info:
+            placement.remove_client(client_info.uuid)
+        # Callers get a 502 now instead of waiting for their timeouts, sessions wait for a reconnect
+        _release_client(client_info)
+        _journal_client(client_info)
+        
+        # Close client writer
+        await _close_writer(client_writer)
         logging.info(f"[SERVER][CLIENT] Client disconnected: {ip}:{port} at {disconnect_time}")
 
+#==========  WORKER ROUTING  ==========
+# Keep-alive connections to the other workers' Unix sockets
+worker_pools: Dict[int, HttpConnectionPool] = {}
+
+def worker_socket_path(index: int) -> str:
+    return os.path.join(WORKER_SOCKET_DIR, f"dispatcher-{HTTP_PORT}-{index}.sock")
+
+def _new_session_id() -> str:
+    """uuid4, with the owning worker in the first byte when running several workers"""
+    session_id = str(uuid.uuid4())
+    return f"{worker_index:02x}{session_id[2:]}" if WORKER_COUNT > 1 else session_id
+
+def _home_worker(session_id: str) -> Optional[int]:
+    """Worker that created a session (from its id), None when running a single process"""
+    if WORKER_COUNT <= 1:
+        return None
+    try:
+        index = int(session_id[:2], 16)
+    except ValueError:
+        return None
+    return index if index < WORKER_COUNT else None
+
+def _session_worker(session_id: str) -> Optional[int]:
+    """Worker that owns a session: this one while live here, where its crawler re-announced it, else the one that created it"""
+    if WORKER_COUNT > 1 and session_id in sessions:
+        return worker_index
+    owner = session_owners.get(session_id)
+    return owner if owner is not None else _home_worker(session_id)
+
+def _announce_owners(session_ids: List[str], owner: Optional[int]) -> None:
+    """Tell the other workers that `owner` holds the sessions now (None: they ended), in the background"""
+    if WORKER_COUNT <= 1 or not session_ids:
+        return
+    task = asyncio.create_task(_send_owners(session_ids, owner))
+    owner_tasks.add(task)
+    task.add_done_callback(owner_tasks.discard)
+
+def _disown(session_ids: List[str]) -> None:
+    """Ended sessions that had moved here from another worker, the others can forget the move"""
+    _announce_owners([session_id for session_id in session_ids if _home_worker(session_id) not in (None, worker_index)], None)
+
+async def _send_owners(session_ids: List[str], owner: Optional[int]) -> None:
+    body = json.dumps({"sessions": session_ids, "worker": owner}).encode()
+    request_bytes = (f"POST {WORKER_OWNERS_PATH} HTTP/1.1\r\nHost: worker\r\n{FORWARDED_HEADER}: 1\r\n"
+                     f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n").encode() + body
+    for index in range(WORKER_COUNT):
+        if index == worker_index:
+            continue
+        try:
+            await _worker_pool(index).request(request_bytes)
+        except Exception as e:
+            logging.warning(f"[SERVER][WORKER] Error announcing {len(session_ids)} sessions to worker {index}: {e}")
+
+def _apply_owners(session_ids: List[str], owner: Optional[int]) -> None:
+    """Another worker took the sessions (its crawler reconnected there) or ended them (owner None)"""
+    released = 0
+    for session_id in session_ids:
+        if owner is None or owner == _home_worker(session_id):
+            session_owners.pop(session_id, None)
+        else:
+            session_owners[session_id] = owner
+        if owner is None:
+            continue
+        # Kept here for the crawler's old connection: let go without destroying it, it lives on
+        session = sessions.get(session_id)
+        if session is not None and session.destroy_time is None:
+            del sessions[session_id]
+            placement.session_ended(session.client_uuid)
+            previous = clients.get(session.client_uuid)
+            if previous is not None:
+                previous.sessions.discard(session_id)
+            released += 1
+    if released:
+        logging.info(f"[SERVER][WORKER] Worker {owner} took {released} sessions of a reconnected client")
+        admission.dispatch()
+
+def _worker_pool(index: int) -> HttpConnectionPool:
+    pool = worker_pools.get(index)
+    if pool is None:
+        pool = worker_pools[index] = HttpConnectionPool(None, None, path=worker_socket_path(index))
+    return pool
+
+def _forward_request(request: HttpRequest, extra_headers: Dict[str, str]) -> bytes:
+    """The user's request as sent to another worker or node, extra_headers mark it so that it is not forwarded again"""
+    skip = tuple(name.lower().encode() + b':' for name in extra_headers)
+    lines = [line for line in request.lines if not line.lower().startswith(skip)]
+    lines.extend(f"{name}: {value}\r\n".encode() for name, value in extra_headers.items())
+    lines.append(b'\r\n')
+    lines.append(request.body)
+    return b"".join(lines)
+
+async def _forward(slot: ResponseSlot, request_bytes: bytes, pool: HttpConnectionPool, decline_503: bool = False) -> bool:
+    """Relay a request to another worker (or node) and copy its response into the slot.
+
+    With decline_503 a 503 (or an unreachable worker) leaves the slot untouched and returns False.
+    """
+    response = pool.stream(request_bytes, STREAM_CHUNK_SIZE)
+    written = False
+    try:
+        async for part in response:
+            if not written and decline_503 and _parse_status_code(part) == 503:
+                return False
+            slot.write(part)
+            written = True
+            await slot.drain()
+        slot.finish()
+        return True
+    except Exception as e:
+        logging.error(f"[SERVER][WORKER] Error forwarding request to {pool.path or f'{pool.host}:{pool.port}'}: {e}")
+        if written:
+            slot.abort()
+        elif decline_503:
+            return False
+        elif pool.path:
+            _respond(slot, b'HTTP/1.1 502 Bad Gateway\r\nContent-Length: 18\r\n\r\nWorker unavailable')
+        else:
+            _respond(slot, b'HTTP/1.1 502 Bad Gateway\r\nContent-Length: 16\r\n\r\nNode unavailable')
+        return True
+    finally:
+        await response.aclose()
+
+async def _start_on_other_worker(slot: ResponseSlot, request: HttpRequest) -> bool:
+    """Offer an /api/start to the other workers' crawlers, True if one took it"""
+    request_bytes = _forward_request(request, {FORWARDED_HEADER: "1", "X-Max-Wait": "0"})
+    for i in range(1, WORKER_COUNT):
+        index = (worker_index + i) % WORKER_COUNT
+        if await _forward(slot, request_bytes, _worker_pool(index), decline_503=True):
+            return True
+    return False
+
+#==========  CLUSTER ROUTING  ==========
+# Keep-alive connections to the other nodes' HTTP ports
+node_pools: Dict[str, HttpConnectionPool] = {}
+
+def _node_pool(node: str) -> HttpConnectionPool:
+    pool = node_pools.get(node)
+    if pool is None:
+        host, _, port = node.rpartition(":")
+        pool = node_pools[node] = HttpConnectionPool(host, int(port))
+    return pool
+
+async def _start_on_other_node(slot: ResponseSlot, request: HttpRequest) -> bool:
+    """Offer an /api/start to the other nodes, those with the most free browsers first, True if one took it"""
+    free: Dict[str, int] = {}
+    for info in (await routing.nodes()).values():
+        if info.get("address") != NODE_ADDRESS:
+            free[info["address"]] = free.get(info["address"], 0) + info.get("free", 0)
+    request_bytes = _forward_request(request, {NODE_HEADER: NODE_ADDRESS, "X-Max-Wait": "0"})
+    for node in sorted((node for node, count in free.items() if count > 0), key=free.get, reverse=True):
+        if await _forward(slot, request_bytes, _node_pool(node), decline_503=True):
+            return True
+    return False
+
+async def register_node_periodically(interval: float = NODE_REGISTER_INTERVAL) -> None:
+    """Announce this node (one entry per worker) and its free browsers to the routing table"""
+    while True:
+        try:
+            await routing.register_node(f"{NODE_ADDRESS}/{worker_index}", {"address": NODE_ADDRESS, "free": placement.free_browsers(), "clients": len(placement.online())})
+        except Exception as e:
+            logging.warning(f"[SERVER][CLUSTER] Error registering node {NODE_ADDRESS}: {e}")
+        
+        await asyncio.sleep(interval)
+
 #==========  HTTP REQUEST HANDLER  ==========
 async def handle_http(http_reader: asyncio.StreamReader,  http_writer: asyncio.StreamWriter) -> None:
     #
     addr = http_writer.get_extra_info('peername')
+    # Another worker, over its Unix socket
+    internal = isinstance(http_writer.get_extra_info('sockname'), str)
     logging.info(f"[SERVER][HTTP] HTTP client connected: {addr}")
+    # Responses go out in request order, up to MAX_PIPELINED_REQUESTS may be outstanding
+    sequencer = ResponseSequencer(http_writer, MAX_PIPELINED_REQUESTS)
+    slot = None
+    forwards = set()  # requests being relayed to other workers or nodes
     #
     try:
         while True:  # Keep connection open to handle multiple requests
-            # Read HTTP request and parse content-length
-            request_lines = []
-            
-            # Read request line first and validate HTTP protocol start
-            url = None
+            await sequencer.wait_capacity()
+            slot = None
+            # Read the whole request (header block and body) under one deadline
             try:
-                line = await _read_until_delimiter(http_reader, delimiter='\r\n', timeout=10.0, max_size=8192)
-                if not line:
-                    logging.info(f"[SERVER][HTTP] HTTP client disconnected: {addr}")
-                    break
-                
-                # Simple parse: get method and url
-                parts = line.decode(errors='ignore').strip().split()
-                if len(parts) < 2:
-                    logging.warning(f"[SERVER][HTTP] Invalid request format from {addr}")
-                    await _close_writer(http_writer)
-                    break
-                
-                method, url = parts[0], parts[1]
-                
-                # Check if method is supported (only GET and POST allowed)
-                if method.upper() not in ['GET', 'POST']:
-                    logging.warning(f"[SERVER][HTTP] Unsupported HTTP method '{method}' from {addr}")
-                    await _close_writer(http_writer)
-                    break
-                
-                request_lines.append(line)
-                
-            except Exception as e:
-                logging.error(f"[SERVER][HTTP] Error parsing request from {addr}: {e}")
-                await _close_writer(http_writer)
+                request = await asyncio.wait_for(read_request(http_reader), timeout=REQUEST_TIMEOUT)
+            except HttpError as e:
+                logging.warning(f"[SERVER][HTTP] Invalid request from {addr}: {e}")
+                _respond(sequencer.open_slot(), e.response())
+                break
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                logging.info(f"[SERVER][HTTP] HTTP client timed out or disconnected: {addr}")
                 break
+            if request is None:
+                logging.info(f"[SERVER][HTTP] HTTP client disconnected: {addr}")
+                break
+            received = asyncio.get_running_loop().time()
             
-            # Read headers
-            x_session_id = None
-            content_length = 0
-            connection_close = None
-            while True:
-                line = await _read_until_delimiter(http_reader, delimiter='\r\n', timeout=10.0, max_size=8192)
-                if not line:
-                    logging.warning(f"[SERVER][HTTP] Connection closed while reading headers from {addr}")
-                    break
-                
-                decoded = line.decode(errors='ignore')
-                
-                # Check for end of headers
-                if line == b'\r\n':
-                    if connection_close is None:
-                        request_lines.append(b'Connection: close\r\n')
-                    request_lines.append(line)
-                    break
-                
-                # Parse specific headers
-                if decoded.lower().startswith('x-session-id:'):
-                    x_session_id = decoded.split(':', 1)[1].strip()
-                elif decoded.lower().startswith('content-length:'):
-                    try:
-                        content_length = int(decoded.split(':', 1)[1].strip())
-                    except ValueError:
-                        pass
-                elif decoded.lower().startswith('connection:'):
-                    connection_close = decoded[len('connection:'):].strip()
-                    request_lines.append(b'Connection: close\r\n')
-                    continue
-                
-                request_lines.append(line)
+            method, url = request.method, request.url
+            slot = sequencer.open_slot()
             
-            # Check if connection is closed
-            if not request_lines:
-                logging.info(f"[SERVER][HTTP] HTTP client disconnected: {addr}")
+            if url == WORKER_OWNERS_PATH and internal:
+                try:
+                    owners = json.loads(request.body)
+                    _apply_owners(list(owners.get("sessions", [])), owners.get("worker"))
+                    _respond(slot, b'HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n')
+                except (ValueError, AttributeError, TypeError) as e:
+                    logging.warning(f"[SERVER][WORKER] Invalid session owners from {addr}: {e}")
+                    _respond(slot, HttpError(400, "Bad Request").response())
+                continue
+            
+            # Check if method is supported (only GET and POST allowed)
+            if method not in ['GET', 'POST']:
+                logging.warning(f"[SERVER][HTTP] Unsupported HTTP method '{method}' from {addr}")
+                slot.finish()
                 break
-
-            # Read body if present
-            body_data = b""
-            if content_length > 0:
+            
+            x_session_id = request.headers.get('x-session-id') or None
+            forwarded = FORWARDED_HEADER.lower() in request.headers
+            via = NODE_HEADER.lower() in request.headers
+            # Sessions of other nodes are found in the routing table
+            if x_session_id and routing is not None and not via and not forwarded and x_session_id not in sessions:
                 try:
-                    body_data = await asyncio.wait_for(http_reader.readexactly(content_length), timeout=10.0)
+                    node = await routing.get(x_session_id)
                 except Exception as e:
-                    logging.error(f"[SERVER][HTTP] Error reading body from {addr}: {e}")
-                    await _close_writer(http_writer)
-                    return
+                    logging.error(f"[SERVER][CLUSTER] Error looking up session {x_session_id}: {e}")
+                    _respond(slot, b'HTTP/1.1 502 Bad Gateway\r\nContent-Length: 19\r\n\r\nRouting unavailable')
+                    break
+                if node is not None and node != NODE_ADDRESS:
+                    task = asyncio.create_task(_forward(slot, _forward_request(request, {NODE_HEADER: NODE_ADDRESS}), _node_pool(node)))
+                    forwards.add(task)
+                    task.add_done_callback(forwards.discard)
+                    continue
+            # Sessions live on the worker holding their crawler's control connection
+            owner = _session_worker(x_session_id) if x_session_id else None
+            if owner is not None and owner != worker_index and not forwarded:
+                task = asyncio.create_task(_forward(slot, _forward_request(request, {FORWARDED_HEADER: "1"}), _worker_pool(owner)))
+                forwards.add(task)
+                task.add_done_callback(forwards.discard)
+                continue
+            # Overloaded: tell the user when to come back instead of queueing more on the clients
+            retry_after = shedder.check(len(pending_requests), sum(_write_buffer(c) for c in clients.values()))
+            if retry_after is not None:
+                logging.warning(f"[SERVER][HTTP] Shedding {url} from {addr}: dispatcher over its limits, Retry-After {retry_after}s")
+                _shed(slot, retry_after)
+                continue
+            # Relay with Connection: close, older clients read the response until EOF
+            skip = (b'connection:', FORWARDED_HEADER.lower().encode() + b':', NODE_HEADER.lower().encode() + b':', TRACE_HEADER.lower().encode() + b':')
+            request_lines = [line for line in request.lines if not line.lower().startswith(skip)]
+            request_lines.append(b'Connection: close\r\n')
+            request_lines.append(b'\r\n')
+            body_data = request.body
 
             # If there is no x_session_id in the header, generate one using uuid4
             session=None
             if url==r'/api/start' and not x_session_id :
-                client = None
-                async with clients_lock:
-                    # Count sessions per client UUID
-                    client_session_counts = {}
-                    async with sessions_lock:
-                        for session in sessions.values():
-                            if session.destroy_time is None:  # Only count active sessions
-                                client_uuid = session.client_uuid
-                                client_session_counts[client_uuid] = client_session_counts.get(client_uuid, 0) + 1
-                    
-                    # Find available client that doesn't exceed max_browser_count
-                    min_session_count = float('inf')
-                    for c in clients.values():
-                        if c.disconnect_time is None:
-                            current_count = client_session_counts.get(c.uuid, 0)
-                            if current_count < c.max_browser_count and current_count < min_session_count:
-                                min_session_count = current_count
-                                client = c
+                try:
+                    priority = int(request.headers.get('x-admission-priority', 0))
+                    max_wait = min(float(request.headers.get('x-max-wait', ADMISSION_MAX_WAIT)), ADMISSION_MAX_WAIT_LIMIT)
+                except ValueError:
+                    _respond(slot, HttpError(400, "Bad Request").response())
+                    break
+                # Online client below its max_browser_count, chosen by the configured strategy; when all
+                # are full wait in line for one (the session is counted as soon as it is handed out)
+                placement_key = request.headers.get('x-placement-key')
+                if not forwarded and (WORKER_COUNT > 1 or (routing is not None and not via)):
+                    # Full here, try the other workers' and then the other nodes' crawlers before waiting in line
+                    client_uuid = await admission.admit(placement_key, priority, 0)
+                    if client_uuid is None:
+                        if WORKER_COUNT > 1 and await _start_on_other_worker(slot, request):
+                            continue
+                        if routing is not None and not via and await _start_on_other_node(slot, request):
+                            continue
+                        client_uuid = await admission.admit(placement_key, priority, max_wait)
+                else:
+                    client_uuid = await admission.admit(placement_key, priority, max_wait)
+                client = clients.get(client_uuid) if client_uuid else None
                 if client is None:
-                    await _send_response(http_writer, b'HTTP/1.1 503 Service Unavailable\r\nContent-Length: 19\r\n\r\nNo client available')
-                    await _close_writer(http_writer)
-                    return
+                    if client_uuid:
+                        placement.session_ended(client_uuid)
+                        admission.dispatch()
+                    _respond(slot, b'HTTP/1.1 503 Service Unavailable\r\nContent-Length: 19\r\n\r\nNo client available')
+                    break
+                retry_after = _check_client_load(client)
+                if retry_after is not None:
+                    placement.session_ended(client_uuid)
+                    admission.dispatch()
+                    logging.warning(f"[SERVER][HTTP] Shedding {url} from {addr}: client {client_uuid} over its limits, Retry-After {retry_after}s")
+                    _shed(slot, retry_after)
+                    continue
 
-                x_session_id = str(uuid.uuid4())
+                x_session_id = _new_session_id()
                 # Find the position to insert X-Session-Id header
                 insert_pos = len(request_lines)  # Default: insert at the end
                 for i, l in enumerate(request_lines):
@@ -476,40 +1104,55 @@ async def handle_http(http_reader: asyncio.StreamReader,  http_writer: asyncio.S
                         init_time=datetime.datetime.now(),
                     )
                     sessions[x_session_id] = session
+                client.sessions.add(x_session_id)
+                _journal_session(session)
+                if routing is not None:
+                    # Before the user can see the id, requests for it may arrive at any node
+                    try:
+                        await routing.set(x_session_id, NODE_ADDRESS)
+                    except Exception as e:
+                        logging.error(f"[SERVER][CLUSTER] Error adding session {x_session_id} to the routing table: {e}")
             else:
                 async with sessions_lock:
                     session = sessions.get(x_session_id)
                 # Check if session is missing or destroyed
                 if not session or session.destroy_time is not None:
-                    await _send_response(http_writer, b'HTTP/1.1 440 Session Expired\r\nContent-Length: 16\r\n\r\nSession Expired')
-                    await _close_writer(http_writer)
-                    return
+                    _respond(slot, b'HTTP/1.1 440 Session Expired\r\nContent-Length: 15\r\n\r\nSession Expired')
+                    break
+                owner = clients.get(session.client_uuid)
+                retry_after = _check_client_load(owner) if owner is not None else None
+                if retry_after is not None:
+                    logging.warning(f"[SERVER][HTTP] Shedding {url} from {addr}: client {owner.uuid} over its limits, Retry-After {retry_after}s")
+                    _shed(slot, retry_after)
+                    continue
                 
+            msg_id = str(uuid.uuid4())
+            # Followed through the client and the agent, the caller's own id if it sent one
+            trace_id = request.headers.get(TRACE_HEADER.lower(), '')
+            if not TRACE_ID_PATTERN.fullmatch(trace_id):
+                trace_id = msg_id
+            request_lines.insert(len(request_lines) - 1, f"{TRACE_HEADER}: {trace_id}\r\n".encode())
             if url==r'/api/go' :
                 body = json.loads(body_data.decode('utf-8', errors='ignore'))
                 session.url=body.get('url')
+                _journal_session(session)
+                # Wait in line until the site allows another navigation (from any session)
+                domain = registrable_domain(session.url)
+                if domain and not await politeness.acquire(domain, msg_id, DOMAIN_MAX_WAIT):
+                    logging.warning(f"[SERVER][HTTP] Navigation to {domain} from {addr} waited {DOMAIN_MAX_WAIT:.0f}s, giving up")
+                    _shed(slot, RETRY_AFTER_MAX)
+                    continue
 
             # Get client and send JSON request
             client = clients.get(session.client_uuid)
-            if client is None:
-                await _send_response(http_writer, b'HTTP/1.1 503 Service Unavailable\r\nContent-Length: 19\r\n\r\nNo client available')
-                await _close_writer(http_writer)
-                return
-
-            # Create binary HTTP request data
-            request_buffer = b""
-            for line in request_lines:
-                request_buffer += line
-            if body_data:
-                request_buffer += body_data
-            
-            # Encode binary data as base64
-            import base64
-            request_data = base64.b64encode(request_buffer).decode('utf-8')  # Send base64 encoded HTTP request data directly
-            
-            # Send JSON request to client
-            msg_id = str(uuid.uuid4())
-            await write_json_message(client.writer, msg_id, "http.request", request_data)
+            if client is None or client.disconnect_time is not None:
+                politeness.release(msg_id)
+                _respond(slot, b'HTTP/1.1 503 Service Unavailable\r\nContent-Length: 19\r\n\r\nNo client available')
+                break
+
+            # Create binary HTTP request data (sent as frame body, base64 only for older clients)
+            request_lines.append(body_data)
+            request_buffer = b"".join(request_lines)
             
             # Record request
             request_obj = LogInfo(
@@ -518,224 +1161,177 @@ async def handle_http(http_reader: asyncio.StreamReader,  http_writer: asyncio.S
                 url=url,
                 request_time=datetime.datetime.now(),
                 response_time=None,
-                status_code=None
+                status_code=None,
+                trace_id=trace_id,
+                received=received
             )
-            async with logs_lock:
-                logs.append(request_obj)
+            _journal_log(request_obj)
+            metrics.count_request(session.client_uuid, request_obj.request_time)
             
-            # Store request info for later response handling
+            # Store request info for later response handling (before sending, replies can be fast)
             async with pending_requests_lock:
-                pending_requests[msg_id] = (http_writer, request_obj)
+                pending_requests[msg_id] = (slot, request_obj)
+            client.pending.add(msg_id)
+            heapq.heappush(request_deadlines, (asyncio.get_running_loop().time() + REQUEST_DEADLINES.get(url, DEFAULT_REQUEST_DEADLINE), msg_id, client))
+            if client.disconnect_time is not None:
+                # Disconnected while we waited for the lock, after its requests were failed
+                _fail_pending(msg_id, b'HTTP/1.1 502 Bad Gateway\r\nContent-Length: 19\r\n\r\nClient disconnected', 502)
+                continue
+            
+            # Queue for the client by priority, urgent requests overtake those still waiting to be sent
+            priority = parse_priority(request.headers.get(PRIORITY_HEADER.lower()), REQUEST_PRIORITIES.get(url, PRIORITY_NORMAL))
+            client.outbound.put(priority, msg_id, (msg_id, priority, request_buffer), len(request_buffer))
 
     except Exception as e:
         logging.error(f"[SERVER][HTTP] Error handling HTTP client: {e}")
-        await _send_response(http_writer, b'HTTP/1.1 500 Internal Server Error\r\nContent-Length: 21\r\n\r\nInternal server error')
+        if slot is not None and not slot.finished:
+            _respond(slot, b'HTTP/1.1 500 Internal Server Error\r\nContent-Length: 21\r\n\r\nInternal server error')
     finally:
+        # Let outstanding pipelined responses go out before closing
+        await sequencer.wait_idle()
         await _close_writer(http_writer)
         logging.info(f"[SERVER][HTTP] HTTP client disconnected: {addr}")
 
-#==========  DATABASE LOGGING  ==========
-async def log_status_periodically(interval: int = 10) -> None:
-    """Execute database logging periodically"""
+#==========  REQUEST DEADLINES  ==========
+async def reap_expired_requests(interval: float = 0.5) -> None:
+    """Answer 504 for relayed requests past their deadline and tell the client to cancel them"""
+    loop = asyncio.get_running_loop()
     while True:
         try:
-            # Update client max_browser_count from database and update status
-            async with clients_lock:
-                for client in clients.values():
-                    logging.info(f"[SERVER][DB] Processing client: uuid={client.uuid}, connect_time={client.connect_time}, disconnect_time={client.disconnect_time}, max_browser_count={client.max_browser_count}")
-                    try:
-                        connection = get_db_connection()
-                        if connection is None:
-                            continue
-                        cursor = connection.cursor()
-                        
-                        # Try to update existing crawler_info by UUID
-                        status = 10 if client.disconnect_time is None else 20  # 10: online, 20: offline
-                        cursor.execute(
-                            "UPDATE crawler_info SET host_name = %s, internal_ip = %s, external_ip = %s, os = %s, agent = %s, last_heartbeat = %s, status = %s, cpu_usage = %s, memory_usage = %s, update_time = %s WHERE uuid = %s",
-                            (client.host_name, client.internal_ip, client.external_ip, client.os, client.agent, client.last_heartbeat, status, client.cpu_usage, client.memory_usage, datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), client.uuid)
-                        )
-                        
-                        if cursor.rowcount > 0:
-                            # Record was updated, get max_browser_count from crawler_setting
-                            cursor.execute(
-                                "SELECT max_browser_count FROM crawler_setting WHERE crawler_id = (SELECT id FROM crawler_info WHERE uuid = %s)",
-                                (client.uuid,)
-                            )
-                            setting_result = cursor.fetchone()
-                            if setting_result and setting_result[0] is not None:
-                                try:
-                                    client.max_browser_count = int(setting_result[0])  # type: ignore
-                                    logging.info(f"[SERVER][DB] Updated max_browser_count to {client.max_browser_count} for client {client.uuid}")
-                                except (ValueError, TypeError):
-                                    logging.warning(f"[SERVER][DB] Invalid max_browser_count value for client {client.uuid}: {setting_result[0]}")
-                            
-                            connection.commit()
-                            logging.info(f"[SERVER][DB] Updated existing crawler_info with UUID: {client.uuid}")
-                        else:
-                            # No record was updated, create new crawler_info
-                            cursor.execute(
-                                "INSERT INTO crawler_info (uuid, host_name, internal_ip, external_ip, os, agent, last_heartbeat, status, cpu_usage, memory_usage, create_time) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
-                                (client.uuid, client.host_name, client.internal_ip, client.external_ip, client.os, client.agent, client.last_heartbeat, status, client.cpu_usage, client.memory_usage, datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-                            )
-                            connection.commit()
-                            crawler_id = cursor.lastrowid
-                            
-                            # Create crawler_setting record for new crawler_info
-                            cursor.execute(
-                                "INSERT INTO crawler_setting (crawler_id, max_browser_count, create_time) VALUES (%s, %s, %s)",
-                                (crawler_id, client.max_browser_count, datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-                            )
-                            connection.commit()
-                            logging.info(f"[SERVER][DB] Created new crawler_info with ID: {crawler_id}")
-                        
-                        cursor.close()
-                        connection.close()
-                        
-                    except Exception as e:
-                        logging.error(f"[SERVER][DB] Error updating client {client.uuid} in database: {e}")
-                        try:
-                            if 'cursor' in locals():
-                                cursor.close()
-                            if 'connection' in locals() and connection:
-                                connection.close()
-                        except Exception as cleanup_error:
-                            logging.error(f"[SERVER][DB] Error during cleanup: {cleanup_error}")
-            
-            # Update sessions in database
-            async with sessions_lock:
-                # Create a copy of the items to avoid modification during iteration
-                for session in sessions.values():
-                    logging.info(f"[SERVER][DB] Processing session: uuid={session.uuid}, client_uuid={session.client_uuid}, init_time={session.init_time}, url={session.url}, destroy_time={session.destroy_time}")
-                    try:
-                        connection = get_db_connection()
-                        if connection is None:
-                            continue
-                        cursor = connection.cursor()
-                        
-                        # First check if crawler_info exists for this session's client_uuid
-                        cursor.execute(
-                            "SELECT id FROM crawler_info WHERE uuid = %s",
-                            (session.client_uuid,)
-                        )
-                        crawler_result = cursor.fetchone()
-                        
-                        if not crawler_result:
-                            # crawler_info doesn't exist, skip this session
-                            logging.warning(f"[SERVER][DB] Skipping session {session.uuid}: crawler_info not found for client_uuid {session.client_uuid}")
-                            cursor.close()
-                            connection.close()
-                            continue
-                        
-                        crawler_id = int(crawler_result[0])  # type: ignore
-                        
-                        # Try to update existing session by UUID
-                        cursor.execute(
-                            "UPDATE crawler_session SET crawler_id = %s, init_time = %s, url = %s, destroy_time = %s, update_time = %s WHERE uuid = %s",
-                            (crawler_id, session.init_time, session.url, session.destroy_time, datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), session.uuid)
-                        )
-                        
-                        if cursor.rowcount > 0:
-                            # Session was updated
-                            connection.commit()
-                            logging.info(f"[SERVER][DB] Updated session with UUID: {session.uuid}")
-                            
-                            # Remove destroyed session from memory
-                            if session.destroy_time is not None:
-                                sessions.pop(session.uuid, None)
-                                logging.info(f"[SERVER][DB] Removed destroyed session from memory: UUID {session.uuid}")
-                        else:
-                            # Session doesn't exist in database, insert new session
-                            cursor.execute(
-                                "INSERT INTO crawler_session (crawler_id, uuid, init_time, url, destroy_time, create_time) VALUES (%s, %s, %s, %s, %s, %s)",
-                                (crawler_id, session.uuid, session.init_time, session.url, session.destroy_time, datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-                            )
-                            connection.commit()
-                            logging.info(f"[SERVER][DB] Created new session with UUID: {session.uuid}")
-                            
-                            # Remove destroyed session from memory
-                            if session.destroy_time is not None:
-                                sessions.pop(session.uuid, None)
-                                logging.info(f"[SERVER][DB] Removed destroyed session from memory: UUID {session.uuid}")
-                        
-                        cursor.close()
-                        connection.close()
-                        
-                    except Exception as e:
-                        logging.error(f"[SERVER][DB] Error updating session {session.uuid} in database: {e}")
-                        try:
-                            if 'cursor' in locals():
-                                cursor.close()
-                            if 'connection' in locals() and connection:
-                                connection.close()
-                        except Exception as cleanup_error:
-                            logging.error(f"[SERVER][DB] Error during cleanup: {cleanup_error}")
-
-            # Update API logs in database
-            async with logs_lock:
-                # Create a copy of the list to avoid modification during iteration
-                logs_to_process = logs.copy()
-                for request in logs_to_process:
-                    logging.info(f"[SERVER][DB] Processing request: uuid={request.uuid}, id={request.id}, session={request.session_uuid}, api={request.url}, request_time={request.request_time}, response_time={request.response_time}, status_code={request.status_code}")
-                    try:
-                        connection = get_db_connection()
-                        if connection is None:
-                            continue
-                        cursor = connection.cursor()
-                        
-                        # Get crawler_session_id for this request
-                        cursor.execute(
-                            "SELECT id FROM crawler_session WHERE uuid = %s",
-                            (request.session_uuid,)
-                        )
-                        session_result = cursor.fetchone()
-                        
-                        if not session_result:
-                            # crawler_session doesn't exist, skip this request
-                            logging.warning(f"[SERVER][DB] Skipping request {request.uuid}: crawler_session not found for session_uuid {request.session_uuid}")
-                            cursor.close()
-                            connection.close()
-                            continue
-                        
-                        session_id = int(session_result[0])  # type: ignore
-                        
-                        if request.id is None:
-                            # Insert new API log
-                            cursor.execute(
-                                "INSERT INTO crawler_log (crawler_session_id, url, request_time, response_time, status_code, create_time) VALUES (%s, %s, %s, %s, %s, %s)",
-                                (session_id, request.url, request.request_time, request.response_time, request.status_code, datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-                            )
-                            connection.commit()
-                            # Save the ID for next update
-                            request.id = cursor.lastrowid
-                            logging.info(f"[SERVER][DB] Created new API log with ID: {request.id}")
-                        else:
-                            # Update existing API log by ID
-                            cursor.execute(
-                                "UPDATE crawler_log SET response_time = %s, status_code = %s, update_time = %s WHERE id = %s",
-                                (request.response_time, request.status_code, datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), request.id)
-                            )
-                            connection.commit()
-                            logging.info(f"[SERVER][DB] Updated API log with ID: {request.id}")
-                        
-                        # If request is complete (has response_time), remove from memory
-                        if request.response_time is not None:
-                            logs.remove(request)
-                            logging.info(f"[SERVER][DB] Removed completed request from memory: ID {request.id}")
-                        
-                        cursor.close()
-                        connection.close()
-                        
-                    except Exception as e:
-                        logging.error(f"[SERVER][DB] Error updating API log for request {request.uuid} in database: {e}")
-                        try:
-                            if 'cursor' in locals():
-                                cursor.close()
-                            if 'connection' in locals() and connection:
-                                connection.close()
-                        except Exception as cleanup_error:
-                            logging.error(f"[SERVER][DB] Error during cleanup: {cleanup_error}")
+            now = loop.time()
+            while request_deadlines and request_deadlines[0][0] <= now:
+                _, msg_id, client_info = heapq.heappop(request_deadlines)
+                if msg_id not in client_info.pending:
+                    continue  # Answered in time, or failed when the client went away
+                client_info.pending.discard(msg_id)
+                stream = client_info.streams.pop(msg_id, None)
+                if stream and stream.ack_task:
+                    stream.ack_task.cancel()
+                logging.warning(f"[SERVER][HTTP] Request {msg_id} to client {client_info.uuid} timed out")
+                _fail_pending(msg_id, b'HTTP/1.1 504 Gateway Timeout\r\nContent-Length: 15\r\n\r\nGateway Timeout', 504, stream is not None)
+                if client_info.outbound.remove(msg_id):
+                    continue  # Never sent
+                # Late replies are dropped as unknown, let the client stop working on it
+                await write_json_message(client_info.writer, str(uuid.uuid4()), CANCEL_TYPE, {}, msg_id, client_info.protocol)
+        except Exception as e:
+            logging.error(f"[SERVER][HTTP] Error in reap_expired_requests: {e}")
+        
+        await asyncio.sleep(interval)
 
+#==========  PROMETHEUS METRICS  ==========
+registry = MetricsRegistry()
+request_count = registry.counter("dispatcher_requests_total", "Relayed requests by API path and status code", ("path", "code"))
+request_duration = registry.histogram("dispatcher_request_duration_seconds", "Relayed request latency by API path", ("path",))
+crawler_request_count = registry.counter("dispatcher_crawler_requests_total", "Relayed requests by crawler and status code", ("crawler", "code"))
+crawler_request_duration = registry.histogram("dispatcher_crawler_request_duration_seconds", "Relayed request latency by crawler", ("crawler",))
+hop_duration = registry.histogram("dispatcher_request_hop_duration_seconds", "Time relayed requests spent per hop (dispatch, link, client, agent, uia, chrome) by API path", ("path", "hop"))
+shed_requests = registry.counter("dispatcher_shed_requests_total", "Requests answered 429 (load shedding, domain wait too long)")
+db_flush_duration = registry.histogram("dispatcher_db_flush_duration_seconds", "Duration of persistence worker flushes", (), SHORT_BUCKETS)
+db_flush_errors = registry.counter("dispatcher_db_flush_errors_total", "Failed persistence worker flushes")
+loop_lag = registry.histogram("dispatcher_event_loop_lag_seconds", "How late the event loop runs a timer", (), SHORT_BUCKETS)
+registry.gauge("dispatcher_pending_requests", "Relayed requests waiting for their response", lambda: [((), len(pending_requests))])
+registry.gauge("dispatcher_clients", "Connected crawler clients", lambda: [((), len(clients))])
+registry.gauge("dispatcher_client_sessions", "Active sessions per crawler", lambda: [((client_uuid,), count) for client_uuid, count in placement.active.items()], ("crawler",))
+registry.gauge("dispatcher_client_in_flight", "Relayed requests in flight per crawler", lambda: [((c.uuid,), len(c.pending)) for c in clients.values()], ("crawler",))
+registry.gauge("dispatcher_client_queued_requests", "Requests waiting in each crawler's outbound queue", lambda: [((c.uuid,), len(c.outbound)) for c in clients.values()], ("crawler",))
+registry.gauge("dispatcher_client_write_buffer_bytes", "Bytes queued for each crawler's control connection", lambda: [((c.uuid,), _write_buffer(c)) for c in clients.values()], ("crawler",))
+registry.gauge("dispatcher_admission_waiting", "/api/start callers waiting for a free browser", lambda: [((), admission.depth)])
+registry.gauge("dispatcher_domain_waiting", "Navigations waiting for their domain's rate limit", lambda: [((), politeness.stats()["waiting"])])
+
+def _observe_request(request_obj: LogInfo) -> None:
+    """Count a relayed request once it is answered (by its client or on its behalf)"""
+    path = request_obj.url.split("?", 1)[0] if request_obj.url else ""
+    path = path if path in METRIC_PATHS else "other"
+    code = str(request_obj.status_code)
+    seconds = (request_obj.response_time - request_obj.request_time).total_seconds()
+    request_count.inc(path, code)
+    request_duration.observe(seconds, path)
+    for hop in REQUEST_HOPS:
+        ms = getattr(request_obj, f"{hop}_ms")
+        if ms is not None:
+            hop_duration.observe(ms / 1000, path, hop)
+    session = sessions.get(request_obj.session_uuid)
+    if session is not None:
+        crawler_request_count.inc(session.client_uuid, code)
+        crawler_request_duration.observe(seconds, session.client_uuid)
+
+def _observe_flush(seconds: float, succeeded: bool) -> None:
+    db_flush_duration.observe(seconds)
+    if not succeeded:
+        db_flush_errors.inc()
+
+async def measure_loop_lag(interval: float = LOOP_LAG_INTERVAL) -> None:
+    """Sample how much later than asked the event loop wakes up a sleeping task"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        loop_lag.observe(max(0.0, loop.time() - started - interval))
+
+async def handle_metrics(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """GET /metrics in the Prometheus text format, one request per connection"""
+    try:
+        request = await asyncio.wait_for(read_request(reader), timeout=REQUEST_TIMEOUT)
+        if request is not None and request.method == "GET" and request.url.split("?", 1)[0] == "/metrics":
+            body = registry.render()
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\nConnection: close\r\n'
+                         + f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+        elif request is not None:
+            writer.write(b'HTTP/1.1 404 Not Found\r\nConnection: close\r\nContent-Length: 9\r\n\r\nNot Found')
+        await writer.drain()
+    except (HttpError, asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError) as e:
+        logging.warning(f"[SERVER][METRICS] Error serving metrics: {e}")
+    finally:
+        await _close_writer(writer)
+
+#==========  DATABASE LOGGING  ==========
+def _apply_settings(settings: Dict[str, int]) -> None:
+    """Apply max_browser_count read back by the persistence worker (runs on the event loop)"""
+    for client_uuid, max_browser_count in settings.items():
+        client = clients.get(client_uuid)
+        if client is not None and client.max_browser_count != max_browser_count:
+            client.max_browser_count = max_browser_count
+            placement.set_capacity(client_uuid, _capacity(client))
+            admission.dispatch()
+            logging.info(f"[SERVER][DB] Updated max_browser_count to {max_browser_count} for client {client_uuid}")
+
+async def enqueue_status(store: PersistenceWorker, final: bool = False) -> None:
+    """Hand the change journal and closed metric minutes to the persistence worker, then drop destroyed sessions from memory"""
+    global journal
+    changes, journal = journal, []
+    changes.extend(metrics.collect(everything=final))
+    if not changes:
+        return
+    store.put_many(changes)
+    # The worker keeps destroyed sessions until they are written
+    destroyed = [c.uuid for c in changes if isinstance(c, SessionRecord) and c.destroy_time is not None]
+    if destroyed:
+        async with sessions_lock:
+            for session_uuid in destroyed:
+                session = sessions.get(session_uuid)
+                if session is None or session.destroy_time is None:
+                    continue  # re-announced by its client since
+                del sessions[session_uuid]
+                logging.info(f"[SERVER][DB] Removed destroyed session from memory: UUID {session_uuid}")
+
+async def log_status_periodically(store: PersistenceWorker, interval: int = 10) -> None:
+    """Hand dispatcher state to the persistence worker periodically"""
+    shed_logged = 0
+    while True:
+        try:
+            await enqueue_status(store)
+            stats = store.stats()
+            if stats["spool_depth"] or stats["buffered_logs"]:
+                logging.info(f"[SERVER][DB] Persistence backlog: {json.dumps(stats)}")
+            if admission.depth or admission.queued:
+                logging.info(f"[SERVER][HTTP] Admission queue: {json.dumps(admission.stats())}")
+            politeness.prune()
+            domain_stats = politeness.stats()
+            if domain_stats["waiting"]:
+                logging.info(f"[SERVER][HTTP] Navigations waiting for their domain: {json.dumps(domain_stats)}")
+            if shedder.shed != shed_logged:
+                shed_logged = shedder.shed
+                logging.info(f"[SERVER][HTTP] Load shedding: {json.dumps(shedder.stats())}")
         except Exception as e:
             logging.error(f"[SERVER][DB] Error in log_status_periodically: {e}")
         
@@ -743,13 +1339,42 @@ async def log_status_periodically(interval: int = 10) -> None:
 
 #==========  MAIN FUNCTION  ==========
 async def main() -> None:
-    client_server = await asyncio.start_server(handle_client, '0.0.0.0', CLIENT_PORT)
-    http_server = await asyncio.start_server(handle_http, '0.0.0.0', HTTP_PORT)
+    # Database writes happen on their own thread
+    spool_dir = os.path.join(SPOOL_DIR, f"worker-{worker_index}") if WORKER_COUNT > 1 else SPOOL_DIR
+    store = PersistenceWorker(get_db_connection, asyncio.get_running_loop(), _apply_settings, _observe_flush, spool_dir=spool_dir)
+    store.start()
+    registry.gauge("dispatcher_db_pending_changes", "Changes queued for the database but not written yet", lambda: [((), store.pending())])
+    # Several workers share the ports, the kernel spreads connections between them
+    reuse_port = WORKER_COUNT > 1
+    client_server = await asyncio.start_server(handle_client, '0.0.0.0', CLIENT_PORT, reuse_port=reuse_port)
+    http_server = await asyncio.start_server(handle_http, '0.0.0.0', HTTP_PORT, reuse_port=reuse_port)
+    servers = [http_server.serve_forever(), client_server.serve_forever()]
+    if WORKER_COUNT > 1:
+        # Requests forwarded by the other workers
+        path = worker_socket_path(worker_index)
+        if os.path.exists(path):
+            os.unlink(path)
+        worker_server = await asyncio.start_unix_server(handle_http, path=path)
+        servers.append(worker_server.serve_forever())
+    metrics_port = 0
+    if METRICS_PORT:
+        # Scraped per process, away from the port that proxies to the agents; relaying goes on without it
+        try:
+            metrics_server = await asyncio.start_server(handle_metrics, '0.0.0.0', METRICS_PORT + worker_index)
+            servers.append(metrics_server.serve_forever())
+            metrics_port = METRICS_PORT + worker_index
+        except OSError as e:
+            logging.error(f"[SERVER][METRICS] Cannot listen on port {METRICS_PORT + worker_index}, metrics disabled: {e}")
     
     async with http_server, client_server:
-        logging.info(f"[SERVER][MAIN] Server started. HTTP(0.0.0.0:{HTTP_PORT}), Client(0.0.0.0:{CLIENT_PORT})")
+        logging.info(f"[SERVER][MAIN] Server started. HTTP(0.0.0.0:{HTTP_PORT}), Client(0.0.0.0:{CLIENT_PORT})"
+                     + (f", Metrics(0.0.0.0:{metrics_port})" if metrics_port else "")
+                     + (f", worker {worker_index + 1}/{WORKER_COUNT}" if WORKER_COUNT > 1 else "")
+                     + (f", cluster node {NODE_ADDRESS} ({ROUTING_TABLE})" if routing is not None else ""))
         try:
-            await asyncio.gather(http_server.serve_forever(), client_server.serve_forever(), log_status_periodically())
+            if routing is not None:
+                servers.append(register_node_periodically())
+            await asyncio.gather(*servers, log_status_periodically(store), reap_expired_requests(), measure_loop_lag())
         except KeyboardInterrupt:
             logging.info("[SERVER][MAIN] Received shutdown signal, stopping servers...")
             # Close all client connections
@@ -766,11 +1391,9 @@ async def main() -> None:
             
             # Close all pending HTTP requests
             async with pending_requests_lock:
-                for msg_id, (http_writer, request_obj) in list(pending_requests.items()):
+                for msg_id, (slot, request_obj) in list(pending_requests.items()):
                     try:
-                        if not http_writer.is_closing():
-                            http_writer.close()
-                            await http_writer.wait_closed()
+                        slot.abort()
                         logging.info(f"[SERVER][MAIN] Closed pending HTTP request: {msg_id}")
                     except Exception as e:
                         logging.error(f"[SERVER][MAIN] Error closing HTTP request {msg_id}: {e}")
@@ -779,6 +1402,12 @@ async def main() -> None:
         except Exception as e:
             logging.error(f"[SERVER][MAIN] Unexpected error: {e}")
         finally:
+            # Write what is left before exiting
+            try:
+                await enqueue_status(store, final=True)
+                await asyncio.get_running_loop().run_in_executor(None, store.stop)
+            except Exception as e:
+                logging.error(f"[SERVER][MAIN] Error flushing database writes: {e}")
             logging.info("[SERVER][MAIN] Server shutdown complete.")
 
 def run_server():
@@ -790,5 +1419,34 @@ def run_server():
     except Exception as e:
         logging.error(f"[SERVER] Server error: {e}")
 
-if __name__ == '__main__':
+def run_worker(index: int) -> None:
+    """Entry point of one worker process"""
+    global worker_index
+    worker_index = index
+    for handler in logging.getLogger().handlers:
+        handler.setFormatter(logging.Formatter(f'[%(asctime)s] %(levelname)s [W{index}] %(message)s'))
     run_server()
+
+def run_workers(count: int) -> None:
+    """Start `count` worker processes sharing the listening ports and wait for them"""
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=run_worker, args=(i,), name=f"dispatcher-worker-{i}") for i in range(count)]
+    for process in processes:
+        process.start()
+    logging.info(f"[SERVER][MAIN] Started {count} workers on HTTP({HTTP_PORT}) and Client({CLIENT_PORT})")
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # Workers get the Ctrl+C too, give them time to flush
+        for process in processes:
+            process.join(10)
+            if process.is_alive():
+                process.terminate()
+        logging.info("[SERVER] Server stopped by user (Ctrl+C)")
+
+if __name__ == '__main__':
+    if WORKER_COUNT > 1:
+        run_workers(WORKER_COUNT)
+    else:
+        run_server()
@@ -0,0 +1,89 @@
+#
+# Load shedding of user requests: limits on requests in flight and on bytes queued for the clients
+#
+#==========  IMPORTS AND CONFIGURATION  ==========
+import math
+import time
+from typing import Any, Dict, Optional
+
+#==========  CONSTANTS AND CONFIGURATION  ==========
+# Seconds for the completion rate to forget half of its history
+RATE_HALF_LIFE = 5.0
+# Completions per second assumed when nothing has completed lately (keeps Retry-After finite)
+RATE_FLOOR = 1.0
+
+# Bounds of the Retry-After header (seconds)
+RETRY_AFTER_MIN = 1
+RETRY_AFTER_MAX = 30
+
+#==========  COMPLETION RATE  ==========
+class RateMeter:
+    """Exponentially weighted events per second, updated in windows of at least a second"""
+    def __init__(self, half_life: float = RATE_HALF_LIFE):
+        self.half_life = half_life
+        self.rate = 0.0
+        self._count = 0
+        self._since = time.monotonic()
+
+    def mark(self, count: int = 1) -> None:
+        self._count += count
+        self._roll()
+
+    def value(self) -> float:
+        self._roll()
+        return self.rate
+
+    def _roll(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._since
+        if elapsed < 1.0:
+            return
+        if self.rate == 0.0:
+            self.rate = self._count / elapsed  # first window (or after idling), nothing to average with
+        else:
+            alpha = 1.0 - 0.5 ** (elapsed / self.half_life)
+            self.rate += alpha * (self._count / elapsed - self.rate)
+        self._count = 0
+        self._since = now
+
+#==========  LOAD SHEDDER  ==========
+class LoadShedder:
+    """Admits a request, or says how long its sender should wait (Retry-After) before trying again.
+
+    Limits apply to the whole dispatcher process and to each client: requests in flight and bytes
+    waiting in the control connection's write buffer (0 turns a limit off). Retry-After is the time
+    to work off the requests ahead at the rate requests have been completing lately.
+    """
+    def __init__(self, max_in_flight: int = 0, max_write_buffer: int = 0, max_client_in_flight: int = 0, max_client_write_buffer: int = 0):
+        self.max_in_flight = max_in_flight
+        self.max_write_buffer = max_write_buffer
+        self.max_client_in_flight = max_client_in_flight
+        self.max_client_write_buffer = max_client_write_buffer
+        self.completed = RateMeter()
+        self.shed = 0  # requests answered 429
+
+    def complete(self, client_meter: RateMeter) -> None:
+        """A relayed request was answered by its client"""
+        self.completed.mark()
+        client_meter.mark()
+
+    def check(self, in_flight: int, write_buffer: int) -> Optional[int]:
+        """Retry-After for a request when the dispatcher is over its limits, None to admit it"""
+        return self._check(in_flight, write_buffer, self.max_in_flight, self.max_write_buffer, self.completed)
+
+    def check_client(self, in_flight: int, write_buffer: int, completed: RateMeter) -> Optional[int]:
+        """Retry-After for a request to a client over its limits, None to admit it"""
+        return self._check(in_flight, write_buffer, self.max_client_in_flight, self.max_client_write_buffer, completed)
+
+    def _check(self, in_flight: int, write_buffer: int, max_in_flight: int, max_write_buffer: int, completed: RateMeter) -> Optional[int]:
+        if (max_in_flight and in_flight >= max_in_flight) or (max_write_buffer and write_buffer >= max_write_buffer):
+            self.shed += 1
+            wait = math.ceil((in_flight + 1) / max(completed.value(), RATE_FLOOR))
+            return min(max(wait, RETRY_AFTER_MIN), RETRY_AFTER_MAX)
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "shed": self.shed,
+            "completed_per_sec": round(self.completed.value(), 1),
+        }
@@ -0,0 +1,587 @@
+#
+# Write-behind persistence of dispatcher state (crawler_info, crawler_session, crawler_log, crawler_metric)
+#
+#==========  IMPORTS AND CONFIGURATION  ==========
+import asyncio
+import datetime
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+#==========  CONSTANTS AND CONFIGURATION  ==========
+# Seconds between flushes, and the number of queued changes that triggers an early one
+FLUSH_INTERVAL = 1.0
+FLUSH_BATCH_SIZE = 500
+
+# Logs kept in memory while the database is unreachable, beyond that they spill to the spool
+MAX_BUFFERED_LOGS = 10000
+
+# Records per spool segment file, and the segments replayed per flush once the database is back
+SPOOL_SEGMENT_RECORDS = 5000
+SPOOL_REPLAY_SEGMENTS = 4
+
+# Placeholders per SELECT ... IN (...) when resolving uuid -> id
+LOOKUP_BATCH_SIZE = 500
+
+# crawler_metric rollups: bucket size in seconds -> how long its rows are kept
+METRIC_RESOLUTIONS = {
+    60: datetime.timedelta(days=2),
+    3600: datetime.timedelta(days=90),
+}
+# Seconds between deletes of rows past their retention
+METRIC_RETENTION_INTERVAL = 3600.0
+# Minute buckets kept in memory while the database is unreachable, the oldest are dropped beyond that
+MAX_BUFFERED_METRICS = 50000
+
+CLIENT_UPSERT = (
+    "INSERT INTO crawler_info (uuid, host_name, internal_ip, external_ip, os, agent, last_heartbeat, status, cpu_usage, memory_usage, create_time) "
+    "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) "
+    "ON DUPLICATE KEY UPDATE host_name = VALUES(host_name), internal_ip = VALUES(internal_ip), external_ip = VALUES(external_ip), os = VALUES(os), "
+    "agent = VALUES(agent), last_heartbeat = VALUES(last_heartbeat), status = VALUES(status), cpu_usage = VALUES(cpu_usage), "
+    "memory_usage = VALUES(memory_usage), update_time = VALUES(create_time)"
+)
+SETTING_INSERT = (
+    "INSERT INTO crawler_setting (crawler_id, max_browser_count, create_time) "
+    "SELECT %s, %s, %s FROM DUAL WHERE NOT EXISTS (SELECT 1 FROM crawler_setting WHERE crawler_id = %s)"
+)
+SESSION_UPSERT = (
+    "INSERT INTO crawler_session (crawler_id, uuid, init_time, url, destroy_time, create_time) "
+    "VALUES (%s, %s, %s, %s, %s, %s) "
+    "ON DUPLICATE KEY UPDATE crawler_id = VALUES(crawler_id), init_time = VALUES(init_time), url = VALUES(url), "
+    "destroy_time = VALUES(destroy_time), update_time = VALUES(create_time)"
+)
+LOG_UPSERT = (
+    "INSERT INTO crawler_log (uuid, crawler_session_id, url, request_time, response_time, status_code, "
+    "trace_id, dispatch_ms, link_ms, client_ms, agent_ms, uia_ms, chrome_ms, create_time) "
+    "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) "
+    # Spooled rows replay out of order, never let an older snapshot clear the response
+    "ON DUPLICATE KEY UPDATE response_time = COALESCE(VALUES(response_time), response_time), "
+    "status_code = COALESCE(VALUES(status_code), status_code), trace_id = COALESCE(VALUES(trace_id), trace_id), "
+    "dispatch_ms = COALESCE(VALUES(dispatch_ms), dispatch_ms), link_ms = COALESCE(VALUES(link_ms), link_ms), "
+    "client_ms = COALESCE(VALUES(client_ms), client_ms), agent_ms = COALESCE(VALUES(agent_ms), agent_ms), "
+    "uia_ms = COALESCE(VALUES(uia_ms), uia_ms), chrome_ms = COALESCE(VALUES(chrome_ms), chrome_ms), "
+    "update_time = VALUES(create_time)"
+)
+# Buckets hold sums, so partial buckets (several dispatchers, or minutes of the same hour) add up
+METRIC_UPSERT = (
+    "INSERT INTO crawler_metric (crawler_id, resolution, bucket_time, samples, cpu_sum, cpu_max, memory_sum, memory_max, "
+    "sessions_sum, sessions_max, requests) "
+    "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) "
+    "ON DUPLICATE KEY UPDATE samples = samples + VALUES(samples), cpu_sum = cpu_sum + VALUES(cpu_sum), "
+    "cpu_max = GREATEST(cpu_max, VALUES(cpu_max)), memory_sum = memory_sum + VALUES(memory_sum), "
+    "memory_max = GREATEST(memory_max, VALUES(memory_max)), sessions_sum = sessions_sum + VALUES(sessions_sum), "
+    "sessions_max = GREATEST(sessions_max, VALUES(sessions_max)), requests = requests + VALUES(requests)"
+)
+METRIC_EXPIRE = "DELETE FROM crawler_metric WHERE resolution = %s AND bucket_time < %s"
+
+#==========  DATA STRUCTURES  ==========
+class ClientRecord(NamedTuple):
+    """Snapshot of a ClientInfo row (crawler_info), taken on the event loop"""
+    uuid: str
+    host_name: Optional[str]
+    internal_ip: Optional[str]
+    external_ip: Optional[str]
+    os: Optional[str]
+    agent: Optional[str]
+    last_heartbeat: Optional[datetime.datetime]
+    status: int
+    cpu_usage: Optional[float]
+    memory_usage: Optional[float]
+    max_browser_count: int
+
+class SessionRecord(NamedTuple):
+    """Snapshot of a SessionInfo row (crawler_session)"""
+    uuid: str
+    client_uuid: str
+    init_time: datetime.datetime
+    url: Optional[str]
+    destroy_time: Optional[datetime.datetime]
+
+class LogRecord(NamedTuple):
+    """Snapshot of a LogInfo row (crawler_log)"""
+    uuid: str
+    session_uuid: str
+    url: Optional[str]
+    request_time: datetime.datetime
+    response_time: Optional[datetime.datetime]
+    status_code: Optional[int]
+    # Trace id and where the request's time went (ms), see LogInfo
+    trace_id: Optional[str] = None
+    dispatch_ms: Optional[int] = None
+    link_ms: Optional[int] = None
+    client_ms: Optional[int] = None
+    agent_ms: Optional[int] = None
+    uia_ms: Optional[int] = None
+    chrome_ms: Optional[int] = None
+
+class MetricRecord(NamedTuple):
+    """One crawler's load over one minute (crawler_metric), sums and maxima of its heartbeat samples"""
+    client_uuid: str
+    bucket_time: datetime.datetime
+    samples: int
+    cpu_sum: float
+    cpu_max: float
+    memory_sum: float
+    memory_max: float
+    sessions_sum: int
+    sessions_max: int
+    requests: int
+
+    def merge(self, other: "MetricRecord") -> "MetricRecord":
+        return self._replace(
+            samples=self.samples + other.samples,
+            cpu_sum=self.cpu_sum + other.cpu_sum, cpu_max=max(self.cpu_max, other.cpu_max),
+            memory_sum=self.memory_sum + other.memory_sum, memory_max=max(self.memory_max, other.memory_max),
+            sessions_sum=self.sessions_sum + other.sessions_sum, sessions_max=max(self.sessions_max, other.sessions_max),
+            requests=self.requests + other.requests,
+        )
+
+Record = Union[ClientRecord, SessionRecord, LogRecord, MetricRecord]
+
+#==========  METRIC BUCKETS  ==========
+class MetricBuckets:
+    """Per-crawler minute buckets of heartbeat samples and relayed requests, filled on the event loop"""
+    def __init__(self):
+        self._buckets: Dict[Tuple[str, datetime.datetime], MetricRecord] = {}
+
+    @staticmethod
+    def _minute(now: datetime.datetime) -> datetime.datetime:
+        return now.replace(second=0, microsecond=0)
+
+    def _add(self, record: MetricRecord) -> None:
+        key = (record.client_uuid, record.bucket_time)
+        current = self._buckets.get(key)
+        self._buckets[key] = current.merge(record) if current else record
+
+    def sample(self, client_uuid: str, cpu_usage: Optional[float], memory_usage: Optional[float], sessions: int,
+               now: Optional[datetime.datetime] = None) -> None:
+        """A heartbeat: the client's CPU and memory usage and its active sessions"""
+        cpu, memory = cpu_usage or 0.0, memory_usage or 0.0
+        self._add(MetricRecord(client_uuid, self._minute(now or datetime.datetime.now()), 1, cpu, cpu, memory, memory, sessions, sessions, 0))
+
+    def count_request(self, client_uuid: str, now: Optional[datetime.datetime] = None) -> None:
+        """A request relayed to the client"""
+        self._add(MetricRecord(client_uuid, self._minute(now or datetime.datetime.now()), 0, 0.0, 0.0, 0.0, 0.0, 0, 0, 1))
+
+    def collect(self, everything: bool = False) -> List[MetricRecord]:
+        """Take the buckets of past minutes (all of them with `everything`, e.g. at shutdown)"""
+        current = self._minute(datetime.datetime.now())
+        done = [key for key in self._buckets if everything or key[1] < current]
+        return [self._buckets.pop(key) for key in done]
+
+#==========  LOG SPOOL  ==========
+class LogSpool:
+    """Append-only segment files holding crawler_log rows that could not be written to the database"""
+    def __init__(self, directory: str, segment_records: int = SPOOL_SEGMENT_RECORDS):
+        self.directory = directory
+        self.segment_records = segment_records
+        os.makedirs(directory, exist_ok=True)
+        self._segments: List[str] = sorted(f for f in os.listdir(directory) if f.startswith("spool-") and f.endswith(".jsonl"))
+        self._sequence = int(self._segments[-1][6:-6]) if self._segments else 0
+        self._active: Optional[Any] = None  # open file of the last segment, while it has room
+        self._active_records = 0
+        # Records left from a previous run are replayed like any other
+        self.depth = sum(self._count(name) for name in self._segments)
+
+    def _count(self, name: str) -> int:
+        with open(os.path.join(self.directory, name), "rb") as f:
+            return sum(1 for _ in f)
+
+    def append(self, records: Iterable[LogRecord]) -> int:
+        """Write records to the end of the spool, returns how many were written"""
+        written = 0
+        for record in records:
+            if self._active is None or self._active_records >= self.segment_records:
+                self._rotate()
+            self._active.write(json.dumps([v.isoformat() if isinstance(v, datetime.datetime) else v for v in record]) + "\n")
+            self._active_records += 1
+            written += 1
+        if self._active is not None:
+            self._active.flush()
+        self.depth += written
+        return written
+
+    def _rotate(self) -> None:
+        self._close_active()
+        self._sequence += 1
+        name = f"spool-{self._sequence:08d}.jsonl"
+        self._active = open(os.path.join(self.directory, name), "a", encoding="utf-8")
+        self._active_records = 0
+        self._segments.append(name)
+
+    def _close_active(self) -> None:
+        if self._active is not None:
+            self._active.close()
+            self._active = None
+
+    def oldest(self) -> Optional[Tuple[str, List[LogRecord]]]:
+        """The oldest segment and its records, or None when the spool is empty"""
+        if not self._segments:
+            return None
+        name = self._segments[0]
+        if len(self._segments) == 1:
+            # Don't replay a segment that is still being appended to
+            self._close_active()
+        records = []
+        with open(os.path.join(self.directory, name), "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    # Segments written before the timing columns have six fields
+                    uuid, session_uuid, url, request_time, response_time, status_code, *timing = json.loads(line)
+                except ValueError:
+                    logging.warning(f"[SERVER][DB] Skipping corrupt line in spool segment {name}")
+                    continue
+                records.append(LogRecord(
+                    uuid, session_uuid, url,
+                    datetime.datetime.fromisoformat(request_time) if request_time else None,
+                    datetime.datetime.fromisoformat(response_time) if response_time else None,
+                    status_code, *timing
+                ))
+        return name, records
+
+    def remove(self, name: str, count: int) -> None:
+        """Drop a segment once its records are in the database"""
+        os.remove(os.path.join(self.directory, name))
+        self._segments.remove(name)
+        self.depth = max(0, self.depth - count)
+
+    def segments(self) -> int:
+        return len(self._segments)
+
+    def close(self) -> None:
+        self._close_active()
+
+#==========  PERSISTENCE WORKER  ==========
+class PersistenceWorker(threading.Thread):
+    """Writes queued snapshots to MySQL from its own thread, so the event loop never waits on the database.
+
+    Snapshots are merged by uuid (the latest one wins) and flushed as one transaction of batched upserts,
+    clients before sessions before logs. A failed flush keeps its rows for the next attempt; past
+    MAX_BUFFERED_LOGS the logs spill to the spool and are replayed once the database is back.
+    """
+    def __init__(self, connect: Callable[[], Any], loop: Optional[asyncio.AbstractEventLoop] = None,
+                 on_settings: Optional[Callable[[Dict[str, int]], None]] = None,
+                 on_flush: Optional[Callable[[float, bool], None]] = None,
+                 flush_interval: float = FLUSH_INTERVAL, batch_size: int = FLUSH_BATCH_SIZE,
+                 spool_dir: Optional[str] = None, max_buffered_logs: int = MAX_BUFFERED_LOGS):
+        super().__init__(name="dispatcher-store", daemon=True)
+        self._connect = connect
+        self._loop = loop
+        self._on_settings = on_settings
+        self._on_flush = on_flush  # (seconds, succeeded) of every flush, called on the loop
+        self._flush_interval = flush_interval
+        self._batch_size = batch_size
+        self._queue: "queue.Queue[Optional[Record]]" = queue.Queue()
+        self._stopping = threading.Event()
+        # Merged changes not yet written, by uuid
+        self._clients: Dict[str, ClientRecord] = {}
+        self._sessions: Dict[str, SessionRecord] = {}
+        self._logs: Dict[str, LogRecord] = {}
+        self._metrics: Dict[Tuple[str, datetime.datetime], MetricRecord] = {}
+        self._next_retention = 0.0  # monotonic time of the next delete of expired crawler_metric rows
+        # Something arrived (or a flush failed) since the last successful flush
+        self._dirty = False
+        # Last flush failed, wait for the interval instead of retrying on every batch
+        self._failing = False
+        self._max_buffered_logs = max_buffered_logs
+        self._spool = LogSpool(spool_dir) if spool_dir else None
+        self._replayed = 0
+        self._replay_rate = 0.0
+        # uuid -> id of rows known to exist
+        self._crawler_ids: Dict[str, int] = {}
+        self._session_ids: Dict[str, int] = {}
+
+    def put(self, record: Record) -> None:
+        """Queue a snapshot for writing, never blocks"""
+        self._queue.put_nowait(record)
+
+    def put_many(self, records: Iterable[Record]) -> None:
+        for record in records:
+            self._queue.put_nowait(record)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Flush what is queued and stop the thread (blocking, run it off the event loop)"""
+        self._stopping.set()
+        self._queue.put_nowait(None)
+        self.join(timeout)
+
+    def pending(self) -> int:
+        """Changes queued or merged but not yet written"""
+        return self._queue.qsize() + len(self._clients) + len(self._sessions) + len(self._logs) + len(self._metrics)
+
+    def stats(self) -> Dict[str, Any]:
+        """Buffer and spool figures (read from other threads, values may be a moment old)"""
+        return {
+            "pending": self.pending(),
+            "buffered_logs": len(self._logs),
+            "buffered_metrics": len(self._metrics),
+            "spool_depth": self._spool.depth if self._spool else 0,
+            "spool_segments": self._spool.segments() if self._spool else 0,
+            "replayed": self._replayed,
+            "replay_rate": round(self._replay_rate, 1),  # records/sec of the last replay
+        }
+
+    def run(self) -> None:
+        next_flush = time.monotonic() + self._flush_interval
+        while True:
+            try:
+                record = self._queue.get(timeout=max(0.0, next_flush - time.monotonic()))
+                self._merge(record)
+                # Take everything already queued before deciding to flush
+                while len(self._clients) + len(self._sessions) + len(self._logs) + len(self._metrics) < self._batch_size:
+                    self._merge(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            stopping = self._stopping.is_set()
+            size = len(self._clients) + len(self._sessions) + len(self._logs) + len(self._metrics)
+            due = time.monotonic() >= next_flush
+            if (size and self._dirty or due and self._spool and self._spool.depth) and (stopping or due or size >= self._batch_size and not self._failing):
+                self._flush()
+            if due:
+                next_flush = time.monotonic() + self._flush_interval
+            if stopping and self._queue.empty():
+                # Keep what couldn't be written for the next run
+                if self._logs and self._spool:
+                    self._spill()
+                if self._spool:
+                    self._spool.close()
+                break
+
+    def _merge(self, record: Optional[Record]) -> None:
+        self._dirty = self._dirty or record is not None
+        if isinstance(record, ClientRecord):
+            self._clients[record.uuid] = record
+        elif isinstance(record, SessionRecord):
+            self._sessions[record.uuid] = record
+        elif isinstance(record, LogRecord):
+            if self._spool and record.uuid not in self._logs and len(self._logs) >= self._max_buffered_logs:
+                self._spill()
+            self._logs[record.uuid] = record
+        elif isinstance(record, MetricRecord):
+            key = (record.client_uuid, record.bucket_time)
+            current = self._metrics.get(key)
+            if current is None and len(self._metrics) >= MAX_BUFFERED_METRICS:
+                # Database down for a long time, give up the oldest minutes
+                del self._metrics[next(iter(self._metrics))]
+            self._metrics[key] = current.merge(record) if current else record
+
+    def _spill(self) -> None:
+        """Move the buffered logs to the spool"""
+        try:
+            count = self._spool.append(self._logs.values())
+            self._logs = {}
+            logging.warning(f"[SERVER][DB] Spooled {count} logs to disk, spool depth {self._spool.depth}")
+        except Exception as e:
+            logging.error(f"[SERVER][DB] Error writing logs to spool: {e}")
+
+    #==========  FLUSH  ==========
+    def _flush(self) -> None:
+        connection = self._connect()
+        if connection is None:
+            self._failing = True
+            return
+        clients, sessions, logs, metrics = self._clients, self._sessions, self._logs, self._metrics
+        crawler_ids, session_ids = dict(self._crawler_ids), dict(self._session_ids)
+        started = time.perf_counter()
+        cursor = None
+        try:
+            cursor = connection.cursor()
+            settings = self._write_clients(cursor, clients)
+            written_sessions, skipped_sessions = self._write_sessions(cursor, sessions)
+            written_logs, skipped_logs = self._write_logs(cursor, logs)
+            skipped_metrics = self._write_metrics(cursor, metrics)
+            connection.commit()
+            # Rows that could not be linked yet (parent not written) wait for the next flush
+            self._clients, self._sessions, self._logs, self._metrics = {}, skipped_sessions, skipped_logs, skipped_metrics
+            self._dirty = False
+            self._failing = False
+            # Destroyed sessions rarely log again, don't keep their ids around
+            for s in sessions.values():
+                if s.destroy_time is not None:
+                    self._session_ids.pop(s.uuid, None)
+            if clients or sessions or logs or metrics:
+                logging.info(f"[SERVER][DB] Flushed {len(clients)} clients, {written_sessions} sessions, {written_logs} logs, "
+                             f"{len(metrics) - len(skipped_metrics)} metrics in {(time.perf_counter() - started) * 1000:.1f} ms")
+            if settings and self._on_settings:
+                if self._loop:
+                    self._loop.call_soon_threadsafe(self._on_settings, settings)
+                else:
+                    self._on_settings(settings)
+            if self._spool and self._spool.depth:
+                self._replay(connection, cursor)
+            if time.monotonic() >= self._next_retention:
+                self._expire_metrics(connection, cursor)
+            self._report_flush(time.perf_counter() - started, True)
+        except Exception as e:
+            logging.error(f"[SERVER][DB] Error flushing {len(clients)} clients, {len(sessions)} sessions, {len(logs)} logs, {len(metrics)} metrics: {e}")
+            try:
+                connection.rollback()
+            except Exception as rollback_error:
+                logging.error(f"[SERVER][DB] Error during rollback: {rollback_error}")
+            # Ids resolved inside the failed transaction may not exist
+            self._crawler_ids, self._session_ids = crawler_ids, session_ids
+            self._dirty = True
+            self._failing = True
+            self._report_flush(time.perf_counter() - started, False)
+        finally:
+            try:
+                if cursor is not None:
+                    cursor.close()
+                connection.close()
+            except Exception as cleanup_error:
+                logging.error(f"[SERVER][DB] Error during cleanup: {cleanup_error}")
+
+    def _report_flush(self, seconds: float, succeeded: bool) -> None:
+        if self._on_flush is None:
+            return
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._on_flush, seconds, succeeded)
+        else:
+            self._on_flush(seconds, succeeded)
+
+    def _replay(self, connection: Any, cursor: Any) -> None:
+        """Write the oldest spool segments to crawler_log, one transaction per segment"""
+        started = time.perf_counter()
+        replayed = 0
+        for _ in range(SPOOL_REPLAY_SEGMENTS):
+            segment = self._spool.oldest()
+            if segment is None:
+                break
+            name, records = segment
+            written, skipped = self._write_logs(cursor, {r.uuid: r for r in records})
+            connection.commit()
+            self._spool.remove(name, len(records))
+            # Sessions not written yet, try again with the buffered logs
+            for record in skipped.values():
+                self._logs.setdefault(record.uuid, record)
+            replayed += written
+        elapsed = time.perf_counter() - started
+        self._replayed += replayed
+        self._replay_rate = replayed / elapsed if elapsed > 0 else 0.0
+        logging.info(f"[SERVER][DB] Replayed {replayed} spooled logs at {self._replay_rate:.0f}/s, spool depth {self._spool.depth}")
+
+    def _write_clients(self, cursor: Any, clients: Dict[str, ClientRecord]) -> Dict[str, int]:
+        """Upsert crawler_info, create missing crawler_setting rows and read back max_browser_count"""
+        if not clients:
+            return {}
+        now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        cursor.executemany(CLIENT_UPSERT, [
+            (c.uuid, c.host_name, c.internal_ip, c.external_ip, c.os, c.agent, c.last_heartbeat, c.status, c.cpu_usage, c.memory_usage, now)
+            for c in clients.values()
+        ])
+        # Crawlers first seen by this process may be new, make sure they have a setting row
+        new_uuids = [u for u in clients if u not in self._crawler_ids]
+        self._resolve_ids(cursor, "crawler_info", new_uuids, self._crawler_ids)
+        new_settings = [(self._crawler_ids[u], clients[u].max_browser_count, now, self._crawler_ids[u]) for u in new_uuids if u in self._crawler_ids]
+        if new_settings:
+            cursor.executemany(SETTING_INSERT, new_settings)
+        # Current max_browser_count of every crawler in the batch
+        settings: Dict[str, int] = {}
+        uuids = list(clients)
+        for i in range(0, len(uuids), LOOKUP_BATCH_SIZE):
+            chunk = uuids[i:i + LOOKUP_BATCH_SIZE]
+            cursor.execute(
+                "SELECT ci.uuid, cs.max_browser_count FROM crawler_info ci JOIN crawler_setting cs ON cs.crawler_id = ci.id "
+                f"WHERE ci.uuid IN ({', '.join(['%s'] * len(chunk))})",
+                tuple(chunk)
+            )
+            for client_uuid, max_browser_count in cursor.fetchall():
+                if max_browser_count is None:
+                    continue
+                try:
+                    settings[client_uuid] = int(max_browser_count)
+                except (ValueError, TypeError):
+                    logging.warning(f"[SERVER][DB] Invalid max_browser_count value for client {client_uuid}: {max_browser_count}")
+        return settings
+
+    def _write_sessions(self, cursor: Any, sessions: Dict[str, SessionRecord]):
+        """Upsert crawler_session, returns (rows written, records whose crawler is not in the database yet)"""
+        if not sessions:
+            return 0, {}
+        self._resolve_ids(cursor, "crawler_info", {s.client_uuid for s in sessions.values()}, self._crawler_ids)
+        now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        rows, skipped = [], {}
+        for s in sessions.values():
+            crawler_id = self._crawler_ids.get(s.client_uuid)
+            if crawler_id is None:
+                skipped[s.uuid] = s
+                continue
+            rows.append((crawler_id, s.uuid, s.init_time, s.url, s.destroy_time, now))
+        if rows:
+            cursor.executemany(SESSION_UPSERT, rows)
+        if skipped:
+            logging.warning(f"[SERVER][DB] Deferring {len(skipped)} sessions: crawler_info not found")
+        return len(rows), skipped
+
+    def _write_logs(self, cursor: Any, logs: Dict[str, LogRecord]):
+        """Upsert crawler_log, returns (rows written, records whose session is not in the database yet)"""
+        if not logs:
+            return 0, {}
+        self._resolve_ids(cursor, "crawler_session", {l.session_uuid for l in logs.values()}, self._session_ids)
+        now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        rows, skipped = [], {}
+        for l in logs.values():
+            session_id = self._session_ids.get(l.session_uuid)
+            if session_id is None:
+                skipped[l.uuid] = l
+                continue
+            rows.append((l.uuid, session_id, l.url, l.request_time, l.response_time, l.status_code,
+                         l.trace_id, l.dispatch_ms, l.link_ms, l.client_ms, l.agent_ms, l.uia_ms, l.chrome_ms, now))
+        if rows:
+            cursor.executemany(LOG_UPSERT, rows)
+        if skipped:
+            logging.warning(f"[SERVER][DB] Deferring {len(skipped)} logs: crawler_session not found")
+        return len(rows), skipped
+
+    def _write_metrics(self, cursor: Any, metrics: Dict[Tuple[str, datetime.datetime], MetricRecord]) -> Dict[Tuple[str, datetime.datetime], MetricRecord]:
+        """Add minute buckets to crawler_metric at every resolution, returns those whose crawler is not in the database yet"""
+        if not metrics:
+            return {}
+        self._resolve_ids(cursor, "crawler_info", {m.client_uuid for m in metrics.values()}, self._crawler_ids)
+        rollups: Dict[Tuple[int, int, datetime.datetime], MetricRecord] = {}
+        skipped = {}
+        for key, m in metrics.items():
+            crawler_id = self._crawler_ids.get(m.client_uuid)
+            if crawler_id is None:
+                skipped[key] = m
+                continue
+            for resolution in METRIC_RESOLUTIONS:
+                # Buckets start on the local clock (resolutions divide an hour or are whole hours of the day)
+                offset = (m.bucket_time.hour * 3600 + m.bucket_time.minute * 60) % resolution
+                bucket_time = m.bucket_time - datetime.timedelta(seconds=offset)
+                rollup_key = (crawler_id, resolution, bucket_time)
+                current = rollups.get(rollup_key)
+                rollups[rollup_key] = current.merge(m) if current else m
+        if rollups:
+            cursor.executemany(METRIC_UPSERT, [
+                (crawler_id, resolution, bucket_time, m.samples, m.cpu_sum, m.cpu_max, m.memory_sum, m.memory_max, m.sessions_sum, m.sessions_max, m.requests)
+                for (crawler_id, resolution, bucket_time), m in rollups.items()
+            ])
+        if skipped:
+            logging.warning(f"[SERVER][DB] Deferring {len(skipped)} metrics: crawler_info not found")
+        return skipped
+
+    def _expire_metrics(self, connection: Any, cursor: Any) -> None:
+        """Delete crawler_metric rows past the retention of their resolution"""
+        now = datetime.datetime.now()
+        deleted = 0
+        for resolution, retention in METRIC_RESOLUTIONS.items():
+            cursor.execute(METRIC_EXPIRE, (resolution, now - retention))
+            deleted += max(0, cursor.rowcount)
+        connection.commit()
+        self._next_retention = time.monotonic() + METRIC_RETENTION_INTERVAL
+        if deleted:
+            logging.info(f"[SERVER][DB] Deleted {deleted} expired metric rows")
+
+    def _resolve_ids(self, cursor: Any, table: str, uuids: Iterable[str], cache: Dict[str, int]) -> None:
+        """Fill the uuid -> id cache for uuids it doesn't know yet"""
+        missing: List[str] = [u for u in uuids if u is not None and u not in cache]
+        for i in range(0, len(missing), LOOKUP_BATCH_SIZE):
+            chunk = missing[i:i + LOOKUP_BATCH_SIZE]
+            cursor.execute(f"SELECT id, uuid FROM {table} WHERE uuid IN ({', '.join(['%s'] * len(chunk))})", tuple(chunk))
+            for row_id, row_uuid in cursor.fetchall():
+                cache[row_uuid] = int(row_id)
@@ -0,0 +1,83 @@
+#
+# Micro-benchmark for the dispatcher control channel framing (MB/s of http.response frames per mode)
+#
+# python bench_framing.py
+#
+import asyncio
+import os
+import sys
+import time
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dispatcher'))
+from DispatcherProtocol import MESSAGE_DELIMITER, PROTOCOL_DELIMITED, PROTOCOL_FRAMED, PROTOCOL_BINARY, encode_frame, read_frame, split_binary_data
+
+SIZES = [1024, 64 * 1024, 1024 * 1024, 4 * 1024 * 1024]
+TOTAL_BYTES = 32 * 1024 * 1024
+BYTEWISE_MAX_SIZE = 64 * 1024  # the old reader is quadratic, don't wait for it on big messages
+
+async def read_bytewise(reader: asyncio.StreamReader, protocol: int):
+    """The original reader: one read(1) and one endswith() per byte"""
+    buffer = b""
+    while True:
+        char = await reader.read(1)
+        if not char:
+            return None
+        buffer += char
+        if buffer.endswith(MESSAGE_DELIMITER):
+            return buffer[:-len(MESSAGE_DELIMITER)], None
+
+def make_frame(size: int, protocol: int) -> bytes:
+    """An http.response carrying `size` raw bytes, encoded the way write_json_message would"""
+    message = {"id": "bench", "type": "http.response", "time": "", "data": b"x" * size}
+    message, body = split_binary_data(message, protocol)
+    return b"".join(encode_frame(json.dumps(message).encode('utf-8'), protocol, body))
+
+async def run_mode(reader_fn, protocol: int, size: int) -> float:
+    frame = make_frame(size, protocol)
+    count = max(1, TOTAL_BYTES // len(frame))
+    if reader_fn is read_bytewise:
+        count = max(1, min(count, (256 * 1024) // len(frame)))
+    done = asyncio.get_running_loop().create_future()
+
+    async def handle(reader, writer):
+        started = time.perf_counter()
+        received = 0
+        for _ in range(count):
+            payload, body = await reader_fn(reader, protocol)
+            received += len(payload) + len(body or b"")
+        done.set_result(received / (time.perf_counter() - started))
+        writer.close()
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    _, writer = await asyncio.open_connection('127.0.0.1', port)
+    for _ in range(count):
+        writer.write(frame)
+        await writer.drain()
+    rate = await done
+    writer.close()
+    server.close()
+    await server.wait_closed()
+    return rate / (1024 * 1024)
+
+async def main():
+    modes = [
+        ("delimited, byte-at-a-time (old)", read_bytewise, PROTOCOL_DELIMITED),
+        ("delimited, buffered", read_frame, PROTOCOL_DELIMITED),
+        ("length-prefixed", read_frame, PROTOCOL_FRAMED),
+        ("length-prefixed, binary body", read_frame, PROTOCOL_BINARY),
+    ]
+    print(f"{'mode':<34}" + "".join(f"{str(size // 1024) + ' KB':>12}" for size in SIZES))
+    for name, reader_fn, protocol in modes:
+        row = f"{name:<34}"
+        for size in SIZES:
+            if reader_fn is read_bytewise and size > BYTEWISE_MAX_SIZE:
+                row += f"{'-':>12}"
+                continue
+            rate = await run_mode(reader_fn, protocol, size)
+            row += f"{rate:>8.1f} MB/s"
+        print(row)
+
+if __name__ == '__main__':
+    asyncio.run(main())
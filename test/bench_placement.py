@@ -0,0 +1,65 @@
+#
+# Benchmark of /api/start placement, placements/sec with 10k active sessions across 500 clients
+#
+# python bench_placement.py
+#
+import os
+import random
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dispatcher'))
+from DispatcherPlacement import SessionPlacement
+
+CLIENTS = 500
+SESSIONS = 10000
+MAX_BROWSER_COUNT = 40
+ROUNDS = 2000
+
+def pick_scan(clients, sessions):
+    """The original placement: recount active sessions per client, then scan the clients"""
+    client_session_counts = {}
+    for session_client, destroyed in sessions.values():
+        if not destroyed:
+            client_session_counts[session_client] = client_session_counts.get(session_client, 0) + 1
+    client = None
+    min_session_count = float('inf')
+    for c, max_browser_count in clients.items():
+        current_count = client_session_counts.get(c, 0)
+        if current_count < max_browser_count and current_count < min_session_count:
+            min_session_count = current_count
+            client = c
+    return client
+
+def main():
+    random.seed(1)
+    clients = {str(uuid.uuid4()): MAX_BROWSER_COUNT for _ in range(CLIENTS)}
+    placement = SessionPlacement()
+    for c, max_browser_count in clients.items():
+        placement.add_client(c, max_browser_count)
+    # session uuid -> (client uuid, destroyed)
+    sessions = {}
+    for _ in range(SESSIONS):
+        c = placement.pick()
+        placement.session_started(c)
+        sessions[str(uuid.uuid4())] = (c, False)
+    live = list(sessions)
+
+    # Each round destroys a random session and starts a new one
+    for name, pick in (("scan all sessions (old)", lambda: pick_scan(clients, sessions)), ("session counters + heap", placement.pick)):
+        started = time.perf_counter()
+        for _ in range(ROUNDS):
+            i = random.randrange(len(live))
+            session_uuid = live[i]
+            c, _ = sessions.pop(session_uuid)
+            placement.session_ended(c)
+            c = pick()
+            placement.session_started(c)
+            live[i] = str(uuid.uuid4())
+            sessions[live[i]] = (c, False)
+        elapsed = time.perf_counter() - started
+        print(f"{name:<26}{ROUNDS / elapsed:>12.0f} placements/sec{elapsed / ROUNDS * 1e6:>10.1f} us each")
+
+if __name__ == '__main__':
+    main()
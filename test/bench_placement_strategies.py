@@ -0,0 +1,96 @@
+#
+# Simulation comparing the dispatcher's placement strategies by session latency percentiles
+#
+# python bench_placement_strategies.py
+#
+# Clients differ in speed and background CPU load, heartbeats report CPU every 10 s (so the
+# dispatcher sees stale load), and a client that served a domain recently loads it faster.
+#
+import heapq
+import itertools
+import os
+import random
+import sys
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dispatcher'))
+from DispatcherPlacement import SessionPlacement, STRATEGIES, make_strategy
+
+CLIENTS = 100
+MAX_BROWSER_COUNT = 10
+DOMAINS = 2000
+DOMAIN_CACHE = 20            # domains a client keeps warm
+ARRIVAL_RATE = 12.0          # sessions/sec, ~75% of capacity with the mean lifetime below
+MEAN_LIFETIME = 60.0         # seconds
+HEARTBEAT_INTERVAL = 10.0
+DURATION = 3600.0
+BASE_LATENCY = 1.0           # seconds for an idle, average client with a cold cache
+
+class SimClient:
+    def __init__(self, rng: random.Random, name: str):
+        self.name = name
+        self.speed = rng.uniform(0.5, 1.5)
+        self.background_cpu = rng.uniform(0, 70)
+        self.cache = OrderedDict()
+
+    def latency(self, active: int, domain: int) -> float:
+        utilization = active / MAX_BROWSER_COUNT
+        latency = BASE_LATENCY * (1 + 1.5 * utilization) * (1 + self.background_cpu / 100) / self.speed
+        if domain in self.cache:
+            self.cache.move_to_end(domain)
+            latency *= 0.4
+        else:
+            self.cache[domain] = True
+            if len(self.cache) > DOMAIN_CACHE:
+                self.cache.popitem(last=False)
+        return latency
+
+    def cpu(self, active: int) -> float:
+        return min(100.0, self.background_cpu + 30 * active / MAX_BROWSER_COUNT)
+
+def simulate(strategy_name: str, seed: int = 7):
+    rng = random.Random(seed)
+    random.seed(seed)  # power-of-two samples with the module RNG
+    placement = SessionPlacement(make_strategy(strategy_name))
+    clients = {}
+    for i in range(CLIENTS):
+        client = SimClient(rng, f"client-{i:03d}")
+        clients[client.name] = client
+        placement.add_client(client.name, MAX_BROWSER_COUNT)
+        placement.update_load(client.name, client.cpu(0), 40.0)
+    # Zipf-ish domain popularity
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(DOMAINS)))
+    ends = []  # (end time, client name)
+    latencies = []
+    rejected = 0
+    now = 0.0
+    next_heartbeat = HEARTBEAT_INTERVAL
+    while now < DURATION:
+        now += rng.expovariate(ARRIVAL_RATE)
+        while ends and ends[0][0] <= now:
+            _, name = heapq.heappop(ends)
+            placement.session_ended(name)
+        while next_heartbeat <= now:
+            for name, client in clients.items():
+                placement.update_load(name, client.cpu(placement.active.get(name, 0)), 40.0)
+            next_heartbeat += HEARTBEAT_INTERVAL
+        domain = rng.choices(range(DOMAINS), cum_weights=cum_weights)[0]
+        name = placement.pick(f"domain-{domain}")
+        if name is None:
+            rejected += 1
+            continue
+        placement.session_started(name)
+        latencies.append(clients[name].latency(placement.active[name], domain))
+        heapq.heappush(ends, (now + rng.expovariate(1 / MEAN_LIFETIME), name))
+    latencies.sort()
+    percentile = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+    return percentile(0.5), percentile(0.95), percentile(0.99), rejected, len(latencies)
+
+def main():
+    print(f"{'strategy':<18}{'p50':>8}{'p95':>8}{'p99':>8}{'rejected':>10}{'sessions':>10}")
+    for name in STRATEGIES:
+        p50, p95, p99, rejected, placed = simulate(name)
+        print(f"{name:<18}{p50:>7.2f}s{p95:>7.2f}s{p99:>7.2f}s{rejected:>10}{placed:>10}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+#
+# Latency of interactive calls queued behind bulk navigations on one crawler, per priority scheduling
+#
+# python bench_priority.py
+#
+# Starts a dispatcher, a crawler client and a stub agent that takes SERVICE_TIME per request, queues a
+# backlog of bulk /api/go requests and sends /api/click calls while it drains. Without priorities
+# (everything X-Priority: normal) the clicks wait behind the whole backlog; with strict or weighted
+# scheduling they overtake the queued navigations.
+#
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+DISPATCHER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dispatcher')
+
+HTTP_PORT, CLIENT_PORT, AGENT_PORT = 8400, 8401, 8420
+SERVICE_TIME = 0.1  # seconds the stub agent takes per request
+BULK_REQUESTS = 400  # /api/go backlog, the client relays 16 at a time (~160 per second)
+CLICKS = 20  # /api/click calls, one every CLICK_INTERVAL while the backlog drains
+CLICK_INTERVAL = 0.1
+
+#==========  STUB AGENT  ==========
+async def serve_agent(port: int) -> None:
+    """Answers every request after SERVICE_TIME, with the request's X-Session-Id"""
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        while True:
+            try:
+                head = await reader.readuntil(b'\r\n\r\n')
+            except (asyncio.IncompleteReadError, ConnectionError):
+                break
+            headers = dict(line.decode().split(': ', 1) for line in head.split(b'\r\n')[1:] if b': ' in line)
+            headers = {k.lower(): v for k, v in headers.items()}
+            await reader.readexactly(int(headers.get('content-length', 0)))
+            await asyncio.sleep(SERVICE_TIME)
+            session = headers.get('x-session-id', '')
+            writer.write(f"HTTP/1.1 200 OK\r\nX-Session-Id: {session}\r\nContent-Type: application/json\r\nContent-Length: 2\r\n\r\n{{}}".encode())
+            await writer.drain()
+        writer.close()
+    server = await asyncio.start_server(handle, '127.0.0.1', port)
+    async with server:
+        await server.serve_forever()
+
+#==========  USER REQUESTS  ==========
+async def request(path: str, headers: dict, body: dict) -> tuple:
+    """(status, response headers, seconds)"""
+    started = time.perf_counter()
+    reader, writer = await asyncio.open_connection('127.0.0.1', HTTP_PORT)
+    data = json.dumps(body).encode()
+    head = f"POST {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+    head += "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+    writer.write(head.encode() + b'\r\n' + data)
+    await writer.drain()
+    response_head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 60)
+    response_headers = {}
+    for line in response_head.split(b'\r\n')[1:]:
+        if b':' in line:
+            name, value = line.split(b':', 1)
+            response_headers[name.strip().lower().decode()] = value.strip().decode()
+    await asyncio.wait_for(reader.readexactly(int(response_headers.get('content-length', 0))), 60)
+    writer.close()
+    return int(response_head.split(b' ', 2)[1]), response_headers, time.perf_counter() - started
+
+async def backlog(bulk_priority: str, click_priority: str) -> dict:
+    sessions = []
+    for _ in range(2):
+        status, headers, _ = await request("/api/start", {}, {})
+        assert status == 200, status
+        sessions.append(headers['x-session-id'])
+    # One site per navigation, the per-domain politeness limits are not what is measured here
+    bulk = [asyncio.create_task(request("/api/go", {"X-Session-Id": sessions[0], "X-Priority": bulk_priority}, {"url": f"https://site{i}.example{i}.com/"}))
+            for i in range(BULK_REQUESTS)]
+    await asyncio.sleep(0.5)
+    clicks = []
+    for _ in range(CLICKS):
+        clicks.append(asyncio.create_task(request("/api/click", {"X-Session-Id": sessions[1], "X-Priority": click_priority}, {"x": 1, "y": 1})))
+        await asyncio.sleep(CLICK_INTERVAL)
+    click_times = sorted(r[2] for r in await asyncio.gather(*clicks))
+    bulk_times = sorted(r[2] for r in await asyncio.gather(*bulk))
+    return {
+        "click_p50": click_times[len(click_times) // 2],
+        "click_max": click_times[-1],
+        "bulk_max": bulk_times[-1],
+    }
+
+#==========  PROCESSES  ==========
+def start(args: list, env: dict, log_dir: str, name: str) -> subprocess.Popen:
+    log = open(os.path.join(log_dir, f"{name}.log"), "w")
+    return subprocess.Popen([sys.executable] + args, cwd=DISPATCHER_DIR, env={**os.environ, **env}, stdout=log, stderr=subprocess.STDOUT)
+
+def wait_port(port: int, timeout: float = 10.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"nothing listening on port {port}")
+
+def run(name: str, scheduling: str, bulk_priority: str, click_priority: str, log_dir: str) -> dict:
+    env = {"PRIORITY_SCHEDULING": scheduling}
+    processes = [start([os.path.abspath(__file__), "--agent", str(AGENT_PORT)], {}, log_dir, f"agent-{name}")]
+    try:
+        processes.append(start(["DispatcherServer.py"], {
+            **env,
+            "DISPATCHER_HTTP_PORT": str(HTTP_PORT),
+            "DISPATCHER_CLIENT_PORT": str(CLIENT_PORT),
+            "DISPATCHER_SPOOL_DIR": os.path.join(log_dir, f"spool-{name}"),
+            "DISPATCHER_MAX_CLIENT_IN_FLIGHT": "0",  # the whole backlog goes to the client
+        }, log_dir, f"dispatcher-{name}"))
+        wait_port(CLIENT_PORT)
+        processes.append(start(["DispatcherClient.py"], {**env, "DISPATCHER_PORT": str(CLIENT_PORT), "AGENT_PORT": str(AGENT_PORT)}, log_dir, f"client-{name}"))
+        time.sleep(2)
+        return asyncio.run(backlog(bulk_priority, click_priority))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(10)
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == "--agent":
+        asyncio.run(serve_agent(int(sys.argv[2])))
+        return
+    log_dir = tempfile.mkdtemp(prefix="dispatcher-priority-")
+    print(f"{BULK_REQUESTS} bulk /api/go queued, {CLICKS} /api/click while they drain, {SERVICE_TIME * 1000:.0f} ms per request at the agent")
+    runs = (
+        ("no priority", "strict", "normal", "normal"),
+        ("strict", "strict", "bulk", "interactive"),
+        ("weighted", "weighted", "bulk", "interactive"),
+    )
+    for name, scheduling, bulk_priority, click_priority in runs:
+        r = run(name.replace(" ", "-"), scheduling, bulk_priority, click_priority, log_dir)
+        print(f"{name:>12}: click p50 {r['click_p50'] * 1000:6.0f} ms  max {r['click_max'] * 1000:6.0f} ms   last bulk {r['bulk_max']:5.2f} s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+#
+# Runs a dispatcher cluster as local processes and checks that any node serves any session
+#
+# python cluster_local.py
+#
+# Starts a routing table server, two dispatcher nodes, a crawler client per node and a stub agent
+# per client, then starts sessions on both nodes and drives each of them through the other node.
+#
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+DISPATCHER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dispatcher')
+
+ROUTING_PORT = 8130
+# name -> (user HTTP port, crawler port, stub agent port, metrics port)
+NODES = {"node-a": (8100, 8101, 8120, 8140), "node-b": (8200, 8201, 8220, 8240)}
+MAX_BROWSER_COUNT = 5  # the dispatcher's default without a database
+
+#==========  STUB AGENT  ==========
+async def serve_agent(name: str, port: int) -> None:
+    """Answers every request with the agent's name, path and X-Session-Id"""
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        while True:
+            try:
+                head = await reader.readuntil(b'\r\n\r\n')
+            except (asyncio.IncompleteReadError, ConnectionError):
+                break
+            headers = dict(line.decode().split(': ', 1) for line in head.split(b'\r\n')[1:] if b': ' in line)
+            headers = {k.lower(): v for k, v in headers.items()}
+            await reader.readexactly(int(headers.get('content-length', 0)))
+            body = json.dumps({"agent": name, "path": head.split(b' ')[1].decode(), "session": headers.get('x-session-id')}).encode()
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n' % len(body) + body)
+            await writer.drain()
+        writer.close()
+    server = await asyncio.start_server(handle, '127.0.0.1', port)
+    async with server:
+        await server.serve_forever()
+
+#==========  USER REQUESTS  ==========
+async def request(port: int, path: str, headers: dict, body: dict) -> tuple:
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    data = json.dumps(body).encode()
+    head = f"POST {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+    head += "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+    writer.write(head.encode() + b'\r\n' + data)
+    await writer.drain()
+    response_head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 10)
+    length = next(int(line.split(b':')[1]) for line in response_head.split(b'\r\n') if line.lower().startswith(b'content-length:'))
+    payload = await asyncio.wait_for(reader.readexactly(length), 10)
+    writer.close()
+    status = int(response_head.split(b' ', 2)[1])
+    return status, json.loads(payload) if status == 200 else payload.decode()
+
+async def check_cluster() -> None:
+    ports = {name: http_port for name, (http_port, _, _, _) in NODES.items()}
+    # Sessions started on each node run on that node's crawler
+    started = {}
+    for name, port in ports.items():
+        status, reply = await request(port, "/api/start", {}, {})
+        assert status == 200 and reply["agent"] == f"agent-{name}", (name, status, reply)
+        started[name] = reply["session"]
+        print(f"/api/start on {name}: session {reply['session']} on {reply['agent']}")
+    # Any node forwards to the session's node
+    for name, session in started.items():
+        for other, port in ports.items():
+            status, reply = await request(port, "/api/go", {"X-Session-Id": session}, {"url": "https://example.com"})
+            assert status == 200 and reply["agent"] == f"agent-{name}" and reply["session"] == session, (name, other, status, reply)
+            print(f"/api/go for {name}'s session via {other}: {reply['agent']}")
+    # A full node hands /api/start to a node with free browsers
+    for _ in range(MAX_BROWSER_COUNT - 1):
+        await request(ports["node-a"], "/api/start", {}, {})
+    status, reply = await request(ports["node-a"], "/api/start", {}, {})
+    assert status == 200 and reply["agent"] == "agent-node-b", (status, reply)
+    print(f"/api/start on full node-a: session {reply['session']} on {reply['agent']}")
+    # Destroyed sessions are gone on every node
+    status, _ = await request(ports["node-b"], "/api/destroy", {"X-Session-Id": started["node-a"]}, {})
+    assert status == 200, status
+    await asyncio.sleep(0.2)
+    for other, port in ports.items():
+        status, _ = await request(port, "/api/go", {"X-Session-Id": started["node-a"]}, {"url": "https://example.com"})
+        assert status == 440, (other, status)
+    print("destroyed session: 440 on every node")
+
+#==========  PROCESSES  ==========
+def start(args: list, env: dict, log_dir: str, name: str) -> subprocess.Popen:
+    log = open(os.path.join(log_dir, f"{name}.log"), "w")
+    return subprocess.Popen([sys.executable] + args, cwd=DISPATCHER_DIR, env={**os.environ, **env}, stdout=log, stderr=subprocess.STDOUT)
+
+def wait_port(port: int, timeout: float = 10.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"nothing listening on port {port}")
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == "--agent":
+        asyncio.run(serve_agent(sys.argv[2], int(sys.argv[3])))
+        return
+    log_dir = tempfile.mkdtemp(prefix="dispatcher-cluster-")
+    processes = [start(["DispatcherCluster.py", str(ROUTING_PORT)], {}, log_dir, "routing")]
+    try:
+        wait_port(ROUTING_PORT)
+        for name, (http_port, client_port, agent_port, metrics_port) in NODES.items():
+            processes.append(start([os.path.abspath(__file__), "--agent", f"agent-{name}", str(agent_port)], {}, log_dir, f"agent-{name}"))
+            processes.append(start(["DispatcherServer.py"], {
+                "DISPATCHER_HTTP_PORT": str(http_port),
+                "DISPATCHER_CLIENT_PORT": str(client_port),
+                "DISPATCHER_ROUTING_TABLE": f"tcp://127.0.0.1:{ROUTING_PORT}",
+                "DISPATCHER_NODE": f"127.0.0.1:{http_port}",
+                "DISPATCHER_SPOOL_DIR": os.path.join(log_dir, f"spool-{name}"),
+                "DISPATCHER_METRICS_PORT": str(metrics_port),
+            }, log_dir, name))
+        for name, (http_port, client_port, agent_port, metrics_port) in NODES.items():
+            wait_port(client_port)
+            processes.append(start(["DispatcherClient.py"], {"DISPATCHER_PORT": str(client_port), "AGENT_PORT": str(agent_port)}, log_dir, f"client-{name}"))
+        # Clients connect, then the nodes announce their free browsers (every 5 s)
+        time.sleep(6)
+        asyncio.run(check_cluster())
+        print(f"cluster OK (logs in {log_dir})")
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(10)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+#
+# Overloads a local dispatcher and compares request latency with and without load shedding
+#
+# python load_shedding.py
+#
+# Starts a dispatcher, a crawler client and a stub agent that takes SERVICE_TIME per request, then
+# offers more requests per second than the client can relay. Without limits the backlog queues on
+# the control connection and latency grows for as long as the burst lasts; with the per-client
+# in-flight limit the excess is answered 429 with a Retry-After and served requests stay fast.
+#
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+DISPATCHER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dispatcher')
+
+HTTP_PORT, CLIENT_PORT, AGENT_PORT = 8300, 8301, 8320
+SERVICE_TIME = 0.1  # seconds the stub agent takes per request
+OFFERED_RATE = 400  # requests per second, the client relays 16 at a time (~160 per second)
+BURST = 5.0  # seconds
+CLIENT_IN_FLIGHT = 32  # DISPATCHER_MAX_CLIENT_IN_FLIGHT with shedding on
+LATENCY_BOUND = 2.0  # p99 of served requests with shedding on must stay below this (seconds)
+
+#==========  STUB AGENT  ==========
+async def serve_agent(port: int) -> None:
+    """Answers every request after SERVICE_TIME, with the request's X-Session-Id"""
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        while True:
+            try:
+                head = await reader.readuntil(b'\r\n\r\n')
+            except (asyncio.IncompleteReadError, ConnectionError):
+                break
+            headers = dict(line.decode().split(': ', 1) for line in head.split(b'\r\n')[1:] if b': ' in line)
+            headers = {k.lower(): v for k, v in headers.items()}
+            await reader.readexactly(int(headers.get('content-length', 0)))
+            await asyncio.sleep(SERVICE_TIME)
+            session = headers.get('x-session-id', '')
+            writer.write(f"HTTP/1.1 200 OK\r\nX-Session-Id: {session}\r\nContent-Type: application/json\r\nContent-Length: 2\r\n\r\n{{}}".encode())
+            await writer.drain()
+        writer.close()
+    server = await asyncio.start_server(handle, '127.0.0.1', port)
+    async with server:
+        await server.serve_forever()
+
+#==========  USER REQUESTS  ==========
+async def request(path: str, headers: dict, body: dict) -> tuple:
+    """(status, response headers, seconds)"""
+    started = time.perf_counter()
+    reader, writer = await asyncio.open_connection('127.0.0.1', HTTP_PORT)
+    data = json.dumps(body).encode()
+    head = f"POST {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+    head += "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+    writer.write(head.encode() + b'\r\n' + data)
+    await writer.drain()
+    response_head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 60)
+    response_headers = {}
+    for line in response_head.split(b'\r\n')[1:]:
+        if b':' in line:
+            name, value = line.split(b':', 1)
+            response_headers[name.strip().lower().decode()] = value.strip().decode()
+    await asyncio.wait_for(reader.readexactly(int(response_headers.get('content-length', 0))), 60)
+    writer.close()
+    return int(response_head.split(b' ', 2)[1]), response_headers, time.perf_counter() - started
+
+async def overload() -> dict:
+    status, headers, _ = await request("/api/start", {}, {})
+    assert status == 200, status
+    session = headers['x-session-id']
+    tasks = []
+    interval = 1.0 / OFFERED_RATE
+    started = time.perf_counter()
+    for i in range(int(OFFERED_RATE * BURST)):
+        # Open loop: requests go out on schedule whatever happened to the earlier ones
+        await asyncio.sleep(max(0.0, started + i * interval - time.perf_counter()))
+        tasks.append(asyncio.create_task(request("/api/go", {"X-Session-Id": session}, {"url": "https://example.com"})))
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    served = sorted(r[2] for r in results if not isinstance(r, BaseException) and r[0] == 200)
+    retry_after = [int(r[1]['retry-after']) for r in results if not isinstance(r, BaseException) and r[0] == 429]
+    return {
+        "served": len(served),
+        "shed": len(retry_after),
+        "failed": len(results) - len(served) - len(retry_after),
+        "p50": served[len(served) // 2] if served else 0.0,
+        "p99": served[int(len(served) * 0.99)] if served else 0.0,
+        "retry_after": (min(retry_after), sorted(retry_after)[len(retry_after) // 2], max(retry_after)) if retry_after else None,
+    }
+
+#==========  PROCESSES  ==========
+def start(args: list, env: dict, log_dir: str, name: str) -> subprocess.Popen:
+    log = open(os.path.join(log_dir, f"{name}.log"), "w")
+    return subprocess.Popen([sys.executable] + args, cwd=DISPATCHER_DIR, env={**os.environ, **env}, stdout=log, stderr=subprocess.STDOUT)
+
+def wait_port(port: int, timeout: float = 10.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"nothing listening on port {port}")
+
+def run(name: str, limits: dict, log_dir: str) -> dict:
+    processes = [start([os.path.abspath(__file__), "--agent", str(AGENT_PORT)], {}, log_dir, f"agent-{name}")]
+    try:
+        processes.append(start(["DispatcherServer.py"], {
+            "DISPATCHER_HTTP_PORT": str(HTTP_PORT),
+            "DISPATCHER_CLIENT_PORT": str(CLIENT_PORT),
+            "DISPATCHER_SPOOL_DIR": os.path.join(log_dir, f"spool-{name}"),
+            **limits,
+        }, log_dir, f"dispatcher-{name}"))
+        wait_port(CLIENT_PORT)
+        processes.append(start(["DispatcherClient.py"], {"DISPATCHER_PORT": str(CLIENT_PORT), "AGENT_PORT": str(AGENT_PORT)}, log_dir, f"client-{name}"))
+        time.sleep(2)
+        return asyncio.run(overload())
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(10)
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == "--agent":
+        asyncio.run(serve_agent(int(sys.argv[2])))
+        return
+    log_dir = tempfile.mkdtemp(prefix="dispatcher-shedding-")
+    print(f"{OFFERED_RATE} requests/s for {BURST:.0f} s, {SERVICE_TIME * 1000:.0f} ms per request at the agent")
+    # Every navigation goes to example.com, per-domain politeness would hold them back too
+    no_limits = {"DISPATCHER_MAX_IN_FLIGHT": "0", "DISPATCHER_MAX_WRITE_BUFFER": "0", "DISPATCHER_MAX_CLIENT_IN_FLIGHT": "0", "DISPATCHER_MAX_CLIENT_WRITE_BUFFER": "0",
+                 "DISPATCHER_DOMAIN_RATE": "0", "DISPATCHER_DOMAIN_CONCURRENCY": "0"}
+    results = {
+        "no limits": run("unlimited", no_limits, log_dir),
+        "shedding": run("shedding", {**no_limits, "DISPATCHER_MAX_CLIENT_IN_FLIGHT": str(CLIENT_IN_FLIGHT)}, log_dir),
+    }
+    for name, r in results.items():
+        print(f"{name:>10}: served {r['served']:5d}  429 {r['shed']:5d}  failed {r['failed']:3d}  "
+              f"p50 {r['p50'] * 1000:7.0f} ms  p99 {r['p99'] * 1000:7.0f} ms  Retry-After min/median/max {r['retry_after']}")
+    assert results["shedding"]["p99"] < LATENCY_BOUND, results["shedding"]
+    print(f"p99 with shedding below {LATENCY_BOUND:.1f} s (logs in {log_dir})")
+
+if __name__ == '__main__':
+    main()
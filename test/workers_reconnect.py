@@ -0,0 +1,166 @@
+#
+# Reconnects a crawler to another worker of a multi-worker dispatcher and checks that its sessions follow it
+#
+# python workers_reconnect.py
+#
+# Starts a dispatcher with two workers and plays the crawler client itself: it connects, gets a session,
+# then reconnects (re-announcing its sessions) until SO_REUSEPORT puts it on the other worker. Requests
+# for the session must reach the crawler through either worker, also after the old connection's grace
+# period, and a destroyed session must be gone on both.
+#
+import asyncio
+import base64
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+DISPATCHER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dispatcher')
+
+HTTP_PORT, CLIENT_PORT = 8500, 8501
+WORKERS = 2
+RECONNECT_GRACE = 2.0  # SESSION_RECONNECT_GRACE of the dispatcher (seconds)
+MAX_RECONNECTS = 30
+MESSAGE_DELIMITER = b'\x00\x01\x02\x03'  # control channel preamble and terminator (protocol version 0)
+
+#==========  CRAWLER CLIENT  ==========
+class Crawler:
+    """A crawler client on the oldest control protocol: answers each http.request with its path and session"""
+    def __init__(self, client_uuid: str):
+        self.uuid = client_uuid
+        self.writer = None
+        self.task = None
+
+    async def connect(self, sessions: list) -> None:
+        reader, self.writer = await asyncio.open_connection('127.0.0.1', CLIENT_PORT)
+        self.writer.write(MESSAGE_DELIMITER)
+        self.send("dispatcher.heartbeat", {"uuid": self.uuid, "host_name": "workers-reconnect", "cpu_usage": 1.0, "memory_usage": 1.0})
+        if sessions:
+            self.send("dispatcher.sessions", {"sessions": sessions})
+        await self.writer.drain()
+        self.task = asyncio.create_task(self.serve(reader))
+
+    async def close(self) -> None:
+        self.task.cancel()
+        self.writer.close()
+        await asyncio.sleep(0.2)  # the dispatcher notices the disconnect
+
+    def send(self, msg_type: str, data, reply_to: str = None) -> None:
+        message = {"id": str(uuid.uuid4()), "type": msg_type, "data": data}
+        if reply_to:
+            message["reply"] = reply_to
+        self.writer.write(json.dumps(message).encode() + MESSAGE_DELIMITER)
+
+    async def serve(self, reader: asyncio.StreamReader) -> None:
+        while True:
+            message = json.loads((await reader.readuntil(MESSAGE_DELIMITER))[:-len(MESSAGE_DELIMITER)])
+            if message.get("type") != "http.request":
+                continue
+            head = base64.b64decode(message["data"]).split(b'\r\n\r\n', 1)[0].split(b'\r\n')
+            headers = {k.lower(): v for k, v in (line.decode().split(': ', 1) for line in head[1:] if b': ' in line)}
+            body = json.dumps({"path": head[0].split(b' ')[1].decode(), "session": headers.get('x-session-id')}).encode()
+            response = b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n' % len(body) + body
+            self.send("http.response", base64.b64encode(response).decode(), message["id"])
+            await self.writer.drain()
+
+#==========  USER REQUESTS  ==========
+async def request(path: str, headers: dict, body: dict) -> tuple:
+    """(status, reply), on a new connection so that either worker may take it"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', HTTP_PORT)
+    data = json.dumps(body).encode()
+    head = f"POST {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+    head += "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+    writer.write(head.encode() + b'\r\n' + data)
+    await writer.drain()
+    response_head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 10)
+    length = next(int(line.split(b':')[1]) for line in response_head.split(b'\r\n') if line.lower().startswith(b'content-length:'))
+    payload = await asyncio.wait_for(reader.readexactly(length), 10)
+    writer.close()
+    status = int(response_head.split(b' ', 2)[1])
+    return status, json.loads(payload) if status == 200 else payload.decode()
+
+async def check_session(session: str, tries: int = 10) -> None:
+    for _ in range(tries):
+        status, reply = await request("/api/go", {"X-Session-Id": session}, {"url": "https://example.com"})
+        assert status == 200 and reply["session"] == session, (status, reply)
+
+async def check_reconnect() -> None:
+    crawler = Crawler(str(uuid.uuid4()))
+    await crawler.connect([])
+    await asyncio.sleep(0.5)
+    # Session ids start with the worker that created them, the one holding the crawler's connection
+    status, reply = await request("/api/start", {}, {})
+    assert status == 200, (status, reply)
+    session = reply["session"]
+    first_worker = session[:2]
+    print(f"session {session} on worker {int(first_worker, 16)}")
+    live = [session]
+    for attempt in range(MAX_RECONNECTS):
+        await crawler.close()
+        await crawler.connect(live)
+        await asyncio.sleep(0.3)
+        status, reply = await request("/api/start", {}, {})
+        assert status == 200, (status, reply)
+        live.append(reply["session"])
+        if reply["session"][:2] != first_worker:
+            print(f"reconnect {attempt + 1}: crawler on worker {int(reply['session'][:2], 16)}")
+            break
+    else:
+        raise AssertionError(f"crawler stayed on worker {int(first_worker, 16)} for {MAX_RECONNECTS} reconnects")
+    await asyncio.sleep(0.3)  # the workers learn where the sessions went
+    for live_session in live:
+        await check_session(live_session)
+    print(f"{len(live)} sessions served through either worker")
+    # The old connection's grace period runs out without destroying the sessions it had
+    await asyncio.sleep(RECONNECT_GRACE + 1)
+    await check_session(session)
+    print(f"session {session} still served after the grace period")
+    status, _ = await request("/api/destroy", {"X-Session-Id": session}, {})
+    assert status == 200, status
+    await asyncio.sleep(0.3)
+    for _ in range(10):
+        status, _ = await request("/api/go", {"X-Session-Id": session}, {"url": "https://example.com"})
+        assert status == 440, status
+    print("destroyed session: 440 on both workers")
+    await crawler.close()
+
+#==========  PROCESSES  ==========
+def wait_port(port: int, timeout: float = 10.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"nothing listening on port {port}")
+
+def main():
+    log_dir = tempfile.mkdtemp(prefix="dispatcher-workers-")
+    log = open(os.path.join(log_dir, "dispatcher.log"), "w")
+    # In a session of its own, to stop the worker processes along with it
+    process = subprocess.Popen([sys.executable, "DispatcherServer.py"], cwd=DISPATCHER_DIR, stdout=log, stderr=subprocess.STDOUT, start_new_session=True, env={
+        **os.environ,
+        "DISPATCHER_WORKERS": str(WORKERS),
+        "DISPATCHER_HTTP_PORT": str(HTTP_PORT),
+        "DISPATCHER_CLIENT_PORT": str(CLIENT_PORT),
+        "DISPATCHER_SOCKET_DIR": log_dir,
+        "DISPATCHER_SPOOL_DIR": os.path.join(log_dir, "spool"),
+        "SESSION_RECONNECT_GRACE": str(RECONNECT_GRACE),
+    })
+    try:
+        wait_port(CLIENT_PORT)
+        time.sleep(1)  # both workers listening
+        asyncio.run(check_reconnect())
+        print(f"workers reconnect OK (logs in {log_dir})")
+    finally:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(10)
+
+if __name__ == '__main__':
+    main()